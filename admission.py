@@ -0,0 +1,173 @@
+# admission.py
+import socket
+import logging
+import threading
+import time
+from collections import Counter
+
+DEFAULT_MAX_CONNECTIONS = 512
+DEFAULT_MAX_CONNECTIONS_PER_IP = 32
+DEFAULT_HEADER_TIMEOUT = 10.0   # seconds to send a request line and headers once started
+DEFAULT_BODY_TIMEOUT = 60.0     # seconds a body read or write may stall
+DEFAULT_MIN_RATE = 4 * 1024     # bytes per second a transfer must sustain
+MIN_RATE_GRACE = 10.0           # seconds added to every step's budget
+RETRY_AFTER = 5                 # seconds suggested to rejected clients
+WATCHDOG_INTERVAL = 0.25
+
+def busy_response(reason, retry_after=RETRY_AFTER):
+    """Raw 503 reply for a connection turned away before a handler sees it"""
+    body = f"Server busy ({reason}), retry in {retry_after}s\n".encode()
+    return (b"HTTP/1.1 503 Service Unavailable\r\n"
+            b"Retry-After: %d\r\n"
+            b"Content-Type: text/plain; charset=utf-8\r\n"
+            b"Content-Length: %d\r\n"
+            b"Connection: close\r\n\r\n" % (retry_after, len(body))) + body
+
+class AdmissionControl:
+    """
+    Global and per-IP caps on open HTTP connections, plus the counters that
+    show whether they are sized right: rejections by reason and timeouts by
+    kind. The engine reports its own queue depth in stats().
+    """
+
+    def __init__(self, max_connections=DEFAULT_MAX_CONNECTIONS,
+                 max_connections_per_ip=DEFAULT_MAX_CONNECTIONS_PER_IP,
+                 header_timeout=DEFAULT_HEADER_TIMEOUT, body_timeout=DEFAULT_BODY_TIMEOUT,
+                 min_rate=DEFAULT_MIN_RATE, retry_after=RETRY_AFTER):
+        self.max_connections = max_connections
+        self.max_connections_per_ip = max_connections_per_ip
+        self.header_timeout = header_timeout
+        self.body_timeout = body_timeout
+        self.min_rate = min_rate
+        self.retry_after = retry_after
+        self.connections = 0
+        self.per_ip = Counter()
+        self.rejected = Counter()
+        self.timeouts = Counter()
+        self._lock = threading.Lock()
+
+    def admit(self, ip):
+        """Count a new connection; returns the reason to refuse it, or None"""
+        with self._lock:
+            if self.max_connections and self.connections >= self.max_connections:
+                reason = "connection limit"
+            elif self.max_connections_per_ip and self.per_ip[ip] >= self.max_connections_per_ip:
+                reason = "per-IP connection limit"
+            else:
+                self.connections += 1
+                self.per_ip[ip] += 1
+                return None
+            self.rejected[reason] += 1
+        return reason
+
+    def release(self, ip):
+        with self._lock:
+            self.connections -= 1
+            self.per_ip[ip] -= 1
+            if self.per_ip[ip] <= 0:
+                del self.per_ip[ip]
+
+    def reject(self, ip, reason):
+        """Undo admit() for a connection that is refused afterwards, e.g. on a full queue"""
+        self.release(ip)
+        with self._lock:
+            self.rejected[reason] += 1
+
+    def timed_out(self, kind):
+        with self._lock:
+            self.timeouts[kind] += 1
+
+    def step_timeout(self, n):
+        """Seconds a transfer may take to move its next n bytes"""
+        if self.min_rate:
+            return MIN_RATE_GRACE + n / self.min_rate
+        return self.body_timeout
+
+    def stats(self, **extra):
+        with self._lock:
+            result = {
+                "connections": self.connections,
+                "clients": len(self.per_ip),
+                "max_connections": self.max_connections,
+                "max_connections_per_ip": self.max_connections_per_ip,
+                "rejected": dict(self.rejected),
+                "timeouts": dict(self.timeouts),
+            }
+        result.update(extra)
+        return result
+
+class Watchdog:
+    """
+    Thread that shuts down sockets whose deadline has passed, so a worker
+    blocked on a slowloris client or a stalled transfer gets its socket
+    back as an error. Deadlines are per socket; arming again replaces the
+    previous one.
+    """
+
+    def __init__(self, admission, interval=WATCHDOG_INTERVAL):
+        self.admission = admission
+        self.interval = interval
+        self._deadlines = {}  # socket -> (deadline, kind)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="http-watchdog", daemon=True)
+        self._thread.start()
+
+    def arm(self, sock, seconds, kind):
+        deadline = time.monotonic() + seconds
+        with self._lock:
+            self._deadlines[sock] = (deadline, kind)
+
+    def disarm(self, sock):
+        with self._lock:
+            self._deadlines.pop(sock, None)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            with self._lock:
+                # A scan per tick is cheap at the connection counts we cap at
+                expired = [(sock, kind) for sock, (deadline, kind) in self._deadlines.items()
+                           if deadline <= now]
+                for sock, _ in expired:
+                    del self._deadlines[sock]
+            for sock, kind in expired:
+                self.admission.timed_out(kind)
+                logging.info(f"Dropping HTTP connection: {kind} timeout")
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def stop(self):
+        self._stop.set()
+
+class GuardedFlow:
+    """
+    A bandwidth Flow that also enforces the minimum transfer rate: every
+    throttle(n) arms the watchdog with the time n bytes may take, so a
+    client that trickles data loses the connection instead of a worker.
+    """
+
+    def __init__(self, flow, watchdog, sock):
+        self.flow = flow
+        self.watchdog = watchdog
+        self.sock = sock
+
+    def __bool__(self):
+        return True
+
+    def throttle(self, n):
+        if self.flow:
+            self.flow.throttle(n)
+        self.watchdog.arm(self.sock, self.watchdog.admission.step_timeout(n), "transfer")
+
+    def close(self):
+        self.watchdog.disarm(self.sock)
+        self.flow.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
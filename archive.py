@@ -0,0 +1,272 @@
+# archive.py
+import os
+import stat
+import time
+import zlib
+import struct
+import logging
+import tarfile
+from urllib.parse import quote
+from paths import translate_path, guess_type
+from compression import is_compressible
+from uploads import is_temp_upload
+
+ARCHIVE_FORMATS = {
+    "zip": "application/zip",
+    "tar": "application/x-tar",
+}
+ARCHIVE_READ_SIZE = 256 * 1024   # bytes read from a member file at a time
+ARCHIVE_CHUNK_SIZE = 256 * 1024  # output is handed out in pieces of about this size
+ZIP_DEFLATE_LEVEL = 6
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_MAX_ENTRIES = 0xFFFF
+_ZIP_STORED, _ZIP_DEFLATED = 0, 8
+_ZIP_FLAGS = 0x08 | 0x800  # sizes and CRC in a data descriptor, UTF-8 names
+_ZIP_MADE_BY = 45 | (3 << 8)  # ZIP64-capable, Unix attributes
+
+def archive_sources(directory, path, url_path, names=()):
+    """
+    (sources, archive name) for downloading the folder 'path': the folder
+    itself, or only the entries 'names' picked in it. Picked names go through
+    translate_path() like any other request, so the same traversal checks
+    apply; they must be plain entry names of the folder.
+    """
+    title = os.path.basename(os.path.normpath(path)) or "download"
+    if not names:
+        return [(path, title)], title
+    sources = []
+    for name in dict.fromkeys(names):
+        if not name or '/' in name or name in (os.curdir, os.pardir):
+            raise ValueError(f"Invalid file name: {name!r}")
+        full_path = translate_path(directory, url_path + quote(name))
+        if not os.path.lexists(full_path):
+            raise FileNotFoundError(name)
+        sources.append((full_path, name))
+    return sources, title
+
+def walk_members(directory, sources, hidden=()):
+    """
+    Yield (path, name, stat) for each (path, name) source and, for folders,
+    everything under it in name order. Symlinks are followed only while they
+    stay inside 'directory', and each folder is visited once.
+    """
+    root = os.path.realpath(directory)
+    seen = set()
+    stack = list(reversed(sources))
+    while stack:
+        path, name = stack.pop()
+        try:
+            st = os.lstat(path)
+            if stat.S_ISLNK(st.st_mode):
+                real_path = os.path.realpath(path)
+                if real_path != root and not real_path.startswith(root + os.sep):
+                    logging.debug(f"Not archiving {path}: links outside the shared folder")
+                    continue
+                st = os.stat(path)
+        except OSError:
+            continue  # vanished or unreadable since it was listed
+        if stat.S_ISDIR(st.st_mode):
+            if (st.st_dev, st.st_ino) in seen:
+                continue
+            seen.add((st.st_dev, st.st_ino))
+            yield path, name + '/', st
+            try:
+                with os.scandir(path) as it:
+                    children = sorted(entry.name for entry in it
+                                      if entry.name not in hidden and not is_temp_upload(entry.name))
+            except OSError:
+                continue
+            stack.extend((os.path.join(path, child), f"{name}/{child}") for child in reversed(children))
+        elif stat.S_ISREG(st.st_mode):
+            yield path, name, st
+
+def stream_archive(fmt, members):
+    """
+    Build a "zip" or "tar" archive of 'members' (from walk_members())
+    while it is being sent: yields the archive in pieces, reading each file
+    in ARCHIVE_READ_SIZE steps, so memory use doesn't grow with file sizes.
+    """
+    writer = ZipStream() if fmt == "zip" else TarStream()
+    for path, name, st in members:
+        yield from writer.add(path, name, st)
+    yield from writer.close()
+
+def content_disposition(filename):
+    """Content-Disposition for a download, with an ASCII fallback name for old clients"""
+    fallback = filename.encode("ascii", "replace").decode("ascii").replace('"', "'").replace('\\', '_')
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
+
+class _ArchiveStream:
+    """Output buffer shared by the writers; 'offset' counts every byte written"""
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.offset = 0
+
+    def write(self, data):
+        self.buf += data
+        self.offset += len(data)
+
+    def take(self, at_least=ARCHIVE_CHUNK_SIZE):
+        """Yield the buffered output once there is enough of it"""
+        if self.buf and len(self.buf) >= at_least:
+            data = bytes(self.buf)
+            self.buf.clear()
+            yield data
+
+    def open(self, path, name):
+        try:
+            return open(path, 'rb')
+        except OSError as e:
+            logging.warning(f"Skipping {name} in archive: {e}")
+            return None
+
+    def read_chunks(self, f, size):
+        """Chunks of f's first 'size' bytes; a file that grew since stat() is cut off there"""
+        while size > 0:
+            chunk = f.read(min(ARCHIVE_READ_SIZE, size))
+            if not chunk:
+                break
+            size -= len(chunk)
+            yield chunk
+
+class ZipStream(_ArchiveStream):
+    """
+    ZIP writer for an output that can't seek back: each member's CRC and
+    sizes follow its data in a data descriptor. Files that are compressed
+    already (by type, or too small to gain) are stored, the rest deflated.
+    ZIP64 records are used for members and archives past the 4GB and 65535
+    entry limits. Only the central directory grows, by one record per member.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.entries = []
+
+    def add(self, path, name, st):
+        encoded = name.encode("utf-8", "surrogateescape")
+        dos_time, dos_date = _dos_datetime(st.st_mtime)
+        offset = self.offset
+        if stat.S_ISDIR(st.st_mode):
+            self.write(struct.pack("<IHHHHHIIIHH", 0x04034b50, 20, 0x800, _ZIP_STORED, dos_time,
+                                   dos_date, 0, 0, 0, len(encoded), 0) + encoded)
+            self.entries.append((encoded, 0x800, _ZIP_STORED, dos_time, dos_date, 0, 0, 0,
+                                 (st.st_mode << 16) | 0x10, offset))
+            yield from self.take()
+            return
+
+        f = self.open(path, name)
+        if f is None:
+            return
+        with f:
+            method = _ZIP_DEFLATED if is_compressible(guess_type(name), st.st_size) else _ZIP_STORED
+            zip64 = st.st_size * 1.05 > ZIP64_LIMIT
+            extra = struct.pack("<HHQQ", 1, 16, 0, 0) if zip64 else b''
+            size_field = ZIP64_LIMIT if zip64 else 0
+            self.write(struct.pack("<IHHHHHIIIHH", 0x04034b50, 45 if zip64 else 20, _ZIP_FLAGS, method,
+                                   dos_time, dos_date, 0, size_field, size_field, len(encoded),
+                                   len(extra)) + encoded + extra)
+
+            compressor = zlib.compressobj(ZIP_DEFLATE_LEVEL, zlib.DEFLATED, -15) if method else None
+            crc = size = compressed = 0
+            for chunk in self.read_chunks(f, st.st_size):
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                if compressor:
+                    chunk = compressor.compress(chunk)
+                compressed += len(chunk)
+                self.write(chunk)
+                yield from self.take()
+            if compressor:
+                tail = compressor.flush()
+                compressed += len(tail)
+                self.write(tail)
+
+        if zip64:
+            self.write(struct.pack("<IIQQ", 0x08074b50, crc, compressed, size))
+        else:
+            self.write(struct.pack("<IIII", 0x08074b50, crc, compressed, size))
+        self.entries.append((encoded, _ZIP_FLAGS, method, dos_time, dos_date, crc, compressed, size,
+                             st.st_mode << 16, offset))
+        yield from self.take()
+
+    def close(self):
+        """Write the central directory and the end records"""
+        start = self.offset
+        for encoded, flags, method, dos_time, dos_date, crc, compressed, size, attrs, offset in self.entries:
+            large = [value for value in (size, compressed, offset) if value >= ZIP64_LIMIT]
+            extra = struct.pack("<HH", 1, 8 * len(large)) + struct.pack(f"<{len(large)}Q", *large) if large else b''
+            self.write(struct.pack("<IHHHHHHIIIHHHHHII", 0x02014b50, _ZIP_MADE_BY, 45 if large else 20,
+                                   flags, method, dos_time, dos_date, crc, min(compressed, ZIP64_LIMIT),
+                                   min(size, ZIP64_LIMIT), len(encoded), len(extra), 0, 0, 0, attrs,
+                                   min(offset, ZIP64_LIMIT)) + encoded + extra)
+            yield from self.take()
+        count = len(self.entries)
+        cd_size = self.offset - start
+        if count >= ZIP_MAX_ENTRIES or cd_size >= ZIP64_LIMIT or start >= ZIP64_LIMIT:
+            end64 = self.offset
+            self.write(struct.pack("<IQHHIIQQQQ", 0x06064b50, 44, _ZIP_MADE_BY, 45, 0, 0,
+                                   count, count, cd_size, start))
+            self.write(struct.pack("<IIQI", 0x07064b50, 0, end64, 1))
+        self.write(struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, min(count, ZIP_MAX_ENTRIES),
+                               min(count, ZIP_MAX_ENTRIES), min(cd_size, ZIP64_LIMIT),
+                               min(start, ZIP64_LIMIT), 0))
+        yield from self.take(at_least=1)
+
+class TarStream(_ArchiveStream):
+    """
+    POSIX (pax) tar writer: headers come from tarfile, member data is
+    streamed behind them, so memory use is constant however many files
+    there are. Sizes are taken from stat(); a file that shrinks meanwhile
+    is padded with zeros to keep the archive readable.
+    """
+
+    def add(self, path, name, st):
+        info = tarfile.TarInfo(name)
+        info.mtime = int(st.st_mtime)
+        info.mode = stat.S_IMODE(st.st_mode)
+        if stat.S_ISDIR(st.st_mode):
+            info.type = tarfile.DIRTYPE
+            self.write(info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape"))
+            yield from self.take()
+            return
+
+        f = self.open(path, name)
+        if f is None:
+            return
+        with f:
+            info.size = st.st_size
+            self.write(info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape"))
+            remaining = info.size
+            for chunk in self.read_chunks(f, info.size):
+                remaining -= len(chunk)
+                self.write(chunk)
+                yield from self.take()
+        if remaining:
+            logging.warning(f"{name} shrank while being archived; padded with zeros")
+            self._pad(remaining)
+        self._pad(-info.size % tarfile.BLOCKSIZE)
+        yield from self.take()
+
+    def close(self):
+        """End-of-archive blocks, padded to a whole record like tarfile writes"""
+        self._pad(2 * tarfile.BLOCKSIZE)
+        self._pad(-self.offset % tarfile.RECORDSIZE)
+        yield from self.take(at_least=1)
+
+    def _pad(self, n):
+        while n > 0:
+            step = min(n, ARCHIVE_READ_SIZE)
+            self.write(bytes(step))
+            n -= step
+
+def _dos_datetime(mtime):
+    """MS-DOS (time, date) fields, clamped to the years they can hold"""
+    t = time.localtime(mtime)
+    year = min(max(t.tm_year, 1980), 2107)
+    if year != t.tm_year:
+        return (0, 1 | (1 << 5) | ((year - 1980) << 9)) if year == 1980 else (
+            (23 << 11) | (59 << 5) | 29, 31 | (12 << 5) | ((year - 1980) << 9))
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            t.tm_mday | (t.tm_mon << 5) | ((year - 1980) << 9))
@@ -0,0 +1,596 @@
+# assets.py
+import hashlib
+from compression import compress_bytes, PREFERENCE
+
+STATIC_PREFIX = "/static/"
+STATIC_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+APP_CSS = r"""
+/* A small stand-in for the parts of Bootstrap 5 the pages use, so they
+   render without reaching a CDN */
+*, *::before, *::after { box-sizing: border-box; }
+body {
+    margin: 0;
+    font-family: system-ui, -apple-system, "Segoe UI", Roboto, "Helvetica Neue", Arial, sans-serif;
+    font-size: 1rem;
+    line-height: 1.5;
+    color: #212529;
+    background-color: #fff;
+}
+h1 { font-size: calc(1.375rem + 1.5vw); font-weight: 500; line-height: 1.2; margin-top: 0; }
+@media (min-width: 1200px) { h1 { font-size: 2.5rem; } }
+a { color: #0d6efd; }
+a:hover { color: #0a58ca; }
+.container { width: 100%; margin: 0 auto; padding: 0 .75rem; }
+@media (min-width: 576px) { .container { max-width: 540px; } }
+@media (min-width: 768px) { .container { max-width: 720px; } }
+@media (min-width: 992px) { .container { max-width: 960px; } }
+@media (min-width: 1200px) { .container { max-width: 1140px; } }
+@media (min-width: 1400px) { .container { max-width: 1320px; } }
+
+.btn {
+    display: inline-block;
+    padding: .375rem .75rem;
+    font: inherit;
+    line-height: 1.5;
+    text-align: center;
+    text-decoration: none;
+    vertical-align: middle;
+    cursor: pointer;
+    border: 1px solid transparent;
+    border-radius: .375rem;
+    background-color: transparent;
+    transition: color .15s, background-color .15s, border-color .15s;
+}
+.btn:disabled { opacity: .65; pointer-events: none; }
+.btn-primary { color: #fff; background-color: #0d6efd; border-color: #0d6efd; }
+.btn-primary:hover { color: #fff; background-color: #0b5ed7; border-color: #0a58ca; }
+.btn-success { color: #fff; background-color: #198754; border-color: #198754; }
+.btn-success:hover { color: #fff; background-color: #157347; border-color: #146c43; }
+.btn-outline-secondary { color: #6c757d; border-color: #6c757d; }
+.btn-outline-secondary:hover { color: #fff; background-color: #6c757d; }
+
+.table { width: 100%; margin-bottom: 1rem; border-collapse: collapse; vertical-align: top; }
+.table > :not(caption) > * > * { padding: .5rem; border-bottom: 1px solid #dee2e6; text-align: left; }
+.table-light > tr > th { background-color: #f8f9fa; }
+.table-hover tbody tr:hover { background-color: rgba(13, 110, 253, 0.05); }
+
+.pagination { display: flex; padding-left: 0; list-style: none; }
+.page-link {
+    display: block;
+    padding: .375rem .75rem;
+    margin-left: -1px;
+    color: #0d6efd;
+    text-decoration: none;
+    border: 1px solid #dee2e6;
+}
+.page-item:first-child .page-link { border-radius: .375rem 0 0 .375rem; }
+.page-item:last-child .page-link { border-radius: 0 .375rem .375rem 0; }
+.page-item.active .page-link { color: #fff; background-color: #0d6efd; border-color: #0d6efd; }
+.page-item.disabled .page-link { color: #6c757d; pointer-events: none; }
+
+.card { border: 1px solid rgba(0, 0, 0, .175); border-radius: .375rem; }
+.card-body { padding: 1rem; }
+.progress { display: flex; overflow: hidden; background-color: #e9ecef; border-radius: .375rem; font-size: .75rem; }
+.progress-bar {
+    display: flex;
+    flex-direction: column;
+    justify-content: center;
+    color: #fff;
+    text-align: center;
+    white-space: nowrap;
+    background-color: #0d6efd;
+    transition: width .6s ease;
+}
+.form-check-input { width: 1em; height: 1em; vertical-align: -.125em; }
+.form-control {
+    display: block;
+    width: 100%;
+    padding: .375rem .75rem;
+    font: inherit;
+    line-height: 1.5;
+    color: #212529;
+    background-color: #fff;
+    border: 1px solid #dee2e6;
+    border-radius: .375rem;
+}
+.form-control:focus { border-color: #86b7fe; outline: 0; box-shadow: 0 0 0 .25rem rgba(13, 110, 253, .25); }
+
+.bg-success { background-color: #198754 !important; }
+.bg-danger { background-color: #dc3545 !important; }
+.d-none { display: none !important; }
+.d-flex { display: flex !important; }
+.flex-wrap { flex-wrap: wrap !important; }
+.flex-grow-1 { flex-grow: 1 !important; }
+.gap-2 { gap: .5rem !important; }
+.justify-content-between { justify-content: space-between !important; }
+.align-items-center { align-items: center !important; }
+.w-50 { width: 50% !important; }
+.my-4 { margin-top: 1.5rem !important; margin-bottom: 1.5rem !important; }
+.mb-4 { margin-bottom: 1.5rem !important; }
+.mt-3 { margin-top: 1rem !important; }
+.mt-4 { margin-top: 1.5rem !important; }
+.mx-3 { margin-left: 1rem !important; margin-right: 1rem !important; }
+.me-2 { margin-right: .5rem !important; }
+.fs-1 { font-size: 2.5rem !important; }
+.text-muted { color: #6c757d !important; }
+.text-reset { color: inherit !important; }
+.text-decoration-none { text-decoration: none !important; }
+
+/* Icons as plain characters instead of an icon font */
+.bi { display: inline-block; font-style: normal; line-height: 1; }
+.bi-upload::before { content: "\2B06\FE0E"; }
+.bi-cloud-upload::before { content: "\2601\FE0E"; }
+.bi-arrow-clockwise::before { content: "\21BB"; }
+.bi-arrow-left::before { content: "\2190"; }
+.bi-arrow-90deg-up::before { content: "\21B0"; }
+.bi-file-earmark::before { content: "\1F4C4"; }
+.bi-file-earmark-arrow-up::before { content: "\1F4E4"; }
+.bi-file-earmark-zip::before { content: "\1F5DC\FE0F"; }
+.bi-archive::before { content: "\1F5C4\FE0F"; }
+.bi-folder::before { content: "\1F4C1"; }
+.bi-search::before { content: "\1F50D\FE0E"; }
+.bi-caret-up-fill::before { content: "\25B2"; font-size: .7em; }
+.bi-caret-down-fill::before { content: "\25BC"; font-size: .7em; }
+
+.drop-zone {
+    border: 2px dashed #ccc;
+    border-radius: 8px;
+    padding: 3rem;
+    text-align: center;
+    transition: all 0.3s;
+}
+.drop-zone.dragover {
+    border-color: #0d6efd;
+    background-color: rgba(13, 110, 253, 0.05);
+}
+.drop-zone-label {
+    cursor: pointer;
+}
+.file-item {
+    padding: 1rem;
+    border-bottom: 1px solid #eee;
+}
+.progress {
+    height: 25px;
+    margin-top: 5px;
+}
+"""
+
+UPLOADER_JS = r"""
+let filesToUpload = [];
+
+// Drag & drop handlers (the script is in <head>, so wait for the body)
+document.addEventListener('DOMContentLoaded', () => {
+    const dropZone = document.getElementById('drop-zone');
+
+    dropZone.addEventListener('dragover', (e) => {
+        e.preventDefault();
+        dropZone.classList.add('dragover');
+    });
+
+    dropZone.addEventListener('dragleave', () => {
+        dropZone.classList.remove('dragover');
+    });
+
+    dropZone.addEventListener('drop', (e) => {
+        e.preventDefault();
+        dropZone.classList.remove('dragover');
+        handleFiles(e.dataTransfer.files);
+    });
+});
+
+function handleFiles(files) {
+    for (let file of files) {
+        addFileToList(file);
+    }
+    document.getElementById('start-upload').classList.remove('d-none');
+}
+
+function addFileToList(file) {
+    const fileItem = document.createElement('div');
+    fileItem.className = 'file-item';
+    fileItem.innerHTML = `
+        <div class="d-flex justify-content-between align-items-center">
+            <div>
+                <i class="bi bi-file-earmark"></i> 
+                ${file.name} (${formatSize(file.size)})
+            </div>
+            <div class="w-50 mx-3">
+                <div class="progress">
+                    <div class="progress-bar" role="progressbar" 
+                         style="width: 0%" aria-valuenow="0" 
+                         aria-valuemin="0" aria-valuemax="100">
+                    </div>
+                </div>
+            </div>
+        </div>
+    `;
+    document.getElementById('upload-list').appendChild(fileItem);
+    filesToUpload.push(file);
+}
+
+// Files are sent as resumable upload sessions: chunks go up in
+// parallel, failed chunks are retried, and re-selecting the same
+// file after a reload only sends the ranges the server is missing.
+// Large selections pack their small files into tar batches that the
+// server extracts as they arrive, one request per batch.
+const PARALLEL_CHUNKS = 3;
+const MAX_RETRIES = 5;
+const PARALLEL_UPLOADS = 4;                 // files or batches in flight at once
+const BULK_MIN_FILES = 20;                  // selections this large use tar batches
+const BULK_MAX_FILE_SIZE = 8 * 1024 * 1024; // bigger files still go one by one
+const BULK_BATCH_SIZE = 64 * 1024 * 1024;
+const BULK_BATCH_FILES = 1000;
+const HASH_MIN_SIZE = 64 * 1024 * 1024;     // smaller files are sent faster than they are hashed
+const HASH_READ_SIZE = 4 * 1024 * 1024;
+
+async function startUpload() {
+    const uploadBtn = document.getElementById('start-upload');
+    uploadBtn.disabled = true;
+    uploadBtn.innerHTML = `<i class="bi bi-upload"></i> Uploading...`;
+
+    const bars = document.querySelectorAll('.progress-bar');
+    const items = filesToUpload.map((file, i) => ({file: file, bar: bars[i], done: false}));
+    const pending = items.filter(item => !item.bar.classList.contains('bg-success'));
+    const bulk = pending.length >= BULK_MIN_FILES;
+    const tasks = [];
+    let batch = [], batchSize = 0;
+    for (const item of pending) {
+        item.bar.classList.remove('bg-danger');
+        if (!bulk || item.file.size > BULK_MAX_FILE_SIZE) {
+            tasks.push(() => uploadFile(item));
+            continue;
+        }
+        if (batch.length >= BULK_BATCH_FILES || (batch.length && batchSize + item.file.size > BULK_BATCH_SIZE)) {
+            tasks.push(uploadBatch.bind(null, batch));
+            batch = [];
+            batchSize = 0;
+        }
+        batch.push(item);
+        batchSize += item.file.size;
+    }
+    if (batch.length) tasks.push(uploadBatch.bind(null, batch));
+    await runLimited(tasks, PARALLEL_UPLOADS);
+
+    // Redirect when all files complete
+    if (items.every(item => item.done || item.bar.classList.contains('bg-success'))) {
+        setTimeout(() => window.location.href = '/', 1000);
+    } else {
+        uploadBtn.disabled = false;
+        uploadBtn.innerHTML = `<i class="bi bi-arrow-clockwise"></i> Resume Upload`;
+    }
+}
+
+async function runLimited(tasks, limit) {
+    const queue = tasks.slice();
+    const worker = async () => {
+        while (queue.length) await queue.shift()();
+    };
+    await Promise.all(Array.from({length: Math.min(limit, queue.length)}, worker));
+}
+
+function finishItem(item, ok) {
+    item.done = ok;
+    item.bar.classList.add(ok ? 'bg-success' : 'bg-danger');
+    if (ok) setProgress(item.bar, 100);
+    item.bar.textContent = ok ? 'Done!' : 'Error!';
+}
+
+async function uploadFile(item) {
+    try {
+        await uploadResumable(item.file, item.bar);
+        finishItem(item, true);
+    } catch (err) {
+        finishItem(item, false);
+    }
+}
+
+async function uploadBatch(batch) {
+    try {
+        const summary = await postTar(batch);
+        const skipped = new Set(summary.skipped.map(entry => entry.name));
+        for (const item of batch) finishItem(item, !skipped.has(item.file.name));
+    } catch (err) {
+        for (const item of batch) finishItem(item, false);
+    }
+}
+
+function postTar(batch) {
+    const total = batch.reduce((sum, item) => sum + item.file.size, 0);
+    return new Promise((resolve, reject) => {
+        const xhr = new XMLHttpRequest();
+        xhr.upload.addEventListener('progress', (e) => {
+            // Members go in order, so fill the bars one after another
+            let sent = e.total ? total * e.loaded / e.total : 0;
+            for (const item of batch) {
+                const part = Math.min(sent, item.file.size);
+                setProgress(item.bar, item.file.size ? (part / item.file.size) * 100 : 100);
+                sent -= part;
+            }
+        });
+        xhr.open('POST', '/upload/tar', true);
+        xhr.setRequestHeader('Content-Type', 'application/x-tar');
+        xhr.onload = () => xhr.status === 200 ? resolve(JSON.parse(xhr.responseText)) : reject(new Error(xhr.status));
+        xhr.onerror = () => reject(new Error('network error'));
+        xhr.send(tarBlob(batch.map(item => item.file)));
+    });
+}
+
+// ustar archive of the files as a Blob; the file contents are not
+// copied, the browser reads them from disk while sending
+const encoder = new TextEncoder();
+
+function tarBlob(files) {
+    const parts = [];
+    const pad = (size) => {
+        if (size % 512) parts.push(new Uint8Array(512 - size % 512));
+    };
+    for (const file of files) {
+        const mtime = Math.floor(file.lastModified / 1000);
+        if (encoder.encode(file.name).length > 100) {
+            const pax = encoder.encode(paxRecord('path', file.name));
+            parts.push(tarHeader('PaxHeader', pax.length, mtime, 'x'), pax);
+            pad(pax.length);
+        }
+        parts.push(tarHeader(file.name, file.size, mtime, '0'), file);
+        pad(file.size);
+    }
+    parts.push(new Uint8Array(1024));
+    return new Blob(parts, {type: 'application/x-tar'});
+}
+
+function tarHeader(name, size, mtime, type) {
+    const block = new Uint8Array(512);
+    const put = (text, offset, length) => block.set(encoder.encode(text).subarray(0, length), offset);
+    const octal = (n, length) => n.toString(8).padStart(length - 1, '0');
+    put(name, 0, 100);
+    put(octal(0o644, 8), 100, 8);
+    put(octal(0, 8), 108, 8);
+    put(octal(0, 8), 116, 8);
+    put(octal(size, 12), 124, 12);
+    put(octal(mtime, 12), 136, 12);
+    put('        ', 148, 8);
+    put(type, 156, 1);
+    put('ustar\0' + '00', 257, 8);
+    const sum = block.reduce((a, b) => a + b, 0);
+    put(octal(sum, 7) + '\0', 148, 8);
+    return block;
+}
+
+function paxRecord(key, value) {
+    // "<length> key=value\n", where the length counts its own digits
+    const size = encoder.encode(` ${key}=${value}\n`).length;
+    let length = size + String(size).length;
+    length = size + String(length).length;
+    return `${length} ${key}=${value}\n`;
+}
+
+async function uploadResumable(file, progressBar) {
+    const key = `${file.name}:${file.size}:${file.lastModified}`;
+    const session = await requestJSON('POST', '/upload/sessions',
+        JSON.stringify({name: file.name, size: file.size, key: key}));
+    const pending = missingChunks(session.received, file.size, session.chunk_size);
+    const inflight = {};
+    let done = session.received_bytes;
+
+    // Large files are hashed while they upload: if the server already has
+    // the content, it stores the file from there and the rest isn't sent
+    let finished = false, skipped = false;
+    if (session.hash_upload && file.size >= HASH_MIN_SIZE && pending.length) {
+        hashFirst(file, () => finished).then((stored) => {
+            if (stored && !finished) {
+                skipped = true;
+                pending.length = 0;
+            }
+        }, () => {});
+    }
+
+    const update = () => {
+        let sent = done;
+        for (const loaded of Object.values(inflight)) sent += loaded;
+        setProgress(progressBar, file.size ? (sent / file.size) * 100 : 100);
+    };
+    update();
+
+    async function worker() {
+        while (pending.length) {
+            const [start, end] = pending.shift();
+            for (let attempt = 0; ; attempt++) {
+                try {
+                    await putChunk(session.id, file.slice(start, end), start, (loaded) => {
+                        inflight[start] = loaded;
+                        update();
+                    });
+                    break;
+                } catch (err) {
+                    delete inflight[start];
+                    if (attempt >= MAX_RETRIES) throw err;
+                    await new Promise(r => setTimeout(r, 1000 * 2 ** attempt));
+                }
+            }
+            delete inflight[start];
+            done += end - start;
+            update();
+        }
+    }
+    await Promise.all(Array.from({length: PARALLEL_CHUNKS}, worker));
+    finished = true;
+    if (skipped) {
+        await fetch(`/upload/sessions/${session.id}`, {method: 'DELETE'});
+        return;
+    }
+    await requestJSON('POST', `/upload/sessions/${session.id}/complete`);
+}
+
+async function hashFirst(file, cancelled) {
+    const hash = new Sha256();
+    for (let pos = 0; pos < file.size; pos += HASH_READ_SIZE) {
+        if (cancelled()) return false;
+        hash.update(new Uint8Array(await file.slice(pos, pos + HASH_READ_SIZE).arrayBuffer()));
+    }
+    if (cancelled()) return false;
+    const response = await fetch('/upload/hash', {method: 'POST',
+        body: JSON.stringify({name: file.name, size: file.size, sha256: hash.hex()}),
+        headers: {'Content-Type': 'application/json'}});
+    return response.ok;
+}
+
+// Incremental SHA-256; crypto.subtle only hashes whole buffers, and
+// browsers offer it on https and localhost pages only
+const SHA256_K = new Int32Array([
+    0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+    0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+    0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+    0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+    0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+    0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+    0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+    0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2]);
+
+class Sha256 {
+    constructor() {
+        this.h = new Int32Array([0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a,
+                                  0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19]);
+        this.w = new Int32Array(64);  // signed, so the arithmetic stays in small integers
+        this.buffer = new Uint8Array(64);
+        this.buffered = 0;
+        this.length = 0;
+    }
+
+    update(data) {
+        this.length += data.length;
+        let pos = 0;
+        if (this.buffered) {
+            pos = Math.min(64 - this.buffered, data.length);
+            this.buffer.set(data.subarray(0, pos), this.buffered);
+            this.buffered += pos;
+            if (this.buffered < 64) return;
+            this.block(this.buffer, 0);
+            this.buffered = 0;
+        }
+        for (; pos + 64 <= data.length; pos += 64) this.block(data, pos);
+        this.buffer.set(data.subarray(pos), 0);
+        this.buffered = data.length - pos;
+    }
+
+    block(data, offset) {
+        const w = this.w, h = this.h;
+        for (let i = 0; i < 16; i++, offset += 4) {
+            w[i] = (data[offset] << 24) | (data[offset + 1] << 16) | (data[offset + 2] << 8) | data[offset + 3];
+        }
+        for (let i = 16; i < 64; i++) {
+            const x = w[i - 15], y = w[i - 2];
+            const s0 = ((x >>> 7) | (x << 25)) ^ ((x >>> 18) | (x << 14)) ^ (x >>> 3);
+            const s1 = ((y >>> 17) | (y << 15)) ^ ((y >>> 19) | (y << 13)) ^ (y >>> 10);
+            w[i] = (w[i - 16] + s0 + w[i - 7] + s1) | 0;
+        }
+        let a = h[0], b = h[1], c = h[2], d = h[3], e = h[4], f = h[5], g = h[6], k = h[7];
+        for (let i = 0; i < 64; i++) {
+            const S1 = ((e >>> 6) | (e << 26)) ^ ((e >>> 11) | (e << 21)) ^ ((e >>> 25) | (e << 7));
+            const t1 = (k + S1 + ((e & f) ^ (~e & g)) + SHA256_K[i] + w[i]) | 0;
+            const S0 = ((a >>> 2) | (a << 30)) ^ ((a >>> 13) | (a << 19)) ^ ((a >>> 22) | (a << 10));
+            const t2 = (S0 + ((a & b) ^ (a & c) ^ (b & c))) | 0;
+            k = g; g = f; f = e; e = (d + t1) | 0;
+            d = c; c = b; b = a; a = (t1 + t2) | 0;
+        }
+        h[0] += a; h[1] += b; h[2] += c; h[3] += d;
+        h[4] += e; h[5] += f; h[6] += g; h[7] += k;
+    }
+
+    hex() {
+        const bits = this.length * 8;
+        const tail = new Uint8Array((this.buffered < 56 ? 64 : 128) - this.buffered);
+        tail[0] = 0x80;
+        const view = new DataView(tail.buffer);
+        view.setUint32(tail.length - 8, Math.floor(bits / 2 ** 32));
+        view.setUint32(tail.length - 4, bits >>> 0);
+        this.update(tail);
+        return Array.from(this.h, (x) => (x >>> 0).toString(16).padStart(8, '0')).join('');
+    }
+}
+
+function missingChunks(received, size, chunkSize) {
+    const chunks = [];
+    let pos = 0;
+    for (const [start, end] of [...received, [size, size]]) {
+        for (let s = pos; s < start; s += chunkSize) {
+            chunks.push([s, Math.min(s + chunkSize, start)]);
+        }
+        pos = Math.max(pos, end);
+    }
+    return chunks;
+}
+
+function putChunk(sessionId, blob, offset, onProgress) {
+    return new Promise((resolve, reject) => {
+        const xhr = new XMLHttpRequest();
+        xhr.upload.addEventListener('progress', (e) => onProgress(e.loaded));
+        xhr.open('PUT', `/upload/sessions/${sessionId}?offset=${offset}`, true);
+        xhr.onload = () => xhr.status === 200 ? resolve() : reject(new Error(xhr.status));
+        xhr.onerror = () => reject(new Error('network error'));
+        xhr.send(blob);
+    });
+}
+
+async function requestJSON(method, url, body) {
+    const response = await fetch(url, {method: method, body: body,
+        headers: {'Content-Type': 'application/json'}});
+    if (!response.ok) throw new Error(response.status);
+    return response.json();
+}
+
+function setProgress(progressBar, percent) {
+    progressBar.style.width = `${percent}%`;
+    progressBar.textContent = `${Math.round(percent)}%`;
+}
+
+function formatSize(bytes) {
+    const units = ['B', 'KB', 'MB', 'GB'];
+    let size = bytes;
+    for (const unit of units) {
+        if (size < 1024) return `${size.toFixed(1)} ${unit}`;
+        size /= 1024;
+    }
+    return `${size.toFixed(1)} TB`;
+}
+"""
+
+class Asset:
+    """One bundled file with its fingerprinted URL and precompressed variants"""
+
+    def __init__(self, name, content_type, text):
+        self.name = name
+        self.content_type = content_type
+        body = text.encode("utf-8")
+        self.digest = hashlib.sha256(body).hexdigest()[:12]
+        stem, _, ext = name.rpartition(".")
+        self.url = f"{STATIC_PREFIX}{stem}.{self.digest}.{ext}"
+        self.etag = f'"{self.digest}"'
+        self.variants = {None: body}
+        for encoding in PREFERENCE:
+            self.variants[encoding] = compress_bytes(body, encoding)
+
+class StaticAssets:
+    """
+    The stylesheet and scripts the pages need, served by the HTTP server
+    itself so pages render without internet access. URLs carry a content
+    hash, so responses can be cached forever and a new version simply gets
+    a new URL. Every encoding is compressed once, when the module loads.
+    """
+
+    def __init__(self, assets):
+        self.by_name = {asset.name: asset for asset in assets}
+        self.by_url = {asset.url: asset for asset in assets}
+
+    def url(self, name):
+        return self.by_name[name].url
+
+    def lookup(self, url_path):
+        """The asset for a fingerprinted /static/ URL, or None so the path falls through to the share"""
+        return self.by_url.get(url_path)
+
+ASSETS = StaticAssets([
+    Asset("app.css", "text/css; charset=utf-8", APP_CSS),
+    Asset("uploader.js", "text/javascript; charset=utf-8", UPLOADER_JS),
+])
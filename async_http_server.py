@@ -0,0 +1,941 @@
+# async_http_server.py
+import os
+import sys
+import stat
+import json
+import time
+import socket
+import asyncio
+import hashlib
+import logging
+import threading
+from io import BytesIO
+from html import escape
+from functools import partial
+from email.utils import formatdate
+from http.client import parse_headers
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from http.server import (BaseHTTPRequestHandler, SimpleHTTPRequestHandler,
+                         DEFAULT_ERROR_MESSAGE, DEFAULT_ERROR_CONTENT_TYPE)
+from http_workers import listening_socket
+from bandwidth import MIN_DELAY, SHAPED_CHUNK_SIZE
+from admission import AdmissionControl, busy_response
+from metrics import route_of, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from paths import guess_type
+from pages import listing_page, upload_page, search_page
+from assets import ASSETS, STATIC_CACHE_CONTROL
+from transfer import TransferStats, ChunkedWriter, content_length
+from ranges import parse_range_header, content_range, MultipartByteranges, RangeNotSatisfiable
+from multipart import MultipartParser, MultipartError, get_boundary
+from uploads import UploadFile, UploadTooLarge, safe_upload_path, UPLOAD_READ_SIZE
+from tar_upload import TarExtractor, TarUploadError, UnsupportedEncoding, body_encoding, TAR_UPLOAD_PATH
+from content_index import store_known_content, check_digest, digest_header, HASH_UPLOAD_PATH
+from search_index import parse_search_query, search_json, SEARCH_PATH
+from upload_sessions import SessionNotFound, UploadIncomplete, SESSIONS_PREFIX
+from listing import parse_listing_query, listing_json
+from archive import ARCHIVE_FORMATS, archive_sources, walk_members, stream_archive, content_disposition
+from file_cache import etag_matches, stat_identity, variant_etag, is_not_modified, if_range_matches
+from compression import StreamCompressor, choose_encoding, is_compressible, compress_bytes, COMPRESS_READ_SIZE
+
+MAX_HEADER_SIZE = 64 * 1024
+SERVER_VERSION = f"{SimpleHTTPRequestHandler.server_version} {BaseHTTPRequestHandler.sys_version}"
+RESPONSES = BaseHTTPRequestHandler.responses
+
+async def pace(flow, n):
+    """Wait until 'flow' may move n more bytes"""
+    if flow:
+        delay = flow.reserve(n)
+        if delay > MIN_DELAY:
+            await asyncio.sleep(delay)
+
+class Request:
+    """One request on an asyncio connection, with helpers to answer it"""
+
+    def __init__(self, server, reader, writer, client_address, method, target, version, headers, length=0):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.client_address = client_address
+        self.command = method
+        self.path = target
+        self.request_version = version
+        self.requestline = f"{method} {target} {version}"
+        self.headers = headers
+        self.body_remaining = length
+        self.headers_sent = False
+
+        # For server.metrics
+        self.started = time.perf_counter()
+        self.route = route_of(method, urlsplit(target).path)
+        self.status = None
+        self.bytes_sent = self.bytes_received = 0
+        self.error_kind = None
+        self.transfer = None
+
+        connection = headers.get('Connection', '').lower()
+        if not server.keep_alive or version < "HTTP/1.1" or connection == 'close':
+            self.close_connection = True
+        else:
+            self.close_connection = False
+
+    @property
+    def protocol_version(self):
+        return "HTTP/1.1" if self.server.keep_alive else "HTTP/1.0"
+
+    def log_request(self, code, size='-'):
+        sys.stderr.write("%s - - [%s] \"%s\" %s %s\n" % (
+            self.client_address[0], time.strftime("%d/%b/%Y %H:%M:%S"), self.requestline, code, size))
+
+    def start_response(self, code, headers=(), message=None):
+        """Write the status line and headers; body writes follow on self.writer"""
+        if message is None:
+            message = RESPONSES.get(code, ('',))[0]
+        if self.body_remaining:
+            self.close_connection = True  # unread body would be parsed as the next request
+        lines = [f"{self.protocol_version} {code} {message}",
+                 f"Server: {SERVER_VERSION}",
+                 f"Date: {formatdate(usegmt=True)}"]
+        lines += [f"{name}: {value}" for name, value in headers]
+        if self.close_connection:
+            lines.append("Connection: close")
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1', 'strict'))
+        self.headers_sent = True
+        self.status = code
+        self.log_request(code)
+
+    async def send(self, code, body=b'', headers=(), message=None):
+        headers = list(headers) + [("Content-Length", str(len(body)))]
+        self.start_response(code, headers, message)
+        if body and self.command != 'HEAD':
+            self.writer.write(body)
+            self.bytes_sent += len(body)
+        await self.drain(len(body))
+
+    async def send_error(self, code, message=None):
+        shortmsg, longmsg = RESPONSES.get(code, ('???', '???'))
+        message = message or shortmsg
+        logging.debug(f"{self.client_address[0]} code {code}, message {message}")
+        body = b''
+        if code >= 200 and code not in (204, 205, 304):
+            body = (DEFAULT_ERROR_MESSAGE % {
+                'code': code,
+                'message': escape(message, quote=False),
+                'explain': escape(longmsg, quote=False),
+            }).encode('UTF-8', 'replace')
+        headers = [("Content-Type", DEFAULT_ERROR_CONTENT_TYPE)] if body else []
+        await self.send(code, body, headers, message)
+
+    async def send_body(self, body, content_type, code=200, etag=None):
+        """Send an in-memory body, compressed when the client accepts it"""
+        encoding = None
+        compressible = self.server.compressed_cache is not None and is_compressible(content_type, len(body))
+        if compressible:
+            encoding = choose_encoding(self.headers)
+        headers = []
+        if etag:
+            etag = variant_etag(etag, encoding)
+            headers += [("ETag", etag), ("Cache-Control", "no-cache")]
+            if_none_match = self.headers.get("If-None-Match")
+            if if_none_match is not None and etag_matches(if_none_match, etag):
+                await self.send(304, headers=headers)
+                return
+        if encoding:
+            body = await self.server.run(compress_bytes, body, encoding)
+            headers.append(("Content-Encoding", encoding))
+        if compressible:
+            headers.append(("Vary", "Accept-Encoding"))
+        await self.send(code, body, [("Content-Type", content_type)] + headers)
+
+    async def send_html(self, html):
+        body = html.encode('utf-8')
+        await self.send_body(body, "text/html; charset=utf-8", etag=f'"{hashlib.md5(body).hexdigest()}"')
+
+    async def send_json(self, obj, code=200):
+        await self.send_body(json.dumps(obj).encode('utf-8'), 'application/json', code)
+
+    def open_flow(self, direction):
+        """This client's bandwidth share for one upload ("read") or download ("write")"""
+        if self.transfer is None:
+            self.transfer = (direction, self.server.metrics.transfer_started(direction))
+        return self.server.bandwidth.flow(direction, self.client_address[0])
+
+    def record(self):
+        """Add this request to server.metrics once it is over"""
+        metrics = self.server.metrics
+        if self.transfer:
+            direction, started = self.transfer
+            metrics.transfer_finished(direction, started,
+                                      self.bytes_sent if direction == "write" else self.bytes_received)
+        metrics.request_finished(self.route, self.status, time.perf_counter() - self.started,
+                                 self.bytes_sent, self.bytes_received, self.error_kind)
+
+    async def drain(self, n=0):
+        """Wait for buffered output, giving up if the client reads slower than the minimum rate"""
+        await asyncio.wait_for(self.writer.drain(), self.server.admission.step_timeout(n))
+
+    async def read_body(self, n, flow=None):
+        """Read up to n bytes of the request body, paced by 'flow'"""
+        n = min(n, self.body_remaining)
+        if n <= 0:
+            return b''
+        await pace(flow, n)
+        data = await asyncio.wait_for(self.reader.read(n), self.server.admission.step_timeout(n))
+        self.body_remaining -= len(data)
+        self.bytes_received += len(data)
+        return data
+
+    async def read_json_body(self, limit=64 * 1024):
+        if self.body_remaining > limit:
+            raise ValueError("Request body too large")
+        data = await asyncio.wait_for(self.reader.readexactly(self.body_remaining),
+                                      self.server.admission.step_timeout(self.body_remaining))
+        self.body_remaining = 0
+        self.bytes_received += len(data)
+        return json.loads(data or b'{}')
+
+class AsyncHTTPServer:
+    """
+    asyncio HTTP engine serving the same routes as CustomHandler: directory
+    listings, the upload page and API, and file downloads. Connections are
+    coroutines rather than threads, file system calls are offloaded to a
+    small thread pool and file bodies go out with loop.sendfile(). Like
+    HTTPServer, run serve_forever() in a thread and stop it with shutdown().
+    'admission' caps connections; there is no worker queue, so connections
+    over the cap are answered with 503 right away.
+    """
+
+    def __init__(self, server_address, directory, io_threads=16, backlog=128, drain_timeout=5.0,
+                 sock=None, admission=None):
+        self.server_address = server_address
+        self.directory = directory
+        self.drain_timeout = drain_timeout
+        self.admission = admission or AdmissionControl()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, io_threads), thread_name_prefix="http-io")
+        self.socket = sock or listening_socket(server_address, backlog)
+        self.server_address = self.socket.getsockname()
+        # Optional components; create_http_server() sets the enabled ones
+        self.hot_cache = self.compressed_cache = None
+        self.content_index = self.search_index = None
+        self.owned_indexes = []  # the ones built for this server, closed with it
+
+        self.loop = None
+        self._stop = None
+        self._stopped = threading.Event()
+        self._connections = {}  # task -> True while a request is being handled
+
+    # ----- lifecycle -----
+
+    def serve_forever(self):
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self._stopped.set()
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        server = await asyncio.start_server(self._serve_connection, sock=self.socket, limit=MAX_HEADER_SIZE)
+        async with server:
+            await self._stop.wait()
+            server.close()
+
+            # Idle keep-alive connections can go now; give busy ones drain_timeout
+            for task, busy in list(self._connections.items()):
+                if not busy:
+                    task.cancel()
+            if self._connections:
+                await asyncio.wait(list(self._connections), timeout=self.drain_timeout)
+            for task in list(self._connections):
+                task.cancel()
+
+    def shutdown(self):
+        """Stop serving and drain in-flight requests; safe to call from another thread"""
+        if self.loop is None or self._stopped.is_set():
+            return
+        self.loop.call_soon_threadsafe(self._stop.set)
+        self._stopped.wait()
+
+    def server_close(self):
+        self.socket.close()
+        self.executor.shutdown(wait=False)
+        for index in self.owned_indexes:
+            index.close()
+
+    def run(self, func, *args):
+        """Run a blocking call on the I/O thread pool"""
+        return self.loop.run_in_executor(self.executor, partial(func, *args))
+
+    def server_status(self):
+        """Connection counts, rejections and timeouts for /server-status"""
+        return self.admission.stats(engine="asyncio", io_queue=self.executor._work_queue.qsize(),
+                                    hot_cache=self.hot_cache.stats() if self.hot_cache else None,
+                                    content_index=self.content_index.stats() if self.content_index else None,
+                                    search_index=self.search_index.stats() if self.search_index else None)
+
+    async def sendfile(self, request, f, offset, count, flow=None):
+        """
+        loop.sendfile() in SHAPED_CHUNK_SIZE steps, each paced by 'flow'
+        and bounded by the minimum transfer rate
+        """
+        transport = request.writer.transport
+        step = SHAPED_CHUNK_SIZE if flow or self.admission.min_rate else count
+        sent = 0
+        while sent < count:
+            n = min(step, count - sent)
+            await pace(flow, n)
+            n = await asyncio.wait_for(self.loop.sendfile(transport, f, offset + sent, n),
+                                       self.admission.step_timeout(n))
+            if not n:
+                break
+            sent += n
+            request.bytes_sent += n
+        return sent
+
+    async def send_buffer(self, request, data, offset, count, flow=None):
+        """sendfile() for content cached in memory: writes slices of the memoryview, drained in steps"""
+        step = SHAPED_CHUNK_SIZE if flow or self.admission.min_rate else count
+        end = offset + count
+        while offset < end:
+            n = min(step, end - offset)
+            await pace(flow, n)
+            request.writer.write(data[offset:offset + n])
+            await request.drain(n)
+            offset += n
+            request.bytes_sent += n
+        return count
+
+    # ----- connections -----
+
+    async def _serve_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections[task] = False
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client_address = writer.get_extra_info('peername') or ('-', 0)
+        reason = self.admission.admit(client_address[0])
+        if reason is not None:
+            logging.warning(f"Rejected HTTP connection from {client_address[0]}: {reason}")
+            writer.write(busy_response(reason, self.admission.retry_after))
+            self._connections.pop(task, None)
+            writer.close()
+            return
+
+        requests_left = self.max_keepalive_requests
+        try:
+            while requests_left > 0:
+                try:
+                    # Idle wait for the next request, then a deadline for the whole head
+                    first = await asyncio.wait_for(reader.readexactly(1), self.keepalive_timeout)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                try:
+                    head = first + await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"),
+                                                          self.admission.header_timeout)
+                except asyncio.TimeoutError:
+                    self.admission.timed_out("header")
+                    logging.info(f"Dropping HTTP connection from {client_address[0]}: header timeout")
+                    break
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    writer.write(b"HTTP/1.1 431 Request Header Fields Too Large\r\n"
+                                 b"Content-Length: 0\r\nConnection: close\r\n\r\n")
+                    break
+                requests_left -= 1
+
+                request = self._parse_request(head, reader, writer, client_address)
+                if not isinstance(request, Request):
+                    writer.write(f"HTTP/1.1 {request} {RESPONSES[request][0]}\r\n"
+                                 f"Content-Length: 0\r\nConnection: close\r\n\r\n".encode('latin-1'))
+                    break
+                if requests_left == 0:
+                    request.close_connection = True
+
+                self._connections[task] = True
+                try:
+                    await self._dispatch(request)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    request.error_kind = "aborted"
+                    break
+                except asyncio.TimeoutError:
+                    request.error_kind = "timeout"
+                    self.admission.timed_out("transfer")
+                    logging.info(f"Dropping HTTP connection from {client_address[0]}: transfer timeout")
+                    break
+                except Exception as e:
+                    logging.error(f"Error handling {request.requestline}", exc_info=True)
+                    if request.headers_sent:
+                        break
+                    request.close_connection = True
+                    await request.send_error(500, f"Server error: {str(e)}")
+                finally:
+                    self._connections[task] = False
+                    request.record()
+                if request.close_connection or request.body_remaining:
+                    break
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.admission.release(client_address[0])
+            self._connections.pop(task, None)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, asyncio.CancelledError):
+                pass
+
+    def _parse_request(self, head, reader, writer, client_address):
+        """A Request, or the status code to answer a head that can't be served with before closing"""
+        try:
+            request_line, _, rest = head.partition(b"\r\n")
+            method, target, version = request_line.decode('iso-8859-1').split()
+            if version not in ("HTTP/1.0", "HTTP/1.1"):
+                return 400
+            headers = parse_headers(BytesIO(rest))
+            length = content_length(headers)
+        except (ValueError, UnicodeDecodeError):
+            return 400
+        if 'Transfer-Encoding' in headers:
+            # Bodies are only read by Content-Length; any other framing would be parsed as the next request
+            return 411 if headers['Transfer-Encoding'].strip().lower() == 'chunked' else 501
+        if version == "HTTP/1.1" and headers.get('Expect', '').lower() == '100-continue':
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+        return Request(self, reader, writer, client_address, method, target, version, headers, length)
+
+    async def _dispatch(self, request):
+        url = urlsplit(request.path)
+        method = request.command
+        if url.path.startswith(SESSIONS_PREFIX):
+            await self._handle_session(request, url)
+        elif method in ('GET', 'HEAD'):
+            if url.path == '/upload':
+                await request.send_html(upload_page())
+            elif url.path == '/server-status':
+                await request.send_json(self.server_status())
+            elif url.path == '/metrics':
+                await request.send_body(self.metrics.render().encode('utf-8'), METRICS_CONTENT_TYPE)
+            elif url.path == SEARCH_PATH:
+                await self._handle_search(request, url)
+            elif ASSETS.lookup(url.path):
+                await self._send_static_asset(request, ASSETS.lookup(url.path))
+            else:
+                await self._handle_get(request, url)
+        elif method == 'POST' and url.path == '/upload':
+            await self._handle_upload(request)
+        elif method == 'POST' and url.path == TAR_UPLOAD_PATH:
+            await self._handle_tar_upload(request)
+        elif method == 'POST' and url.path == HASH_UPLOAD_PATH:
+            await self._handle_hash_upload(request)
+        elif method in ('POST', 'PUT', 'DELETE'):
+            await request.send_error(404, "Not found")
+        else:
+            await request.send_error(501, f"Unsupported method ({method!r})")
+
+    # ----- downloads and listings -----
+
+    async def _handle_get(self, request, url):
+        try:
+            path = await self.run(self.path_cache.translate, self.directory, request.path)
+        except PermissionError:
+            await request.send_error(403, "Access denied")
+            return
+        except FileNotFoundError:
+            await request.send_error(404, "File not found")
+            return
+        try:
+            st = await self.run(os.stat, path)
+        except (FileNotFoundError, NotADirectoryError):
+            st = None
+        if st is not None and stat.S_ISDIR(st.st_mode):
+            await self._handle_directory(request, path, url)
+        else:
+            await self._handle_file(request, path, st)
+
+    async def _send_static_asset(self, request, asset):
+        """Bundled stylesheet or script, same as CustomHandler.send_static_asset"""
+        encoding = choose_encoding(request.headers) if self.compressed_cache is not None else None
+        etag = variant_etag(asset.etag, encoding)
+        headers = [("ETag", etag), ("Cache-Control", STATIC_CACHE_CONTROL)]
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match is not None and etag_matches(if_none_match, etag):
+            await request.send(304, headers=headers)
+            return
+        headers += [("Content-Type", asset.content_type), ("Vary", "Accept-Encoding")]
+        if encoding:
+            headers.append(("Content-Encoding", encoding))
+        await request.send(200, asset.variants[encoding], headers)
+
+    async def _handle_directory(self, request, path, url):
+        if not url.path.endswith('/'):
+            location = url.path + '/' + (f"?{url.query}" if url.query else '')
+            await request.send(301, headers=[("Location", location)])
+            return
+        query = parse_qs(url.query)
+        if 'archive' in query:
+            await self._send_archive(request, path, url, query)
+            return
+        try:
+            page, per_page, sort, order = parse_listing_query(query)
+        except ValueError:
+            await request.send_error(400, "Invalid page")
+            return
+
+        listing = await self.run(self.listing_cache.get, path)
+        entries, pages = listing.page(page, per_page, sort, order == 'desc')
+        page = min(max(1, page), pages)
+        if query.get('format', [''])[0] == 'json':
+            await request.send_json(listing_json(url.path, listing, entries, page, pages, per_page, sort, order))
+            return
+        html = await self.run(listing_page, self.directory, url.path, entries, page, pages, per_page, sort, order,
+                              self.search_index is not None)
+        await request.send_html(html)
+
+    async def _handle_search(self, request, url):
+        """Search the share by name, size and date, same as CustomHandler.handle_search"""
+        if self.search_index is None:
+            await request.send_error(404, "Search is disabled")
+            return
+        query = parse_qs(url.query)
+        try:
+            options = parse_search_query(query)
+            started = time.monotonic()
+            # Off the loop: a first size or date query sorts the whole index
+            results, truncated = await self.run(partial(self.search_index.search, **options))
+            took = time.monotonic() - started
+        except ValueError as e:
+            await request.send_error(400, f"Bad request: {str(e)}")
+            return
+        if query.get('format', [''])[0] == 'html':
+            await request.send_html(search_page(self.directory, options['path'], options['query'],
+                                                results, truncated))
+        else:
+            await request.send_json(search_json(self.search_index, options, results, truncated, took))
+
+    async def _send_archive(self, request, path, url, query):
+        """ZIP or TAR of a folder built while streaming, same as CustomHandler.send_archive"""
+        fmt = query['archive'][0]
+        if fmt not in ARCHIVE_FORMATS:
+            await request.send_error(400, "Unsupported archive format")
+            return
+        try:
+            sources, name = await self.run(archive_sources, self.directory, path, url.path,
+                                           query.get('files', []))
+        except PermissionError:
+            await request.send_error(403, "Access denied")
+            return
+        except FileNotFoundError:
+            await request.send_error(404, "File not found")
+            return
+        except ValueError as e:
+            await request.send_error(400, str(e))
+            return
+
+        headers = [("Content-Type", ARCHIVE_FORMATS[fmt]),
+                   ("Content-Disposition", content_disposition(f"{name}.{fmt}")),
+                   ("Cache-Control", "no-store")]
+        chunked = request.request_version >= "HTTP/1.1" and request.protocol_version >= "HTTP/1.1"
+        if chunked:
+            headers.append(("Transfer-Encoding", "chunked"))
+        else:
+            request.close_connection = True
+        request.start_response(200, headers)
+        if request.command == 'HEAD':
+            await request.drain()
+            return
+
+        writer = ChunkedWriter(request.writer, chunked)
+        chunks = stream_archive(fmt, walk_members(self.directory, sources, self.listing_cache.hidden))
+        flow = request.open_flow("write")
+        stats = TransferStats(f"{fmt} stream")
+        try:
+            while True:
+                data = await self.run(next, chunks, None)
+                if data is None:
+                    break
+                await pace(flow, len(data))
+                writer.write(data)
+                stats.bytes += len(data)
+                request.bytes_sent += len(data)
+                await request.drain(len(data))
+            writer.close()
+            await request.drain()
+        finally:
+            flow.close()
+        logging.info(f"Sent {request.path}: {stats.finish()}")
+
+    def _validator_headers(self, validators, etag, vary=False):
+        headers = [("ETag", etag), ("Last-Modified", validators.last_modified),
+                   ("Cache-Control", self.cache_control)]
+        if validators.digest and etag == validators.etag:
+            headers.append(("Repr-Digest", digest_header(validators.digest)))  # not for compressed variants
+        if vary:
+            headers.append(("Vary", "Accept-Encoding"))
+        return headers
+
+    async def _handle_file(self, request, path, st):
+        if st is None or not stat.S_ISREG(st.st_mode):
+            await request.send_error(404, "File not found")
+            return
+
+        validators = await self.run(self.validator_cache.get, path, st)
+        content_type = guess_type(path)
+        compressible = self.compressed_cache is not None and is_compressible(content_type, st.st_size)
+        encoding = choose_encoding(request.headers) if compressible else None
+        etag = variant_etag(validators.etag, encoding)
+        if is_not_modified(request.headers, validators, etag):
+            await request.send(304, headers=self._validator_headers(validators, etag, compressible))
+            return
+
+        hot_cache = self.hot_cache
+        cached = None
+        if hot_cache is not None:
+            cached = hot_cache.lookup(path, st, encoding)
+            if cached is None and hot_cache.admit(path, st, encoding):
+                cached = await self.run(hot_cache.load, path, st, encoding)
+        if cached is not None:
+            flow = request.open_flow("write")
+            try:
+                if encoding:
+                    headers = [("Content-Type", content_type), ("Content-Encoding", encoding),
+                               ("Content-Length", str(len(cached)))]
+                    request.start_response(200, headers + self._validator_headers(validators, etag, vary=True))
+                    stats = TransferStats("memory")
+                    if request.command != 'HEAD':
+                        await self._send_body(request, cached, 0, len(cached), flow, stats)
+                    await request.drain()
+                    logging.info(f"Sent {request.path} ({encoding}, memory): {stats.finish()}")
+                else:
+                    await self._send_file_body(request, cached, len(cached), validators, content_type,
+                                               compressible, flow)
+            finally:
+                flow.close()
+            return
+
+        f = await self.run(open, path, 'rb')
+        flow = request.open_flow("write")
+        try:
+            fst = os.fstat(f.fileno())
+            if stat_identity(fst) != validators.identity:
+                validators = await self.run(self.validator_cache.get, path, fst)
+                etag = variant_etag(validators.etag, encoding)
+
+            if encoding:
+                await self._send_compressed(request, path, f, validators, content_type, encoding, etag, flow)
+                return
+            await self._send_file_body(request, f, fst.st_size, validators, content_type, compressible, flow)
+        finally:
+            flow.close()
+            f.close()
+
+    async def _send_file_body(self, request, source, file_size, validators, content_type, compressible, flow):
+        """Full or Range response from an open file or a memoryview of cached content"""
+        ranges = None
+        range_header = request.headers.get("Range")
+        if range_header and if_range_matches(request.headers, validators):
+            try:
+                ranges = parse_range_header(range_header, file_size)
+            except RangeNotSatisfiable:
+                await request.send(416, headers=[("Content-Range", f"bytes */{file_size}")])
+                return
+
+        headers = [("Accept-Ranges", "bytes")] + self._validator_headers(validators, validators.etag, compressible)
+        if not ranges:
+            code, length = 200, file_size
+            headers.append(("Content-Type", content_type))
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            code, length = 206, end - start + 1
+            headers += [("Content-Type", content_type),
+                        ("Content-Range", content_range(start, end, file_size))]
+        else:
+            body = MultipartByteranges(ranges, file_size, content_type)
+            code, length = 206, body.content_length
+            headers.append(("Content-Type", body.content_type))
+        headers.append(("Content-Length", str(length)))
+        request.start_response(code, headers)
+        if request.command == 'HEAD':
+            await request.drain()
+            return
+
+        stats = TransferStats("memory" if isinstance(source, memoryview) else "loop.sendfile")
+        if not ranges:
+            await self._send_body(request, source, 0, file_size, flow, stats)
+        elif len(ranges) == 1:
+            await self._send_body(request, source, start, end - start + 1, flow, stats)
+        else:
+            for head, offset, part_length in body.parts:
+                request.writer.write(head)
+                await self._send_body(request, source, offset, part_length, flow, stats)
+            request.writer.write(body.trailer)
+            await request.drain()
+        logging.info(f"Sent {request.path}: {stats.finish()}")
+
+    async def _send_body(self, request, source, offset, count, flow, stats):
+        """Send part of an open file with sendfile(), or of a memoryview, counting it in 'stats'"""
+        if isinstance(source, memoryview):
+            stats.bytes += await self.send_buffer(request, source, offset, count, flow)
+        else:
+            sent = await self.sendfile(request, source, offset, count, flow)
+            stats.bytes += sent
+            self._check_sent(request, sent, count)
+
+    def _check_sent(self, request, sent, expected):
+        """Close the connection after a body cut short by a file that shrank, see CustomHandler.check_sent"""
+        if sent < expected:
+            logging.warning(f"{request.path} shrank while it was sent ({sent} of {expected} bytes)")
+            request.error_kind = "truncated"
+            request.close_connection = True
+
+    async def _send_compressed(self, request, path, f, validators, content_type, encoding, etag, flow=None):
+        """Cached compressed variant via sendfile, or compress while streaming and fill the cache"""
+        cache = self.compressed_cache
+        key = cache.key(path, validators.identity, encoding)
+        headers = [("Content-Type", content_type), ("Content-Encoding", encoding)]
+        headers += self._validator_headers(validators, etag, vary=True)
+
+        cf = await self.run(cache.lookup, key)
+        if cf is not None:
+            try:
+                size = os.fstat(cf.fileno()).st_size
+                request.start_response(200, headers + [("Content-Length", str(size))])
+                if request.command == 'HEAD':
+                    await request.drain()
+                    return
+                stats = TransferStats("loop.sendfile")
+                stats.bytes = await self.sendfile(request, cf, 0, size, flow)
+                self._check_sent(request, stats.bytes, size)
+            finally:
+                cf.close()
+            logging.info(f"Sent {request.path} ({encoding}, cached): {stats.finish()}")
+            return
+
+        chunked = request.request_version >= "HTTP/1.1" and request.protocol_version >= "HTTP/1.1"
+        if chunked:
+            headers.append(("Transfer-Encoding", "chunked"))
+        else:
+            request.close_connection = True
+        request.start_response(200, headers)
+        if request.command == 'HEAD':
+            await request.drain()
+            return  # the GET's headers; its body is only compressed while it is sent
+        writer = ChunkedWriter(request.writer, chunked)
+
+        out = await self.run(cache.writer)
+        compressor = StreamCompressor(encoding)
+        stats = TransferStats(f"{encoding} stream")
+
+        def compress_next():
+            chunk = f.read(COMPRESS_READ_SIZE)
+            data = compressor.compress(chunk) if chunk else compressor.flush()
+            out.write(data)
+            return data, not chunk
+
+        try:
+            while True:
+                data, done = await self.run(compress_next)
+                await pace(flow, len(data))
+                writer.write(data)
+                stats.bytes += len(data)
+                request.bytes_sent += len(data)
+                await request.drain(len(data))
+                if done:
+                    break
+            writer.close()
+            await request.drain()
+            if stat_identity(os.fstat(f.fileno())) == validators.identity:
+                await self.run(cache.commit, key, out)
+            else:
+                out.discard()  # file changed while we read it
+        except BaseException:
+            out.discard()
+            raise
+        logging.info(f"Sent {request.path}: {stats.finish()}")
+
+    # ----- uploads -----
+
+    async def _handle_upload(self, request):
+        """Stream multipart uploads to disk, same as CustomHandler.do_POST"""
+        parser = None
+        try:
+            boundary = get_boundary(request.headers['Content-Type'])
+            if request.headers.get('Content-Length') is None:
+                await request.send_error(411, "Content-Length required")
+                return
+
+            saved = []
+            unparsed = request.body_remaining
+            def open_part(part):
+                if not part.filename:
+                    return None  # plain form field
+                path = safe_upload_path(self.directory, part.filename)
+                saved.append(os.path.basename(path))
+                return UploadFile(path, size_hint=unparsed, durability=self.durability)
+
+            parser = MultipartParser(boundary, open_part)
+            with request.open_flow("read") as flow:
+                while request.body_remaining > 0:
+                    chunk = await request.read_body(UPLOAD_READ_SIZE, flow)
+                    if not chunk:
+                        raise MultipartError("Client closed connection mid-upload")
+                    unparsed = request.body_remaining + len(chunk)
+                    await self.run(parser.feed, chunk)
+            parser.close()
+            self._folder_changed(self.directory)
+            self._content_changed([os.path.join(self.directory, name) for name in saved])
+            await request.send_json({"status": "success", "files": saved})
+
+        except (ConnectionError, asyncio.TimeoutError, asyncio.CancelledError):
+            if parser is not None:
+                await self.run(parser.abort)
+            raise
+        except Exception as e:
+            if parser is not None:
+                await self.run(parser.abort)
+            request.close_connection = True
+            if isinstance(e, UploadTooLarge):
+                await request.send_error(413, f"Upload failed: {str(e)}")
+            elif isinstance(e, ValueError):
+                await request.send_error(400, f"Upload failed: {str(e)}")
+            else:
+                await request.send_error(500, f"Upload failed: {str(e)}")
+
+    async def _handle_tar_upload(self, request):
+        """Extract a streamed tar into the shared folder, same as CustomHandler.handle_tar_upload"""
+        extractor = None
+        try:
+            if request.headers.get('Content-Length') is None:
+                await request.send_error(411, "Content-Length required")
+                return
+            encoding = body_encoding(request.headers.get('Content-Type'), request.headers.get('Content-Encoding'))
+            extractor = TarExtractor(self.directory, encoding,
+                                     durability=self.durability)
+            with request.open_flow("read") as flow:
+                while request.body_remaining > 0:
+                    chunk = await request.read_body(UPLOAD_READ_SIZE, flow)
+                    if not chunk:
+                        raise TarUploadError("Client closed connection mid-upload")
+                    await self.run(extractor.feed, chunk)
+            await self.run(extractor.close)
+            summary = extractor.summary()
+            self._content_changed([os.path.join(self.directory, name) for name in summary['files']])
+            logging.info(f"Extracted {len(summary['files'])} files from a tar upload "
+                         f"({len(summary['skipped'])} skipped)")
+            await request.send_json(summary)
+
+        except (ConnectionError, asyncio.TimeoutError, asyncio.CancelledError):
+            if extractor is not None:
+                await self.run(extractor.abort)
+            raise
+        except Exception as e:
+            if extractor is not None:
+                await self.run(extractor.abort)
+            request.close_connection = True
+            if isinstance(e, UnsupportedEncoding):
+                await request.send_error(415, str(e))
+            elif isinstance(e, UploadTooLarge):
+                await request.send_error(413, f"Upload failed: {str(e)}")
+            elif isinstance(e, ValueError):
+                await request.send_error(400, f"Upload failed: {str(e)}")
+            else:
+                await request.send_error(500, f"Upload failed: {str(e)}")
+        finally:
+            if extractor is not None:
+                for path in extractor.touched:
+                    self._folder_changed(path)
+
+    async def _handle_hash_upload(self, request):
+        """Store a file from content the share already has, see CustomHandler.handle_hash_upload"""
+        try:
+            body = await request.read_json_body()
+            path = safe_upload_path(self.directory, str(body['name']))
+            digest, size = check_digest(body['sha256']), int(body['size'])
+            method = None
+            if self.content_index is not None:
+                method = await self.run(store_known_content, self.content_index, path, digest, size,
+                                        body.get('method', 'copy'), self.durability)
+            if method is None:
+                await request.send_json({"status": "missing"}, 404)
+                return
+            self._folder_changed(self.directory)
+            logging.info(f"Stored {path} from existing content ({method})")
+            await request.send_json({"status": "success", "files": [os.path.basename(path)], "method": method})
+        except (KeyError, ValueError) as e:
+            request.close_connection = True
+            await request.send_error(400, f"Bad request: {str(e)}")
+        except OSError as e:
+            await request.send_error(500, f"Upload failed: {str(e)}")
+
+    def _folder_changed(self, path):
+        """Refresh the listing and search index of a folder the server wrote into"""
+        self.listing_cache.invalidate(path)
+        if self.search_index is not None:
+            self.search_index.invalidate(path)
+
+    def _content_changed(self, paths):
+        """Have the content index hash files the server just stored"""
+        if self.content_index is not None:
+            for path in paths:
+                self.content_index.update(path)
+
+    async def _handle_session(self, request, url):
+        """Resumable upload API, see CustomHandler.handle_session_request"""
+        store = self.upload_sessions
+        parts = url.path[len(SESSIONS_PREFIX):].strip('/').split('/')
+        session_id = parts[0]
+        action = parts[1] if len(parts) > 1 else None
+        method = request.command
+        try:
+            if method == 'POST' and not session_id:
+                body = await request.read_json_body()
+                session = await self.run(store.create, str(body['name']), int(body['size']), body.get('key'))
+                await request.send_json(dict(session.to_dict(), hash_upload=self.content_index is not None), 201)
+            elif method == 'GET' and not action:
+                session = await self.run(store.get, session_id)
+                await request.send_json(session.to_dict())
+            elif method == 'PUT' and not action:
+                session = await self.run(store.get, session_id)
+                offset = int(parse_qs(url.query).get('offset', ['0'])[0])
+                if request.headers.get('Content-Length') is None:
+                    await request.send_error(411, "Content-Length required")
+                    return
+                await self._receive_chunk(request, session, offset)
+                await request.send_json(session.to_dict())
+            elif method == 'POST' and action == 'complete':
+                path = await self.run(store.finalize, session_id)
+                self._folder_changed(self.directory)
+                self._content_changed([path])
+                logging.info(f"Upload complete: {path}")
+                await request.send_json({"status": "success", "files": [os.path.basename(path)]})
+            elif method == 'DELETE' and not action:
+                await self.run(store.abort, session_id)
+                await request.send_json({"status": "aborted"})
+            else:
+                await request.send_error(404, "Not found")
+        except SessionNotFound:
+            await request.send_error(404, "Upload session not found")
+        except UploadIncomplete as e:
+            await request.send_error(409, str(e))
+        except UploadTooLarge as e:
+            await request.send_error(413, f"Upload failed: {str(e)}")
+        except (KeyError, ValueError) as e:
+            await request.send_error(400, f"Bad request: {str(e)}")
+
+    async def _receive_chunk(self, request, session, offset):
+        length = request.body_remaining
+        f = await self.run(session.open_chunk, offset, length)
+        flow = request.open_flow("read")
+        written = 0
+        try:
+            while request.body_remaining > 0:
+                data = await request.read_body(UPLOAD_READ_SIZE, flow)
+                if not data:
+                    break
+                await self.run(f.write, data)
+                written += len(data)
+        finally:
+            flow.close()
+            await self.run(session.finish_chunk, f, offset, written)
+        if written < length:
+            raise ConnectionError("Client closed connection mid-chunk")
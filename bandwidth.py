@@ -0,0 +1,156 @@
+# bandwidth.py
+import time
+import threading
+
+SHAPED_CHUNK_SIZE = 256 * 1024  # largest send/recv while shaping, keeps pacing smooth
+FLOW_BURST = 256 * 1024  # bytes a new transfer may send at once, so small files don't wait
+MIN_DELAY = 0.001
+MAX_IDLE_BUCKETS = 1024
+DIRECTIONS = ("read", "write")  # read = uploads from clients, write = downloads to them
+
+class TokenBucket:
+    """
+    Bytes refill at 'rate' per second up to 'burst'. A reservation always
+    succeeds and may leave the bucket in debt; the caller then waits the
+    returned number of seconds before moving the data.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+
+    def reserve(self, n, now, rate=None):
+        rate = rate or self.rate
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * rate)
+        self.stamp = now
+        self.tokens -= n
+        return -self.tokens / rate if self.tokens < 0 else 0.0
+
+class Flow:
+    """
+    One transfer's share of a BandwidthLimiter. Call throttle(n) before
+    moving n bytes from a thread, or wait reserve(n) seconds from an event
+    loop, and close() when the transfer ends. An unlimited flow is false,
+    so callers can skip pacing altogether.
+    """
+
+    def __init__(self, limiter, direction, ip, user, weight):
+        self.limiter = limiter
+        self.direction = direction
+        self.weight = weight
+        self.closed = False
+        total = limiter.limits[direction][0]
+        self.bucket = TokenBucket(total, FLOW_BURST) if total else None
+        self.shared = limiter._acquire(self, ip, user) if limiter.limited(direction) else []
+
+    def __bool__(self):
+        return self.bucket is not None or bool(self.shared)
+
+    def reserve(self, n):
+        """Take n bytes from the buckets; returns how long to wait before sending them"""
+        return self.limiter._reserve(self, n)
+
+    def throttle(self, n):
+        delay = self.reserve(n)
+        if delay > MIN_DELAY:
+            time.sleep(delay)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            if self:
+                self.limiter._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class BandwidthLimiter:
+    """
+    Token-bucket bandwidth shaping shared by the FTP and HTTP servers, with
+    global, per-IP and per-user limits in bytes per second for each
+    direction (0 means unlimited). The global limit is split between the
+    active transfers in proportion to their weight (weighted fair queuing),
+    so a new small transfer gets its share right away instead of queueing
+    behind a bulk one. Per-IP and per-user limits are plain buckets shared
+    by all of that client's transfers.
+    """
+
+    def __init__(self, read_limit=0, write_limit=0, per_ip_read_limit=0,
+                 per_ip_write_limit=0, per_user_read_limit=0, per_user_write_limit=0):
+        self.limits = {
+            "read": (read_limit, per_ip_read_limit, per_user_read_limit),
+            "write": (write_limit, per_ip_write_limit, per_user_write_limit),
+        }
+        self._lock = threading.Lock()
+        self._weights = {"read": 0, "write": 0}
+        self._buckets = {}  # (direction, "ip" or "user", key) -> [TokenBucket, flow count]
+
+    def __reduce__(self):
+        # Worker processes get a fresh limiter with the same limits
+        (r, ip_r, user_r), (w, ip_w, user_w) = self.limits["read"], self.limits["write"]
+        return (self.__class__, (r, w, ip_r, ip_w, user_r, user_w))
+
+    def limited(self, direction):
+        return any(self.limits[direction])
+
+    def split(self, parts):
+        """A limiter with every limit divided between 'parts' independent processes"""
+        (r, ip_r, user_r), (w, ip_w, user_w) = self.limits["read"], self.limits["write"]
+        share = lambda limit: -(-limit // parts) if limit else 0
+        return BandwidthLimiter(share(r), share(w), share(ip_r), share(ip_w),
+                                share(user_r), share(user_w))
+
+    def flow(self, direction, ip=None, user=None, weight=1):
+        """Register a transfer; use it as a context manager"""
+        if direction not in DIRECTIONS:
+            raise ValueError(f"Unknown direction: {direction}")
+        return Flow(self, direction, ip, user, weight)
+
+    def _acquire(self, flow, ip, user):
+        direction = flow.direction
+        _, per_ip, per_user = self.limits[direction]
+        shared = []
+        with self._lock:
+            if flow.bucket is not None:
+                self._weights[direction] += flow.weight
+            for kind, key, rate in (("ip", ip, per_ip), ("user", user, per_user)):
+                if not rate or key is None:
+                    continue
+                entry = self._buckets.get((direction, kind, key))
+                if entry is None:
+                    entry = self._buckets[(direction, kind, key)] = [TokenBucket(rate), 0]
+                entry[1] += 1
+                shared.append((direction, kind, key))
+        return shared
+
+    def _reserve(self, flow, n):
+        with self._lock:
+            now = time.monotonic()
+            delay = 0.0
+            if flow.bucket is not None:
+                total = self.limits[flow.direction][0]
+                share = total * flow.weight / max(self._weights[flow.direction], flow.weight)
+                delay = flow.bucket.reserve(n, now, share)
+            for key in flow.shared:
+                delay = max(delay, self._buckets[key][0].reserve(n, now))
+        return delay
+
+    def _release(self, flow):
+        with self._lock:
+            if flow.bucket is not None:
+                self._weights[flow.direction] -= flow.weight
+            for key in flow.shared:
+                self._buckets[key][1] -= 1
+            if len(self._buckets) > MAX_IDLE_BUCKETS:
+                self._prune(time.monotonic())
+
+    def _prune(self, now):
+        """Forget idle clients whose buckets have refilled; they'd start full anyway"""
+        for key, (bucket, flows) in list(self._buckets.items()):
+            if not flows and bucket.tokens + (now - bucket.stamp) * bucket.rate >= bucket.burst:
+                del self._buckets[key]
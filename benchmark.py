@@ -0,0 +1,551 @@
+# benchmark.py
+"""
+Load-test the HTTP and FTP servers on this machine.
+
+    python benchmark.py --output results.json
+    python benchmark.py --quick --compare results.json
+
+The servers run in a child process on a generated dataset, and client
+threads in this process drive one scenario at a time. The dataset has
+many small files, a few large sparse files and one directory with many
+entries. For each scenario the report gives throughput, p50/p90/p99
+latency, and the server's CPU time and memory. The report is JSON, so
+runs can be compared with --compare.
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import socket
+import ftplib
+import logging
+import argparse
+import platform
+import threading
+import subprocess
+import http.client
+import multiprocessing
+from urllib.parse import quote
+
+DATASET_MARKER = ".bench-dataset.json"
+SMALL_DIR = "small"
+BIG_DIR = "bigdir"
+SPARSE_DIR = "sparse"
+UPLOAD_DIR = "ftp-uploads"
+READ_SIZE = 1024 * 1024
+MB = 1024 * 1024
+
+SCENARIOS = ("http_small", "http_large", "http_listing", "http_listing_json", "http_search",
+             "http_upload", "ftp_retr_small", "ftp_retr_large", "ftp_stor")
+
+# ----- dataset -----
+
+def dataset_spec(args):
+    return {
+        "small_files": args.small_files,
+        "small_max_size": args.small_max_size,
+        "sparse_files": args.sparse_files,
+        "sparse_size": args.sparse_size,
+        "dir_entries": args.dir_entries,
+        "seed": args.seed,
+    }
+
+def build_dataset(directory, spec):
+    """Create the test files, or reuse them if 'directory' already holds this spec"""
+    marker = os.path.join(directory, DATASET_MARKER)
+    try:
+        with open(marker) as f:
+            if json.load(f) == spec:
+                logging.info(f"Reusing dataset in {directory}")
+                return
+    except (OSError, ValueError):
+        pass
+
+    logging.info(f"Generating dataset in {directory}")
+    rng = random.Random(spec["seed"])
+    for sub in (SMALL_DIR, BIG_DIR, SPARSE_DIR, UPLOAD_DIR):
+        os.makedirs(os.path.join(directory, sub), exist_ok=True)
+
+    # Many small files with random content, so compression has real work to do
+    for i in range(spec["small_files"]):
+        size = rng.randint(1, spec["small_max_size"])
+        with open(os.path.join(directory, SMALL_DIR, f"file-{i:06d}.bin"), "wb") as f:
+            f.write(rng.randbytes(size))
+
+    # Large files that cost no disk space; reading them returns zeros
+    for i in range(spec["sparse_files"]):
+        with open(os.path.join(directory, SPARSE_DIR, f"sparse-{i}.img"), "wb") as f:
+            f.truncate(spec["sparse_size"])
+
+    # A directory with many empty entries for listing
+    big = os.path.join(directory, BIG_DIR)
+    for i in range(spec["dir_entries"]):
+        open(os.path.join(big, f"entry-{i:06d}.txt"), "wb").close()
+
+    with open(marker, "w") as f:
+        json.dump(spec, f)
+
+# ----- server process -----
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def process_usage():
+    """CPU seconds and memory of the current process"""
+    times = os.times()
+    usage = {"cpu_user": times.user, "cpu_system": times.system, "rss_mb": None, "peak_rss_mb": None}
+    try:
+        with open("/proc/self/statm") as f:
+            usage["rss_mb"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / MB
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        usage["peak_rss_mb"] = peak / MB if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        pass  # Windows
+    return usage
+
+def _server_main(directory, http_port, ftp_port, options, conn):
+    """
+    Child process: run both servers and answer "usage" and "stop" requests
+    from the benchmark until told to stop.
+    """
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    # Request logging stays on (it is part of the cost), but out of the report
+    sys.stderr = open(os.devnull, "w")
+    logging.basicConfig(level=logging.WARNING)
+    from http_server import start_http_server
+    from ftp_server import start_ftp_server
+
+    # Every client comes from loopback, so per-IP caps would only limit the benchmark
+    http_server = start_http_server(directory, http_port, workers=options["workers"],
+                                    engine=options["engine"], processes=1,
+                                    compression=options["compression"], max_connections_per_ip=0,
+                                    durability=options["durability"], hash_workers=options["hash_workers"],
+                                    search=options["search"])
+    ftp_server = start_ftp_server("bench", "bench", directory, ftp_port,
+                                  concurrency=options["ftp_concurrency"], max_cons_per_ip=0,
+                                  durability=options["durability"])
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    threading.Thread(target=ftp_server.serve_forever, kwargs={"handle_exit": False}, daemon=True).start()
+    conn.send({"ftp_host": ftp_server.address[0]})
+
+    while True:
+        command = conn.recv()
+        if command == "usage":
+            conn.send(process_usage())
+        elif command == "stop":
+            break
+    http_server.shutdown()
+    http_server.server_close()
+    ftp_server.close_all()
+    conn.send("stopped")
+
+class ServerProcess:
+    """The servers under test, in their own process so their CPU and memory can be measured alone"""
+
+    def __init__(self, directory, options):
+        self.http_port = free_port()
+        self.ftp_port = free_port()
+        context = multiprocessing.get_context("spawn")
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_server_main, name="bench-servers", daemon=True,
+                                       args=(directory, self.http_port, self.ftp_port, options, child_conn))
+        self.process.start()
+        if not self.conn.poll(30):
+            self.process.terminate()
+            raise RuntimeError("Servers did not start")
+        self.ftp_host = self.conn.recv()["ftp_host"]
+
+    def usage(self):
+        self.conn.send("usage")
+        return self.conn.recv()
+
+    def stop(self):
+        try:
+            self.conn.send("stop")
+            self.conn.poll(15)
+        except OSError:
+            pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+
+# ----- clients -----
+
+class HTTPClient:
+    """One keep-alive connection; reconnects after errors"""
+
+    def __init__(self, port, timeout):
+        self.port = port
+        self.timeout = timeout
+        self.conn = None
+        self.buffer = bytearray(READ_SIZE)
+
+    def request(self, method, path, body=None, headers=None):
+        """Send a request and read the whole response; returns (status, body bytes received)"""
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=self.timeout)
+        try:
+            self.conn.request(method, path, body=body, headers=headers or {})
+            response = self.conn.getresponse()
+            received = 0
+            view = memoryview(self.buffer)
+            while True:
+                n = response.readinto(view)
+                if not n:
+                    break
+                received += n
+            if response.will_close:
+                self.close()
+            return response.status, received
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+def multipart_body(name, payload, boundary="bench-boundary"):
+    head = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{name}"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n').encode()
+    return head + payload + f"\r\n--{boundary}--\r\n".encode(), f"multipart/form-data; boundary={boundary}"
+
+class FTPClient:
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.ftp = None
+
+    def connect(self):
+        if self.ftp is None:
+            self.ftp = ftplib.FTP(timeout=self.timeout)
+            self.ftp.connect(self.host, self.port)
+            self.ftp.login("bench", "bench")
+        return self.ftp
+
+    def retr(self, path):
+        received = [0]
+        def count(chunk):
+            received[0] += len(chunk)
+        try:
+            self.connect().retrbinary(f"RETR {path}", count, blocksize=READ_SIZE)
+        except Exception:
+            self.close()
+            raise
+        return received[0]
+
+    def stor(self, path, payload):
+        try:
+            self.connect().storbinary(f"STOR {path}", io.BytesIO(payload), blocksize=READ_SIZE)
+        except Exception:
+            self.close()
+            raise
+        return len(payload)
+
+    def close(self):
+        if self.ftp is not None:
+            try:
+                self.ftp.close()
+            except OSError:
+                pass
+            self.ftp = None
+
+# ----- scenarios -----
+
+def make_operation(name, worker, server, args, dataset, upload_payload):
+    """A per-worker callable that performs one operation and returns the bytes it moved"""
+    rng = random.Random(args.seed + worker)
+    small = [f"/{SMALL_DIR}/file-{i:06d}.bin" for i in range(dataset["small_files"])]
+    sparse = [f"/{SPARSE_DIR}/sparse-{i}.img" for i in range(dataset["sparse_files"])]
+    accept = {"Accept-Encoding": "gzip"} if args.accept_gzip else {}
+
+    if name.startswith("http"):
+        client = HTTPClient(server.http_port, args.timeout)
+
+        def checked(status, received, expected=(200,)):
+            if status not in expected:
+                raise RuntimeError(f"HTTP {status}")
+            return received
+
+        if name == "http_small":
+            op = lambda: checked(*client.request("GET", quote(rng.choice(small)), headers=accept))
+        elif name == "http_large":
+            op = lambda: checked(*client.request("GET", quote(rng.choice(sparse))))
+        elif name == "http_listing":
+            op = lambda: checked(*client.request("GET", f"/{BIG_DIR}/?page={rng.randint(1, 50)}",
+                                                 headers=accept))
+        elif name == "http_listing_json":
+            op = lambda: checked(*client.request("GET", f"/{BIG_DIR}/?format=json&page={rng.randint(1, 50)}",
+                                                 headers=accept))
+        elif name == "http_search":
+            # Name fragments over the whole dataset, some with a size filter
+            def op():
+                query = f"q=file-{rng.randint(0, 999):03d}" + ("&min_size=8K" if rng.random() < 0.5 else "")
+                return checked(*client.request("GET", f"/search?{query}", headers=accept))
+        elif name == "http_upload":
+            body, content_type = multipart_body(f"bench-upload-{worker}.bin", upload_payload)
+            headers = {"Content-Type": content_type}
+            def op():
+                checked(*client.request("POST", "/upload", body=body, headers=headers))
+                return len(upload_payload)
+        return op, client.close
+
+    client = FTPClient(server.ftp_host, server.ftp_port, args.timeout)
+    if name == "ftp_retr_small":
+        op = lambda: client.retr(rng.choice(small).lstrip("/"))
+    elif name == "ftp_retr_large":
+        op = lambda: client.retr(rng.choice(sparse).lstrip("/"))
+    elif name == "ftp_stor":
+        op = lambda: client.stor(f"{UPLOAD_DIR}/bench-stor-{worker}.bin", upload_payload)
+    return op, client.close
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+def run_scenario(name, server, args, dataset, upload_payload):
+    """
+    Run 'name' with args.concurrency workers for args.warmup plus
+    args.duration seconds. One operation runs alone first to fill the
+    server's caches, and only operations started after the warm-up count,
+    so the numbers describe the steady state.
+    """
+    prime, close = make_operation(name, 0, server, args, dataset, upload_payload)
+    try:
+        prime()
+    except Exception as e:
+        logging.warning(f"{name}: first operation failed: {e}")
+    finally:
+        close()
+
+    latencies = [[] for _ in range(args.concurrency)]
+    moved = [0] * args.concurrency
+    errors = [0] * args.concurrency
+    error_samples = []
+    start_barrier = threading.Barrier(args.concurrency + 1)
+    measure_from = time.perf_counter() + 3600  # set for real once every worker is ready
+    deadline = measure_from
+
+    def worker(index):
+        op, close = make_operation(name, index, server, args, dataset, upload_payload)
+        start_barrier.wait()
+        try:
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                measured = started >= measure_from
+                try:
+                    n = op()
+                except Exception as e:
+                    if measured:
+                        errors[index] += 1
+                        if len(error_samples) < 5:
+                            error_samples.append(f"{type(e).__name__}: {e}")
+                    continue
+                if measured:
+                    moved[index] += n
+                    latencies[index].append(time.perf_counter() - started)
+        finally:
+            close()
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    measure_from = time.perf_counter() + args.warmup
+    deadline = measure_from + args.duration
+    start_barrier.wait()
+    time.sleep(max(0.0, measure_from - time.perf_counter()))
+    before, client_before = server.usage(), os.times()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - measure_from
+    after, client_after = server.usage(), os.times()
+
+    samples = sorted(x for per_worker in latencies for x in per_worker)
+    total_bytes = sum(moved)
+    ms = lambda seconds: None if seconds is None else round(seconds * 1000, 3)
+    server_cpu = (after["cpu_user"] - before["cpu_user"]) + (after["cpu_system"] - before["cpu_system"])
+    client_cpu = (client_after.user - client_before.user) + (client_after.system - client_before.system)
+    return {
+        "concurrency": args.concurrency,
+        "seconds": round(elapsed, 3),
+        "operations": len(samples),
+        "errors": sum(errors),
+        "error_samples": error_samples,
+        "bytes": total_bytes,
+        "ops_per_second": round(len(samples) / elapsed, 2),
+        "throughput_mb_s": round(total_bytes / MB / elapsed, 2),
+        "latency_ms": {
+            "p50": ms(percentile(samples, 50)),
+            "p90": ms(percentile(samples, 90)),
+            "p99": ms(percentile(samples, 99)),
+            "max": ms(samples[-1] if samples else None),
+        },
+        "server_cpu_seconds": round(server_cpu, 3),
+        "server_cpu_percent": round(100 * server_cpu / elapsed, 1),
+        "server_rss_mb": after["rss_mb"] and round(after["rss_mb"], 1),
+        "server_peak_rss_mb": after["peak_rss_mb"] and round(after["peak_rss_mb"], 1),
+        "client_cpu_percent": round(100 * client_cpu / elapsed, 1),
+    }
+
+def cleanup_uploads(directory):
+    for path in [os.path.join(directory, UPLOAD_DIR)] + [directory]:
+        for entry in os.listdir(path):
+            if entry.startswith(("bench-upload-", "bench-stor-")):
+                os.remove(os.path.join(path, entry))
+
+# ----- reporting -----
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def print_summary(results, out):
+    print(f"{'scenario':<20}{'ops/s':>10}{'MB/s':>10}{'p50 ms':>10}{'p99 ms':>10}"
+          f"{'errors':>8}{'srv cpu%':>10}{'srv rss':>9}", file=out)
+    for name, r in results["scenarios"].items():
+        print(f"{name:<20}{r['ops_per_second']:>10}{r['throughput_mb_s']:>10}"
+              f"{r['latency_ms']['p50'] or '-':>10}{r['latency_ms']['p99'] or '-':>10}"
+              f"{r['errors']:>8}{r['server_cpu_percent']:>10}{r['server_rss_mb'] or '-':>9}", file=out)
+
+def print_comparison(results, baseline_path, out):
+    """Relative change of each scenario against an earlier report"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def change(new, old, lower_is_better=False):
+        if not new or not old:
+            return "-"
+        pct = (new - old) / old * 100
+        better = pct < 0 if lower_is_better else pct > 0
+        return f"{pct:+.1f}%{'' if abs(pct) < 5 else (' better' if better else ' worse')}"
+
+    print(f"\nCompared with {baseline_path} ({baseline['meta'].get('revision') or 'unknown revision'}):",
+          file=out)
+    print(f"{'scenario':<20}{'ops/s':>16}{'MB/s':>16}{'p99':>16}{'srv cpu':>16}", file=out)
+    for name, r in results["scenarios"].items():
+        old = baseline["scenarios"].get(name)
+        if old is None:
+            continue
+        print(f"{name:<20}{change(r['ops_per_second'], old['ops_per_second']):>16}"
+              f"{change(r['throughput_mb_s'], old['throughput_mb_s']):>16}"
+              f"{change(r['latency_ms']['p99'], old['latency_ms']['p99'], True):>16}"
+              f"{change(r['server_cpu_percent'], old['server_cpu_percent'], True):>16}", file=out)
+
+# ----- command line -----
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the HTTP and FTP servers on loopback.")
+    parser.add_argument("--data-dir", default=os.path.join(os.path.expanduser("~"), ".ftp-http-bench"),
+                        help="where the generated dataset lives (reused between runs)")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--compare", metavar="REPORT", help="show changes against an earlier JSON report")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=2.0, help="unmeasured seconds before each scenario")
+    parser.add_argument("--concurrency", type=int, default=16, help="client connections per scenario")
+    parser.add_argument("--timeout", type=float, default=60.0, help="client socket timeout")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--small-files", type=int, default=10000)
+    parser.add_argument("--small-max-size", type=int, default=16 * 1024)
+    parser.add_argument("--sparse-files", type=int, default=2)
+    parser.add_argument("--sparse-size", type=int, default=2 * 1024 * MB)
+    parser.add_argument("--dir-entries", type=int, default=50000)
+    parser.add_argument("--upload-size", type=int, default=8 * MB)
+    parser.add_argument("--accept-gzip", action="store_true", help="ask for compressed responses")
+    parser.add_argument("--engine", choices=("threads", "asyncio"), default="threads")
+    parser.add_argument("--workers", type=int, default=16, help="HTTP worker threads")
+    parser.add_argument("--no-compression", dest="compression", action="store_false")
+    parser.add_argument("--ftp-concurrency", choices=("async", "threads", "processes"), default="threads")
+    parser.add_argument("--durability", choices=("none", "fsync", "periodic"), default="none",
+                        help="how uploads are synced to disk")
+    parser.add_argument("--hash-workers", type=int, default=0,
+                        help="threads hashing the dataset for the content index (default 0: off)")
+    parser.add_argument("--no-search", dest="search", action="store_false",
+                        help="don't build the search index")
+    parser.add_argument("--quick", action="store_true",
+                        help="small dataset and short runs, for a smoke test of the harness")
+    args = parser.parse_args(argv)
+    if args.quick:
+        # Only options left at their defaults are scaled down
+        quick = dict(duration=2.0, warmup=0.5, concurrency=4, small_files=200, sparse_files=1,
+                     sparse_size=64 * MB, dir_entries=2000, upload_size=MB)
+        for name, value in quick.items():
+            if getattr(args, name) == parser.get_default(name):
+                setattr(args, name, value)
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    args = parse_args(argv)
+    dataset = dataset_spec(args)
+    directory = os.path.abspath(args.data_dir)
+    build_dataset(directory, dataset)
+    upload_payload = random.Random(args.seed).randbytes(args.upload_size)
+
+    options = {"engine": args.engine, "workers": args.workers, "compression": args.compression,
+               "ftp_concurrency": args.ftp_concurrency, "durability": args.durability,
+               "hash_workers": args.hash_workers, "search": args.search}
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "dataset": dataset,
+            "server": options,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "concurrency": args.concurrency,
+            "upload_size": args.upload_size,
+            "accept_gzip": args.accept_gzip,
+        },
+        "scenarios": {},
+    }
+
+    server = ServerProcess(directory, options)
+    try:
+        for name in args.scenarios:
+            logging.info(f"Running {name} ({args.concurrency} clients, {args.duration:g}s)")
+            results["scenarios"][name] = run_scenario(name, server, args, dataset, upload_payload)
+    finally:
+        server.stop()
+        cleanup_uploads(directory)
+
+    # Without --output the JSON goes to stdout and the tables to stderr
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        logging.info(f"Report written to {args.output}")
+        out = sys.stdout
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        out = sys.stderr
+    print_summary(results, out)
+    if args.compare:
+        print_comparison(results, args.compare, out)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+# compression.py
+import os
+import sys
+import zlib
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+MIN_COMPRESS_SIZE = 1024
+COMPRESS_READ_SIZE = 1024 * 1024
+DEFAULT_CACHE_SIZE = 1024**3  # 1GB of compressed variants on disk
+STALE_TMP_AGE = 3600
+SCAN_INTERVAL = 30.0  # re-total the folder at least this often, for variants other processes added
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+BROTLI_QUALITY = 5
+
+# Preferred first when the client accepts several equally
+PREFERENCE = [enc for enc, available in (("zstd", zstandard), ("br", brotli), ("gzip", True)) if available]
+
+# Formats that are compressed already; recompressing them only burns CPU
+_COMPRESSED_PREFIXES = ("image/", "audio/", "video/", "font/")
+_COMPRESSED_TYPES = {
+    "application/zip", "application/gzip", "application/x-gzip", "application/x-bzip2",
+    "application/x-xz", "application/zstd", "application/x-7z-compressed",
+    "application/x-rar-compressed", "application/vnd.rar", "application/java-archive",
+    "application/x-compress", "application/pdf", "application/epub+zip",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+    "application/x-iso9660-image", "application/octet-stream",
+}
+_COMPRESSIBLE_EXCEPTIONS = {"image/svg+xml", "image/bmp", "image/x-ms-bmp", "font/ttf", "font/otf"}
+
+def is_compressible(content_type, size):
+    """False for small bodies and types that are compressed already"""
+    if size < MIN_COMPRESS_SIZE:
+        return False
+    content_type = content_type.split(";")[0].strip().lower()
+    if content_type in _COMPRESSIBLE_EXCEPTIONS:
+        return True
+    return not (content_type.startswith(_COMPRESSED_PREFIXES) or content_type in _COMPRESSED_TYPES)
+
+def negotiate(accept_encoding):
+    """Pick the best supported encoding from an Accept-Encoding header, or None"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[coding.strip().lower()] = q
+    wildcard = weights.get("*", 0.0)
+    best, best_q = None, 0.0
+    for enc in PREFERENCE:
+        q = weights.get(enc, wildcard)
+        if q > best_q:
+            best, best_q = enc, q
+    return best
+
+def choose_encoding(headers):
+    """Content-Encoding for a response body (or a HEAD response's headers), or None to send it as is"""
+    if 'Range' in headers:
+        return None  # ranges refer to the stored bytes
+    return negotiate(headers.get('Accept-Encoding'))
+
+class StreamCompressor:
+    """compress()/flush() interface over zlib, zstandard and brotli"""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == "gzip":
+            self._obj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+            self.compress, self._flush = self._obj.compress, self._obj.flush
+        elif encoding == "zstd":
+            self._obj = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+            self.compress, self._flush = self._obj.compress, self._obj.flush
+        elif encoding == "br":
+            self._obj = brotli.Compressor(quality=BROTLI_QUALITY)
+            self.compress, self._flush = self._obj.process, self._obj.finish
+        else:
+            raise ValueError(f"Unsupported encoding: {encoding}")
+
+    def flush(self):
+        return self._flush()
+
+def default_cache_dir():
+    """Per-user cache folder: under %LOCALAPPDATA%, ~/Library/Caches or $XDG_CACHE_HOME"""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser(os.path.join("~", "AppData", "Local"))
+    elif sys.platform == "darwin":
+        base = os.path.expanduser(os.path.join("~", "Library", "Caches"))
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser(os.path.join("~", ".cache"))
+    return os.path.join(base, "ftp-http-server", "compressed")
+
+def prepare_cache_dir(directory=None):
+    """
+    Create the cache folder, private to this user, and return it. Without
+    'directory' this is default_cache_dir(), or a new temporary folder if
+    that can't be created (e.g. a service user without a home).
+    """
+    if directory is None:
+        try:
+            return prepare_cache_dir(default_cache_dir())
+        except OSError as e:
+            directory = tempfile.mkdtemp(prefix="ftp-http-server-cache-")
+            logging.warning(f"Using {directory} for compressed files: {e}")
+            return directory
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    # Someone else's folder could hold planted variants, or deny us writes
+    if hasattr(os, "getuid") and os.stat(directory).st_uid != os.getuid():
+        raise PermissionError(f"Cache folder {directory} belongs to another user")
+    return directory
+
+def compress_bytes(data, encoding):
+    c = StreamCompressor(encoding)
+    return c.compress(data) + c.flush()
+
+class VariantWriter:
+    """
+    Temp file for a new cache entry that is dropped as soon as it grows past
+    'limit' bytes; later writes are ignored, so a variant too big to be
+    cached doesn't cost a full extra disk write on every request
+    """
+
+    def __init__(self, directory, limit):
+        self.limit = limit
+        self.size = 0
+        self.file = None
+        if limit > 0:
+            fd, self.path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            self.file = os.fdopen(fd, "wb")
+
+    def write(self, data):
+        if self.file is None:
+            return
+        self.size += len(data)
+        if self.size > self.limit:
+            self.discard()
+        else:
+            self.file.write(data)
+
+    def close(self):
+        """Finish the file; False if it was dropped"""
+        if self.file is None:
+            return False
+        self.file.close()
+        self.file = None
+        return True
+
+    def discard(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+class CompressedCache:
+    """
+    On-disk cache of compressed file variants with a total size cap and
+    LRU eviction. Entries are keyed by file path, stat identity and
+    encoding, so a changed file simply misses and its stale variant ages out.
+    The folder itself is the index: a hit touches the variant's mtime and
+    eviction lists the folder, so server processes sharing it see each
+    other's variants and stay under one 'max_size' together.
+    """
+
+    def __init__(self, directory=None, max_size=DEFAULT_CACHE_SIZE):
+        self.directory = prepare_cache_dir(directory)
+        self.max_size = max_size
+        self.max_entry_size = max_size // 4
+        self._total = 0  # bytes in the folder at the last scan, plus what this process added since
+        self._scanned = 0.0
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()
+        self._scan()
+
+    @staticmethod
+    def key(path, identity, encoding):
+        digest = hashlib.sha1(repr((path, identity)).encode("utf-8", "surrogateescape")).hexdigest()
+        return f"{digest}.{encoding}"
+
+    def lookup(self, key):
+        """Open file of a cached variant, or None"""
+        try:
+            f = open(os.path.join(self.directory, key), "rb")
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(f.name)  # most recently used, for every process's eviction
+        except OSError:
+            pass
+        return f
+
+    def writer(self):
+        """VariantWriter to fill with a new variant; pass it to commit() or discard() it"""
+        return VariantWriter(self.directory, self.max_entry_size)
+
+    def commit(self, key, writer):
+        """Move a finished variant into the cache, unless it outgrew max_entry_size"""
+        if not writer.close():
+            return
+        try:
+            os.replace(writer.path, os.path.join(self.directory, key))
+        except OSError as e:  # e.g. Windows, while another request reads the old variant
+            logging.debug(f"Could not cache {key}: {e}")
+            os.remove(writer.path)
+            return
+        with self._lock:
+            self._total += writer.size
+            due = self._total > self.max_size or time.monotonic() - self._scanned > SCAN_INTERVAL
+        if due:
+            self._scan()
+
+    def _scan(self):
+        """
+        Total the variants in the folder, whichever process wrote them, and
+        remove the least recently used ones over max_size
+        """
+        if not self._scan_lock.acquire(blocking=False):
+            return  # another thread is at it
+        try:
+            found = []
+            now = time.time()
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    try:
+                        st = entry.stat()
+                        if entry.name.endswith(".tmp"):
+                            # Interrupted write from a previous run; recent ones may
+                            # belong to another server process sharing the cache
+                            if now - st.st_mtime > STALE_TMP_AGE:
+                                os.remove(entry.path)
+                            continue
+                    except FileNotFoundError:
+                        continue  # evicted or committed by another process meanwhile
+                    found.append((st.st_mtime, entry.name, st.st_size))
+            total = sum(size for _, _, size in found)
+            for _, name, size in sorted(found):
+                if total <= self.max_size:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass  # another process evicted it first
+                except OSError as e:
+                    logging.debug(f"Could not evict {name}: {e}")
+                    continue
+                total -= size
+            with self._lock:
+                self._total = total
+                self._scanned = time.monotonic()
+        finally:
+            self._scan_lock.release()
@@ -0,0 +1,399 @@
+# content_index.py
+import os
+import re
+import json
+import base64
+import time
+import errno
+import shutil
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from file_cache import hash_file
+from uploads import (TEMP_PREFIX, DEFAULT_DURABILITY, is_temp_upload, create_temp,
+                     sync_file, sync_directory)
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+HASH_UPLOAD_PATH = "/upload/hash"
+INDEX_FILE_NAME = "content-index.jsonl"
+DEFAULT_HASH_WORKERS = 2
+RESCAN_INTERVAL = 600.0   # full walks of the share, for changes made by FTP or other programs
+REFRESH_INTERVAL = 10.0   # reads of hashes logged by other server processes
+LINK_METHODS = ("copy", "reflink", "hardlink")
+COPY_STEP = 64 * 1024 * 1024
+FICLONE = 0x40049409      # Linux ioctl: share the source's extents (btrfs, XFS, ...)
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+def _version(st):
+    """What must stay the same for a recorded hash to still describe the file"""
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+class ContentIndex:
+    """
+    SHA-256 of every regular file in the shared 'directory', hashed by a
+    pool of 'workers' background threads and kept in an append-only log in
+    'state_dir', so a restart only hashes what changed meanwhile. Entries
+    are checked against a fresh stat() before use. The share is walked at
+    start and every RESCAN_INTERVAL seconds; files the server writes itself
+    are hashed as they are stored, and ones found changed on download are
+    queued again. When several server processes share the folder, the one
+    holding the log's lock walks the share; the others read its log.
+    """
+
+    def __init__(self, directory, state_dir, workers=DEFAULT_HASH_WORKERS, hidden=()):
+        self.directory = directory
+        self.hidden = frozenset(hidden)
+        self.log_path = os.path.join(state_dir, INDEX_FILE_NAME)
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="content-hash")
+        self._slots = threading.BoundedSemaphore(max(1, workers) * 4)  # hash jobs queued by a walk
+        self._entries = {}     # relative path -> (version, digest)
+        self._by_digest = {}   # digest -> set of relative paths
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        self._log_identity = None
+        self._log_offset = 0
+        self._lock_file = None
+        self._stop = threading.Event()
+        self.hashed = 0
+        os.makedirs(state_dir, exist_ok=True)
+        self._refresh()
+        self._thread = threading.Thread(target=self._run, name="content-index", daemon=True)
+        self._thread.start()
+
+    # ----- lookups -----
+
+    def digest(self, path, st):
+        """SHA-256 of this version of 'path', or None (and queue it) if not hashed yet"""
+        rel = self._relative(path)
+        if rel is None:
+            return None
+        entry = self._entries.get(rel)
+        if entry is not None and entry[0] == _version(st):
+            return entry[1]
+        if self._lock_file is not None:
+            self.update(path)
+        return None
+
+    def find(self, digest, size):
+        """(path, stat) of a file in the share with this content, or None"""
+        self._refresh()
+        with self._lock:
+            candidates = list(self._by_digest.get(digest, ()))
+        for rel in candidates:
+            path = os.path.join(self.directory, rel)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entry = self._entries.get(rel)
+            if entry is not None and entry[0] == _version(st) and entry[1] == digest and st.st_size == size:
+                return path, st
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {"files": len(self._entries), "pending": len(self._pending), "hashed": self.hashed,
+                    "scanner": self._lock_file is not None}
+
+    # ----- updates -----
+
+    def update(self, path):
+        """Hash 'path' in the background, e.g. after an upload replaced it"""
+        rel = self._relative(path)
+        if rel is None or self._stop.is_set():
+            return
+        with self._lock:
+            if rel in self._pending:
+                return
+            self._pending.add(rel)
+        self.executor.submit(self._hash, rel)
+
+    def record(self, path, st, digest):
+        """Store a hash computed elsewhere for this version of 'path'"""
+        rel = self._relative(path)
+        if rel is not None:
+            self._set(rel, _version(st), digest)
+            self._append({"path": rel, "version": list(_version(st)), "sha256": digest})
+
+    def _hash(self, rel):
+        path = os.path.join(self.directory, rel)
+        try:
+            before = os.stat(path)
+            entry = self._entries.get(rel)
+            if entry is not None and entry[0] == _version(before):
+                return
+            digest = hash_file(path)
+            after = os.stat(path)
+        except OSError:
+            self._set(rel, None, None)
+            return
+        finally:
+            with self._lock:
+                self._pending.discard(rel)
+        if _version(before) != _version(after):
+            return  # changed while being read; the next walk or download queues it again
+        self.record(path, after, digest)
+        with self._lock:
+            self.hashed += 1
+
+    def _set(self, rel, version, digest):
+        with self._lock:
+            old = self._entries.pop(rel, None)
+            if old is not None:
+                paths = self._by_digest.get(old[1])
+                if paths:
+                    paths.discard(rel)
+                    if not paths:
+                        del self._by_digest[old[1]]
+            if digest is not None:
+                self._entries[rel] = (tuple(version), digest)
+                self._by_digest.setdefault(digest, set()).add(rel)
+
+    def _relative(self, path):
+        rel = os.path.relpath(path, self.directory)
+        if rel.startswith(os.pardir) or os.path.isabs(rel):
+            return None
+        return rel.replace(os.sep, '/')
+
+    # ----- log -----
+
+    def _append(self, record):
+        line = json.dumps(record, separators=(',', ':')) + "\n"
+        try:
+            # One write() per line, so lines of processes appending at once don't interleave
+            with open(self.log_path, "a") as f:
+                f.write(line)
+        except OSError as e:
+            logging.warning(f"Couldn't update the content index: {e}")
+
+    def _refresh(self):
+        """Read lines appended to the log since the last call; start over if it was compacted"""
+        with self._log_lock:
+            records = self._read_log()
+        for record in records:
+            try:
+                rel, digest = record["path"], record.get("sha256")
+                version = record.get("version")
+                self._set(rel, version, digest if version else None)
+            except (KeyError, TypeError, AttributeError):
+                continue
+
+    def _read_log(self):
+        try:
+            with open(self.log_path, "rb") as f:
+                st = os.fstat(f.fileno())
+                identity = (st.st_dev, st.st_ino)
+                if identity != self._log_identity or st.st_size < self._log_offset:
+                    self._log_identity, self._log_offset = identity, 0
+                if st.st_size == self._log_offset:
+                    return []
+                f.seek(self._log_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        end = data.rfind(b"\n") + 1  # a partially written last line is read next time
+        self._log_offset += end
+        records = []
+        for line in data[:end].splitlines():
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+        return records
+
+    def _compact(self):
+        """Rewrite the log with one line per file; only the scanning process does this"""
+        with self._lock:
+            records = [{"path": rel, "version": list(version), "sha256": digest}
+                       for rel, (version, digest) in self._entries.items()]
+        tmp = self.log_path + ".tmp"
+        with open(tmp, "w") as f:
+            for record in records:
+                f.write(json.dumps(record, separators=(',', ':')) + "\n")
+        os.replace(tmp, self.log_path)
+
+    # ----- background walk -----
+
+    def _acquire(self):
+        """Become the process that walks the share, if no other one is"""
+        if self._lock_file is not None:
+            return True
+        f = open(self.log_path + ".lock", "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                return False
+        self._lock_file = f
+        return True
+
+    def _run(self):
+        next_walk = 0
+        while not self._stop.is_set():
+            self._refresh()
+            if time.monotonic() >= next_walk and self._acquire():
+                try:
+                    self._walk()
+                except Exception:
+                    logging.exception("Content index walk failed")
+                next_walk = time.monotonic() + RESCAN_INTERVAL
+            self._stop.wait(REFRESH_INTERVAL)
+
+    def _walk(self):
+        started = time.monotonic()
+        seen = set()
+        stack = [""]
+        while stack and not self._stop.is_set():
+            rel_dir = stack.pop()
+            try:
+                with os.scandir(os.path.join(self.directory, rel_dir)) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.name in self.hidden or is_temp_upload(entry.name):
+                    continue
+                rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(rel)
+                        continue
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                seen.add(rel)
+                cached = self._entries.get(rel)
+                if cached is not None and cached[0] == _version(st):
+                    continue
+                # Don't queue a job per file of a huge tree up front
+                while not self._slots.acquire(timeout=1.0):
+                    if self._stop.is_set():
+                        return
+                with self._lock:
+                    queued = rel not in self._pending
+                    self._pending.add(rel)
+                if queued:
+                    self.executor.submit(self._walk_job, rel)
+                else:
+                    self._slots.release()
+        if self._stop.is_set():
+            return
+        with self._lock:
+            vanished = [rel for rel in self._entries if rel not in seen]
+        for rel in vanished:
+            self._set(rel, None, None)
+        self._compact()
+        logging.info(f"Content index: {len(self._entries)} files, walked in "
+                     f"{time.monotonic() - started:.1f}s")
+
+    def _walk_job(self, rel):
+        try:
+            self._hash(rel)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        self._stop.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+def check_digest(digest):
+    digest = str(digest).lower()
+    if not _DIGEST_RE.match(digest):
+        raise ValueError("sha256 must be 64 hex digits")
+    return digest
+
+def digest_header(digest):
+    """Repr-Digest (RFC 9530) value for a hex SHA-256"""
+    return f"sha-256=:{base64.b64encode(bytes.fromhex(digest)).decode('ascii')}:"
+
+def store_known_content(index, path, digest, size, method="copy", durability=DEFAULT_DURABILITY):
+    """
+    Put a file with the content 'digest' at 'path' without receiving it:
+    a copy of a file in the share with that content ("reflink" clones it
+    where the file system can, "hardlink" links it, falling back to a copy
+    across devices). Returns the method used, "exists" when 'path' already
+    has that content, or None when the index knows no such file.
+    """
+    if method not in LINK_METHODS:
+        raise ValueError(f"Unknown method: {method}")
+    found = index.find(digest, size)
+    if found is None:
+        return None
+    source, source_st = found
+    try:
+        if os.path.samefile(source, path) or index.digest(path, os.stat(path)) == digest:
+            return "exists"
+    except FileNotFoundError:
+        pass
+
+    directory = os.path.dirname(path)
+    if method == "hardlink":
+        temp_path = os.path.join(directory, f"{TEMP_PREFIX}{os.urandom(8).hex()}")
+        try:
+            os.link(source, temp_path)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP):
+                raise
+            method = "copy"
+        else:
+            os.replace(temp_path, path)
+            sync_directory(directory, durability)
+            index.record(path, os.stat(path), digest)
+            return method
+
+    fd, temp_path = create_temp(path)
+    try:
+        with open(source, "rb") as src, os.fdopen(fd, "wb") as dst:
+            if method != "reflink" or not _clone(src.fileno(), dst.fileno()):
+                method = "copy"
+                _copy(src, dst)
+            dst.flush()
+            if os.fstat(dst.fileno()).st_size != source_st.st_size:
+                raise OSError(errno.EIO, f"{source} changed while being copied")
+            sync_file(dst.fileno(), durability)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    sync_directory(directory, durability)
+    index.record(path, os.stat(path), digest)
+    return method
+
+def _clone(src_fd, dst_fd):
+    """Reflink copy; False where the file system (or OS) can't share extents"""
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    except OSError:
+        return False
+
+def _copy(src, dst):
+    """Copy in the kernel where possible (copy_file_range may also clone or copy server-side)"""
+    if hasattr(os, "copy_file_range"):
+        try:
+            while os.copy_file_range(src.fileno(), dst.fileno(), COPY_STEP):
+                pass
+            return
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+            src.seek(0)
+            dst.seek(0)
+            dst.truncate()
+    shutil.copyfileobj(src, dst, 1024 * 1024)
@@ -0,0 +1,222 @@
+# daemon.py
+import time
+
+STARTED = time.perf_counter()  # before the server modules load, so startup time includes them
+
+import os
+import sys
+import signal
+import inspect
+import logging
+import argparse
+import threading
+import configparser
+from ftp_server import start_ftp_server
+from http_server import start_http_server
+from bandwidth import BandwidthLimiter
+from metrics import Metrics
+from socket_activation import listen_sockets, notify
+from utils import get_local_ip, parse_size
+
+IMPORTED = time.perf_counter()
+
+# Config keys that aren't start_*_server() options, and options the daemon sets itself
+SERVICE_KEYS = ("enabled", "port", "username", "password")
+FIXED_OPTIONS = ("username", "password", "directory", "ftp_port", "http_port", "bandwidth", "metrics", "sock")
+DEFAULT_FTP_PORT = 2121
+DEFAULT_HTTP_PORT = 8000
+
+EXAMPLE_CONFIG = """\
+# Shared folder and services for `python main.py --config <this file>`
+[share]
+directory = /srv/share
+
+[ftp]
+enabled = yes
+port = 2121
+username = user
+password = pass
+# Any other start_ftp_server() option, e.g.
+# concurrency = threads
+# passive_ports = 60000-60099
+
+[http]
+enabled = yes
+port = 8000
+# Any other start_http_server() option, e.g.
+# processes = 0
+# engine = asyncio
+# durability = fsync
+# hash_workers = 2
+
+[bandwidth]
+# Bytes per second shared by FTP and HTTP (0 = unlimited), e.g.
+# read_limit = 10M
+# per_ip_write_limit = 2M
+"""
+
+def load_config(path):
+    """
+    Server settings from an INI file (see EXAMPLE_CONFIG): [share] names the
+    directory, [ftp] and [http] take 'enabled', 'port' (and for FTP the
+    login) plus any keyword option of start_ftp_server()/start_http_server(),
+    converted to the type of its default, and [bandwidth] takes
+    BandwidthLimiter's limits. Raises ValueError for unknown or invalid keys.
+    """
+    parser = configparser.ConfigParser(interpolation=None)
+    if not parser.read(path):
+        raise FileNotFoundError(f"Config file not found: {path}")
+    unknown = set(parser.sections()) - {"share", "ftp", "http", "bandwidth"}
+    if unknown:
+        raise ValueError(f"Unknown config section: [{sorted(unknown)[0]}]")
+    if not parser.has_option("share", "directory"):
+        raise ValueError("[share] directory is required")
+
+    config = {"directory": os.path.abspath(os.path.expanduser(parser.get("share", "directory")))}
+    for name, function, port in (("ftp", start_ftp_server, DEFAULT_FTP_PORT),
+                                 ("http", start_http_server, DEFAULT_HTTP_PORT)):
+        section = parser[name] if parser.has_section(name) else parser["DEFAULT"]
+        if not section.getboolean("enabled", True):
+            config[name] = None
+            continue
+        config[name] = {"port": section.getint("port", port), "options": _options(section, function)}
+        if name == "ftp":
+            config[name]["username"] = section.get("username", "user")
+            config[name]["password"] = section.get("password", "pass")
+    if not config["ftp"] and not config["http"]:
+        raise ValueError("Both servers are disabled")
+
+    config["bandwidth"] = {}
+    if parser.has_section("bandwidth"):
+        limits = inspect.signature(BandwidthLimiter).parameters
+        for key, value in parser["bandwidth"].items():
+            if key not in limits:
+                raise ValueError(f"Unknown option in [bandwidth]: {key}")
+            config["bandwidth"][key] = parse_size(value)
+    return config
+
+def _options(section, function):
+    """Keyword arguments for 'function' from the keys of 'section' that aren't SERVICE_KEYS"""
+    parameters = inspect.signature(function).parameters
+    options = {}
+    for key in section:
+        if key in SERVICE_KEYS:
+            continue
+        parameter = parameters.get(key)
+        if parameter is None or key in FIXED_OPTIONS or parameter.default is inspect.Parameter.empty:
+            raise ValueError(f"Unknown option in [{section.name}]: {key}")
+        try:
+            options[key] = _convert(section, key, parameter.default)
+        except ValueError as e:
+            raise ValueError(f"Invalid [{section.name}] {key}: {e}")
+    return options
+
+def _convert(section, key, default):
+    """A config value as the type of the option's default"""
+    value = section[key]
+    if key == "passive_ports":
+        first, _, last = value.partition("-")
+        return list(range(int(first), int(last or first) + 1))
+    if isinstance(default, bool) or key == "use_sendfile":
+        return section.getboolean(key)
+    if isinstance(default, int):
+        return parse_size(value) if key.endswith(("_size", "_limit")) else int(value)
+    if isinstance(default, float):
+        return float(value)
+    return value  # strings, and paths that default to None
+
+def activated_socket(sockets, name, port):
+    """The passed socket for a service, by FileDescriptorName= or else by port"""
+    for match in (lambda n, s: n == name, lambda n, s: s.getsockname()[1] == port):
+        for i, (sock_name, sock) in enumerate(sockets):
+            if match(sock_name, sock):
+                return sockets.pop(i)[1]
+    return None
+
+def run(config):
+    """Start the configured servers and serve until SIGTERM or SIGINT"""
+    sockets = listen_sockets()
+    bandwidth = BandwidthLimiter(**config["bandwidth"])
+    metrics = Metrics()
+    servers = []
+    try:
+        if config["ftp"]:
+            ftp = config["ftp"]
+            sock = activated_socket(sockets, "ftp", ftp["port"])
+            ftp_server = start_ftp_server(ftp["username"], ftp["password"], config["directory"], ftp["port"],
+                                          bandwidth=bandwidth, metrics=metrics, sock=sock, **ftp["options"])
+            servers.append(("FTP", ftp_server, {"handle_exit": False}))
+        if config["http"]:
+            http = config["http"]
+            sock = activated_socket(sockets, "http", http["port"])
+            http_server = start_http_server(config["directory"], http["port"], bandwidth=bandwidth,
+                                            metrics=metrics, sock=sock, **http["options"])
+            servers.append(("HTTP", http_server, {}))
+    except Exception:
+        _stop(servers)
+        raise
+    for name, sock in sockets:
+        logging.warning(f"Closing unused passed socket {name or sock.fileno()} ({sock.getsockname()})")
+        sock.close()
+
+    for name, server, kwargs in servers:
+        threading.Thread(target=server.serve_forever, kwargs=kwargs, name=f"{name.lower()}-server",
+                         daemon=True).start()
+    ready = time.perf_counter()
+    local_ip = get_local_ip()
+    logging.info(f"Started in {(ready - STARTED) * 1000:.0f} ms "
+                 f"({(IMPORTED - STARTED) * 1000:.0f} ms loading modules); LAN address {local_ip}")
+    notify(f"READY=1\nSTATUS=Serving {config['directory']} at {local_ip}")
+
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stop.set())
+    while not stop.wait(1.0):
+        pass
+    logging.info("Stopping servers")
+    notify("STOPPING=1")
+    _stop(servers)
+
+def _stop(servers):
+    for name, server, _ in servers:
+        try:
+            if name == "FTP":
+                server.close_all()
+            else:
+                server.shutdown()
+                server.server_close()
+        except Exception:
+            logging.exception(f"Error stopping the {name} server")
+
+def main(argv=None):
+    """Headless entry point: python main.py --config server.ini"""
+    parser = argparse.ArgumentParser(description="Share a folder over FTP and HTTP without the GUI.")
+    parser.add_argument("-c", "--config", help="INI file with the server settings")
+    parser.add_argument("--check", action="store_true", help="validate the config file and exit")
+    parser.add_argument("--example-config", action="store_true", help="print an example config file and exit")
+    parser.add_argument("--log-level", default="INFO", choices=("DEBUG", "INFO", "WARNING", "ERROR"))
+    args = parser.parse_args(argv)
+    if args.example_config:
+        print(EXAMPLE_CONFIG, end="")
+        return 0
+    if not args.config:
+        parser.error("--config is required")
+    logging.basicConfig(level=args.log_level, format="%(asctime)s - %(message)s")
+
+    try:
+        config = load_config(args.config)
+    except (OSError, ValueError, configparser.Error) as e:
+        logging.error(f"Invalid config: {e}")
+        return 2
+    if args.check:
+        logging.info(f"{args.config} is valid")
+        return 0
+    try:
+        run(config)
+    except Exception as e:
+        logging.error(f"Error starting servers: {e}", exc_info=args.log_level == "DEBUG")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,222 @@
+# file_cache.py
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from compression import compress_bytes
+
+DEFAULT_CACHE_ENTRIES = 10000
+DEFAULT_HASH_MAX_SIZE = 64 * 1024 * 1024  # larger files keep stat-based ETags in hash mode
+HASH_READ_SIZE = 1024 * 1024
+DEFAULT_HOT_CACHE_SIZE = 64 * 1024 * 1024
+DEFAULT_HOT_FILE_SIZE = 1024 * 1024
+HOT_ADMIT_HITS = 2          # requests a file needs before its content is kept in memory
+RACY_WINDOW_NS = 2 * 10**9  # a file modified this recently may change again within the same mtime
+
+def stat_identity(st):
+    """What has to stay the same for a file's cached metadata to remain valid"""
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+class Validators:
+    """ETag and Last-Modified for one version of a file, plus its SHA-256 when known"""
+    __slots__ = ("identity", "etag", "last_modified", "mtime", "digest")
+
+    def __init__(self, identity, etag, last_modified, mtime, digest=None):
+        self.identity = identity
+        self.etag = etag
+        self.last_modified = last_modified
+        self.mtime = mtime
+        self.digest = digest
+
+def hash_file(path):
+    """Hex SHA-256 of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        buf = bytearray(HASH_READ_SIZE)
+        view = memoryview(buf)
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            digest.update(view[:n])
+    return digest.hexdigest()
+
+class ValidatorCache:
+    """
+    LRU cache of per-file validators keyed by path and checked against a
+    fresh stat(), so answering a conditional request needs no extra I/O.
+    Files whose SHA-256 is in the content 'index' (a ContentIndex) get it
+    as their ETag. In 'hash' mode the others are hashed on the spot (once
+    per file version) up to hash_max_size; otherwise ETags are derived from
+    inode, size and mtime until the index has caught up with the file.
+    """
+
+    def __init__(self, mode="stat", max_entries=DEFAULT_CACHE_ENTRIES, hash_max_size=DEFAULT_HASH_MAX_SIZE,
+                 index=None):
+        if mode not in ("stat", "hash"):
+            raise ValueError(f"Unknown ETag mode: {mode}")
+        self.mode = mode
+        self.max_entries = max_entries
+        self.hash_max_size = hash_max_size
+        self.index = index
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, st):
+        identity = stat_identity(st)
+        with self._lock:
+            cached = self._entries.get(path)
+            if cached is not None and cached.identity == identity and (cached.digest or self.index is None):
+                self._entries.move_to_end(path)
+                return cached
+
+        digest = self.index.digest(path, st) if self.index is not None else None
+        if digest is None and cached is not None and cached.identity == identity:
+            return cached  # still being hashed
+        if digest is None and self.mode == "hash" and st.st_size <= self.hash_max_size:
+            digest = hash_file(path)
+            if self.index is not None:
+                self.index.record(path, st, digest)
+        if digest:
+            etag = f'"{digest}"'
+        else:
+            etag = f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+        validators = Validators(identity, etag, formatdate(st.st_mtime, usegmt=True), int(st.st_mtime), digest)
+
+        with self._lock:
+            self._entries[path] = validators
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return validators
+
+class HotFileCache:
+    """
+    Byte-budgeted LRU cache of the contents of small, frequently requested
+    files, and of their compressed variants, so repeat downloads are sent
+    from memory without opening the file. Entries are checked against the
+    stat() every request makes anyway and dropped when the file's size,
+    mtime or inode change. A file is only loaded once it has been asked
+    for HOT_ADMIT_HITS times, so a crawl over many files doesn't flush out
+    the ones that are actually hot. Hits are read-only memoryviews shared
+    by every request.
+    """
+
+    def __init__(self, max_size=DEFAULT_HOT_CACHE_SIZE, max_file_size=DEFAULT_HOT_FILE_SIZE):
+        self.max_size = max_size
+        self.max_file_size = min(max_file_size, max_size)
+        self._entries = OrderedDict()  # (path, encoding) -> (identity, memoryview)
+        self._seen = OrderedDict()     # (path, encoding) -> (identity, requests), for admission
+        self._total = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def lookup(self, path, st, encoding=None):
+        """The cached content for this version of the file, or None"""
+        if st.st_size > self.max_file_size:
+            return None
+        key = (path, encoding)
+        identity = stat_identity(st)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] == identity:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                self._remove(key)
+            self.misses += 1
+        return None
+
+    def admit(self, path, st, encoding=None):
+        """Count a miss; True once the file has been requested often enough to load() it"""
+        if st.st_size > self.max_file_size or time.time_ns() - st.st_mtime_ns < RACY_WINDOW_NS:
+            return False
+        key = (path, encoding)
+        identity = stat_identity(st)
+        with self._lock:
+            seen_identity, requests = self._seen.pop(key, (identity, 0))
+            requests = requests + 1 if seen_identity == identity else 1
+            if requests >= HOT_ADMIT_HITS:
+                return True
+            self._seen[key] = (identity, requests)
+            while len(self._seen) > DEFAULT_CACHE_ENTRIES:
+                self._seen.popitem(last=False)
+        return False
+
+    def load(self, path, st, encoding=None):
+        """Read the file (and compress it with 'encoding') into the cache; None if it changed meanwhile"""
+        identity = stat_identity(st)
+        with open(path, 'rb') as f:
+            if stat_identity(os.fstat(f.fileno())) != identity:
+                return None
+            data = f.read(st.st_size + 1)
+        if len(data) != st.st_size:
+            return None
+        if encoding:
+            data = compress_bytes(data, encoding)
+        view = memoryview(data)
+        with self._lock:
+            self._remove((path, encoding))
+            self._entries[(path, encoding)] = (identity, view)
+            self._total += len(view)
+            while self._total > self.max_size:
+                self._remove(next(iter(self._entries)))
+        return view
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total -= len(entry[1])
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._total,
+                    "hits": self.hits, "misses": self.misses}
+
+def etag_matches(header, etag, weak=True):
+    """Check an If-None-Match / If-Match style header against an ETag"""
+    if header.strip() == "*":
+        return True
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if weak and candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+def variant_etag(etag, encoding):
+    """Distinct ETag for a content-encoded representation"""
+    if not encoding:
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+def is_not_modified(headers, validators, etag):
+    """Evaluate If-None-Match / If-Modified-Since for a GET or HEAD"""
+    if_none_match = headers.get("If-None-Match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = headers.get("If-Modified-Since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return validators.mtime <= since.timestamp()
+    return False
+
+def if_range_matches(headers, validators):
+    """True if the Range header applies, i.e. If-Range is absent or still current"""
+    if_range = headers.get("If-Range")
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return etag_matches(if_range, validators.etag, weak=False)
+    try:
+        since = parsedate_to_datetime(if_range)
+    except (TypeError, ValueError):
+        return False
+    return validators.mtime == int(since.timestamp())
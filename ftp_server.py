@@ -1,37 +1,285 @@
 # ftp_server.py
 import os
 import logging
+import threading
 from pyftpdlib import servers
-from pyftpdlib.handlers import FTPHandler
+from pyftpdlib.handlers import FTPHandler, DTPHandler, ThrottledDTPHandler
 from pyftpdlib.authorizers import DummyAuthorizer
+from pyftpdlib.filesystems import AbstractedFS
 from utils import get_local_ip, test_local_ip, is_port_in_use
+from paths import is_private_name, is_private_path
+from bandwidth import MIN_DELAY
+from uploads import UploadFile, DEFAULT_DURABILITY, check_durability
 
-def start_ftp_server(username, password, directory, ftp_port):
+FTP_CONCURRENCY = ("async", "threads", "processes")
+DEFAULT_FTP_CONCURRENCY = "threads"
+DEFAULT_MAX_CONS = 256
+DEFAULT_MAX_CONS_PER_IP = 5
+PASSIVE_PORT_START = 60000
+DEFAULT_FTP_BUFFER_SIZE = 256 * 1024  # pyftpdlib default is 64KB
+
+class ShapedDTPHandler(ThrottledDTPHandler):
+    """
+    Data channel paced by a shared BandwidthLimiter ('bandwidth', set on a
+    per-server subclass) instead of pyftpdlib's per-connection counters, so
+    FTP and HTTP transfers draw from the same global, per-IP and per-user
+    budgets. While its flow waits the channel sleeps on the IO loop.
+    """
+
+    bandwidth = None
+
+    def __init__(self, sock, cmd_channel):
+        self._flows = {}
+        super().__init__(sock, cmd_channel)
+
+    def _flow(self, direction):
+        flow = self._flows.get(direction)
+        if flow is None:
+            flow = self._flows[direction] = self.bandwidth.flow(
+                direction, self.cmd_channel.remote_ip, self.cmd_channel.username)
+        return flow
+
+    def use_sendfile(self):
+        # sendfile() bypasses send(), so it can only be used when downloads are unlimited
+        if self.bandwidth.limited("write"):
+            return False
+        return DTPHandler.use_sendfile(self)
+
+    def recv(self, buffer_size):
+        chunk = DTPHandler.recv(self, buffer_size)
+        self._shape("read", len(chunk))
+        return chunk
+
+    def send(self, data):
+        num_sent = DTPHandler.send(self, data)
+        self._shape("write", num_sent)
+        return num_sent
+
+    def _shape(self, direction, num_bytes):
+        if not num_bytes:
+            return
+        flow = self._flow(direction)
+        if not flow:
+            return
+        delay = flow.reserve(num_bytes)
+        if delay <= MIN_DELAY:
+            return
+
+        def unsleep():
+            self.add_channel(events=self.ioloop.READ if self.receive else self.ioloop.WRITE)
+
+        self.del_channel()
+        self._cancel_throttler()
+        self._throttler = self.ioloop.call_later(delay, unsleep, _errback=self.handle_error)
+
+    def close(self):
+        for flow in self._flows.values():
+            flow.close()
+        self._flows = {}
+        super().close()
+
+class StoredFile(UploadFile):
+    """
+    UploadFile behind a STOR command. pyftpdlib closes it on success and on
+    failure alike, so close() discards the data unless the data channel
+    called finish() first.
+    """
+
+    def finish(self):
+        UploadFile.close(self)
+
+    def close(self):
+        self.abort()
+
+class AtomicStoreFS(AbstractedFS):
+    """
+    File system view whose STOR uploads are written through StoredFile,
+    synced as 'durability' asks (set on a per-server subclass). Appends
+    (APPE) and resumed uploads (REST) still write to the file in place.
+    Listings leave out the upload session folder and unfinished uploads.
+    """
+
+    durability = DEFAULT_DURABILITY
+
+    def open(self, filename, mode):
+        if mode == 'wb':
+            return StoredFile(filename, limit=None, durability=self.durability)
+        return super().open(filename, mode)
+
+    def listdir(self, path):
+        return [name for name in super().listdir(path) if not is_private_name(name)]
+
+class SharedDirectoryAuthorizer(DummyAuthorizer):
+    """
+    DummyAuthorizer that refuses every command on the upload session folder
+    and unfinished uploads, as the HTTP server does
+    """
+
+    def has_perm(self, username, perm, path=None):
+        if path is not None:
+            home = self.get_home_dir(username)
+            if (is_private_path(home, path)
+                    or is_private_path(os.path.realpath(home), os.path.realpath(path))):
+                return False
+        return super().has_perm(username, perm, path)
+
+class AtomicStoreDTP:
+    """
+    Data channel mixin that moves a StoredFile into place once its transfer
+    completed, and reports a failure to do so instead of "226"
+    """
+
+    def close(self):
+        file = self.file_obj
+        if (not self._closed and self.receive and self.transfer_finished
+                and isinstance(file, StoredFile) and not file.closed):
+            try:
+                file.finish()
+            except OSError as e:
+                logging.error(f"Couldn't store {file.path}: {e}")
+                self.transfer_finished = False
+                self._resp = (f"550 {e.strerror or e}.", logging.warning)
+        super().close()
+
+class LockedPassiveDTP(FTPHandler.passive_dtp):
+    """
+    PassiveDTP that binds and listens under a lock. With a thread per
+    session, two sessions could otherwise bind the same passive port
+    (SO_REUSEADDR allows it until one of them listens) and the second
+    listen() would fail and drop its session.
     """
-    Create and return an FTPServer instance. Caller can run server.serve_forever() in a thread.
+
+    _bind_lock = threading.Lock()
+
+    def __init__(self, cmd_channel, extmode=False):
+        with self._bind_lock:
+            super().__init__(cmd_channel, extmode)
+
+class MeteredFTPHandler(FTPHandler):
+    """
+    FTPHandler that records logins, connected sessions and RETR/STOR
+    transfers in 'metrics' (a Metrics registry, set on a per-server subclass)
     """
+
+    metrics = None
+
+    def on_connect(self):
+        self.metrics.ftp_sessions.inc()
+
+    def on_disconnect(self):
+        self.metrics.ftp_sessions.dec()
+
+    def on_login(self, username):
+        self.metrics.ftp_logins.inc(("success",))
+
+    def on_login_failed(self, username, password):
+        self.metrics.ftp_logins.inc(("failure",))
+
+    def _record_transfer(self, completed):
+        # Called from the data channel's close(), before it is detached
+        dtp = self.data_channel
+        if dtp is not None:
+            command = "STOR" if dtp.receive else "RETR"
+            self.metrics.ftp_transfer(command, dtp.get_transmitted_bytes(), dtp.get_elapsed_time(), completed)
+
+    def on_file_sent(self, file):
+        self._record_transfer(True)
+
+    def on_file_received(self, file):
+        self._record_transfer(True)
+
+    def on_incomplete_file_sent(self, file):
+        self._record_transfer(False)
+
+    def on_incomplete_file_received(self, file):
+        self._record_transfer(False)
+
+def _server_class(concurrency):
+    """pyftpdlib server class for a concurrency model"""
+    if concurrency == "async":
+        return servers.FTPServer  # one IO loop for all sessions
+    if concurrency == "threads":
+        return servers.ThreadedFTPServer  # one thread per session
+    if concurrency == "processes":
+        if not hasattr(servers, "MultiprocessFTPServer"):
+            raise ValueError("Multiprocess FTP server is not available on this platform")
+        return servers.MultiprocessFTPServer  # one forked process per session
+    raise ValueError(f"Unknown FTP concurrency model: {concurrency}")
+
+def passive_port_range(max_cons, start=PASSIVE_PORT_START):
+    """One passive port per allowed connection, so data channels never run out"""
+    end = start + max_cons
+    if end > 65536:
+        raise ValueError(f"Passive port range {start}-{end - 1} exceeds 65535")
+    return range(start, end)
+
+def start_ftp_server(username, password, directory, ftp_port,
+                     concurrency=DEFAULT_FTP_CONCURRENCY, max_cons=DEFAULT_MAX_CONS,
+                     max_cons_per_ip=DEFAULT_MAX_CONS_PER_IP, passive_ports=None,
+                     use_sendfile=None, ac_in_buffer_size=DEFAULT_FTP_BUFFER_SIZE,
+                     ac_out_buffer_size=DEFAULT_FTP_BUFFER_SIZE, bandwidth=None, metrics=None,
+                     durability=DEFAULT_DURABILITY, sock=None):
+    """
+    Create and return an FTPServer instance (the options are described in
+    the README). Caller can run server.serve_forever() in a thread.
+    """
+    check_durability(durability)
     if not os.path.exists(directory):
         raise FileNotFoundError("Selected directory doesn't exist or is inaccessible.")
 
+    server_class = _server_class(concurrency)
+    if passive_ports is None:
+        passive_ports = passive_port_range(max_cons)
+    elif len(passive_ports) < max_cons:
+        logging.warning(f"Only {len(passive_ports)} passive ports for {max_cons} connections; "
+                        "passive transfers may fail under load")
+
     local_ip = get_local_ip()
     if not test_local_ip(local_ip):
         local_ip = "127.0.0.1"
         logging.warning("Using localhost because the detected IP is unreachable.")
 
-    if is_port_in_use(ftp_port):
+    if sock is None and is_port_in_use(ftp_port):
         raise OSError(f"FTP port {ftp_port} is already in use.")
 
-    authorizer = DummyAuthorizer()
+    authorizer = SharedDirectoryAuthorizer()
     authorizer.add_user(username, password, directory, perm="elradfmw")
 
-    handler = FTPHandler
-    handler.authorizer = authorizer
-    handler.passive_ports = range(60000, 60100)
+    # Subclass rather than configure pyftpdlib's handlers in place, so each
+    # server gets its own settings
+    dtp_attrs = {
+        "ac_in_buffer_size": ac_in_buffer_size,
+        "ac_out_buffer_size": ac_out_buffer_size,
+    }
+    if bandwidth is not None:
+        if concurrency == "processes":
+            logging.warning("Bandwidth limits apply per FTP session with the multiprocess server")
+        dtp_attrs["bandwidth"] = bandwidth
+        dtp_handler = type("TunedDTPHandler", (AtomicStoreDTP, ShapedDTPHandler), dtp_attrs)
+    else:
+        dtp_handler = type("TunedDTPHandler", (AtomicStoreDTP, DTPHandler), dtp_attrs)
+    handler_attrs = {
+        "authorizer": authorizer,
+        "passive_ports": passive_ports,
+        "passive_dtp": LockedPassiveDTP,
+        "dtp_handler": dtp_handler,
+        "abstracted_fs": type("SharedDirectoryFS", (AtomicStoreFS,), {"durability": durability}),
+    }
+    if metrics is not None:
+        handler_attrs["metrics"] = metrics
+        handler = type("SharedDirectoryFTPHandler", (MeteredFTPHandler,), handler_attrs)
+    else:
+        handler = type("SharedDirectoryFTPHandler", (FTPHandler,), handler_attrs)
+    if use_sendfile is not None:
+        handler.use_sendfile = use_sendfile
 
-    address = (local_ip, ftp_port)
-    ftp_server = servers.FTPServer(address, handler)
-    ftp_server.max_cons = 256  # optional: set connection limits
-    ftp_server.max_cons_per_ip = 5
+    if sock is not None:
+        ftp_port = sock.getsockname()[1]
+    ftp_server = server_class(sock if sock is not None else (local_ip, ftp_port), handler)
+    ftp_server.max_cons = max_cons
+    ftp_server.max_cons_per_ip = max_cons_per_ip
 
     logging.info(f"FTP Server ready at ftp://{local_ip}:{ftp_port} (User: {username}, Pass: {password})")
+    logging.info(f"FTP concurrency: {concurrency}, passive ports "
+                 f"{passive_ports[0]}-{passive_ports[-1]}, sendfile: {handler.use_sendfile}")
     return ftp_server
@@ -6,6 +6,9 @@ import logging
 
 from ftp_server import start_ftp_server
 from http_server import start_http_server
+from bandwidth import BandwidthLimiter
+from content_index import DEFAULT_HASH_WORKERS
+from metrics import Metrics
 from utils import get_local_ip
 
 def run_gui():
@@ -23,8 +26,10 @@ def run_gui():
         try:
             ftp_port = int(ftp_port_entry.get() or 2121)
             http_port = int(http_port_entry.get() or 8000)
+            http_processes = int(http_processes_entry.get() or 1)
+            speed_limit = int(float(speed_limit_entry.get() or 0) * 1024 * 1024)
         except ValueError:
-            messagebox.showerror("Error", "Ports must be numeric.")
+            messagebox.showerror("Error", "Ports, process count and speed limit must be numeric.")
             return
 
         directory = filedialog.askdirectory(title="Select Directory to Share")
@@ -33,9 +38,15 @@ def run_gui():
             return
 
         try:
-            # Start servers
-            ftp_server_instance = start_ftp_server(username, password, directory, ftp_port)
-            http_server_instance = start_http_server(directory, http_port)
+            # Start servers; both draw from one bandwidth budget and report to one /metrics
+            bandwidth = BandwidthLimiter(read_limit=speed_limit, write_limit=speed_limit)
+            metrics = Metrics()
+            ftp_server_instance = start_ftp_server(username, password, directory, ftp_port,
+                                                   bandwidth=bandwidth, metrics=metrics)
+            hash_workers = DEFAULT_HASH_WORKERS if hash_index_var.get() else 0
+            http_server_instance = start_http_server(directory, http_port, processes=http_processes,
+                                                     bandwidth=bandwidth, metrics=metrics,
+                                                     hash_workers=hash_workers)
 
             # Run in background threads
             threading.Thread(target=ftp_server_instance.serve_forever, daemon=True).start()
@@ -76,6 +87,7 @@ def run_gui():
             ftp_server_instance = None
         if http_server_instance:
             http_server_instance.shutdown()
+            http_server_instance.server_close()
             http_server_instance = None
 
         root.destroy()
@@ -84,7 +96,7 @@ def run_gui():
     # ----- GUI LAYOUT -----
     root = tk.Tk()
     root.title("FTP and HTTP Server Setup")
-    root.geometry("500x350")
+    root.geometry("500x500")
 
     # Frame for inputs
     input_frame = tk.Frame(root)
@@ -112,6 +124,22 @@ def run_gui():
     http_port_entry.insert(0, "8000")
     http_port_entry.pack()
 
+    tk.Label(input_frame, text="HTTP Processes (0 = one per CPU):", font=("Sans-Serif", 12)).pack()
+    http_processes_entry = tk.Entry(input_frame, font=("Sans-Serif", 12))
+    http_processes_entry.insert(0, "1")
+    http_processes_entry.pack()
+
+    tk.Label(input_frame, text="Speed Limit (MB/s, 0 = unlimited):", font=("Sans-Serif", 12)).pack()
+    speed_limit_entry = tk.Entry(input_frame, font=("Sans-Serif", 12))
+    speed_limit_entry.insert(0, "0")
+    speed_limit_entry.pack()
+
+    # Off by default: building the index reads every file in the shared folder once
+    hash_index_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(input_frame, text="Index file hashes (skips re-uploading files the share has;\n"
+                                     "reads the whole shared folder once, then only changes)",
+                   variable=hash_index_var, font=("Sans-Serif", 10)).pack(pady=5)
+
     # Start button
     start_button = tk.Button(input_frame, text="Select Directory & Start Servers", font=("Sans-Serif", 12), command=start_server)
     start_button.pack(pady=10)
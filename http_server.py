@@ -1,401 +1,1187 @@
 # http_server.py
 import os
-import cgi
+import json
+import stat
+import hashlib
+from html import escape
+import sys
+import time
+import queue
+import socket
 import logging
+import threading
 from http.server import HTTPServer, SimpleHTTPRequestHandler
 from utils import get_local_ip, is_port_in_use
-from datetime import datetime
+from paths import translate_path, PathCache, EXTENSIONS_MAP
+from pages import listing_page, upload_page, search_page
+from assets import ASSETS, STATIC_CACHE_CONTROL
+from transfer import send_file, send_buffer, TransferStats, ChunkedWriter, can_sendfile, content_length
+from ranges import parse_range_header, content_range, MultipartByteranges, RangeNotSatisfiable
+from multipart import MultipartParser, MultipartError, get_boundary
+from uploads import (UploadFile, UploadTooLarge, safe_upload_path, check_durability, UPLOAD_READ_SIZE,
+                     DEFAULT_DURABILITY)
+from tar_upload import TarExtractor, TarUploadError, UnsupportedEncoding, body_encoding, TAR_UPLOAD_PATH
+from content_index import ContentIndex, store_known_content, check_digest, digest_header, HASH_UPLOAD_PATH
+from search_index import SearchIndex, parse_search_query, search_json, SEARCH_PATH
+from upload_sessions import (UploadSessionStore, SessionNotFound, UploadIncomplete,
+                             SESSION_DIR_NAME, SESSIONS_PREFIX)
+from urllib.parse import urlsplit, parse_qs
+from async_http_server import AsyncHTTPServer
+from http_workers import HTTPWorkerProcesses, SharedObjects
+from bandwidth import BandwidthLimiter
+from metrics import Metrics, route_of, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from admission import (AdmissionControl, Watchdog, GuardedFlow, busy_response,
+                       DEFAULT_MAX_CONNECTIONS, DEFAULT_MAX_CONNECTIONS_PER_IP,
+                       DEFAULT_HEADER_TIMEOUT, DEFAULT_BODY_TIMEOUT, DEFAULT_MIN_RATE)
+from listing import ListingCache, parse_listing_query, listing_json
+from archive import ARCHIVE_FORMATS, archive_sources, walk_members, stream_archive, content_disposition
+from file_cache import (ValidatorCache, HotFileCache, etag_matches, stat_identity, variant_etag,
+                        is_not_modified, if_range_matches, DEFAULT_HOT_CACHE_SIZE, DEFAULT_HOT_FILE_SIZE)
+from compression import (CompressedCache, StreamCompressor, choose_encoding, is_compressible,
+                         compress_bytes, prepare_cache_dir, COMPRESS_READ_SIZE, DEFAULT_CACHE_SIZE)
 
-def format_file_size(size):
-    """Convert file size to human-readable format"""
-    for unit in ['B', 'KB', 'MB', 'GB']:
-        if size < 1024.0:
-            return f"{size:.2f} {unit}"
-        size /= 1024.0
-    return f"{size:.2f} TB"
+DEFAULT_HTTP_WORKERS = 16
+DEFAULT_HTTP_QUEUE_SIZE = 64
+DEFAULT_DRAIN_TIMEOUT = 5.0
+DEFAULT_KEEPALIVE_TIMEOUT = 15.0
+DEFAULT_MAX_KEEPALIVE_REQUESTS = 1000
+
+# Worker processes share one copy of each index, held by a SharedObjects process
+SharedObjects.register("SearchIndex", SearchIndex)
+SharedObjects.register("ContentIndex", ContentIndex)
 
 class CustomHandler(SimpleHTTPRequestHandler):
+    # Small responses are written as headers + body; don't let Nagle hold the body back
+    disable_nagle_algorithm = True
+
+    extensions_map = EXTENSIONS_MAP
+
     def __init__(self, *args, directory=None, **kwargs):
-        self.directory = directory
-        super().__init__(*args, **kwargs)
+        super().__init__(*args, directory=directory, **kwargs)
+
+    def setup(self):
+        super().setup()
+        self.protocol_version = "HTTP/1.1" if getattr(self.server, 'keep_alive', False) else "HTTP/1.0"
+        self.requests_left = getattr(self.server, 'max_keepalive_requests', DEFAULT_MAX_KEEPALIVE_REQUESTS)
+        self.body_consumed = True
+        self.content_length = 0
+        self.route = None
+
+    def handle(self):
+        """Serve requests on one connection until it closes, idles out or hits max_keepalive_requests"""
+        idle_timeout = getattr(self.server, 'keepalive_timeout', DEFAULT_KEEPALIVE_TIMEOUT)
+        self.close_connection = True
+        while True:
+            # Wait for the next request line without tying the worker up forever
+            self.connection.settimeout(idle_timeout)
+            try:
+                if not self.rfile.peek(1):
+                    break  # client closed the connection
+            except (TimeoutError, ConnectionError):
+                break  # idle for too long
+            self.requests_left -= 1
+            # A client that starts a request has header_timeout to finish its head
+            self.arm_watchdog("header")
+            self.handle_one_request()
+            if self.close_connection or self.has_unread_body():
+                break
+
+    def handle_one_request(self):
+        """handle_one_request() that also records the request in server.metrics"""
+        self.route = self.response_code = self.error_kind = self.transfer = None
+        self.bytes_sent = self.bytes_received = 0
+        try:
+            super().handle_one_request()
+        except ConnectionError:
+            self.error_kind = "aborted"
+            raise
+        finally:
+            self.record_request()
+
+    def parse_request(self):
+        # The request line has arrived; the rest of the request is not an idle wait
+        admission = getattr(self.server, 'admission', None)
+        self.connection.settimeout(admission.body_timeout if admission else None)
+        self.body_consumed = False
+        self.content_length = 0
+        result = super().parse_request()
+        watchdog = getattr(self.server, 'watchdog', None)
+        if watchdog:
+            watchdog.disarm(self.connection)
+        if result:
+            try:
+                self.content_length = content_length(self.headers)
+            except ValueError as e:
+                self.close_connection = True  # where the body ends is unknown
+                self.send_error(400, str(e))
+                return False
+            self.request_started = time.perf_counter()
+            self.route = route_of(self.command, urlsplit(self.path).path)
+        return result
+
+    def send_response(self, code, message=None):
+        self.response_code = code
+        super().send_response(code, message)
+
+    def record_request(self):
+        metrics = getattr(self.server, 'metrics', None)
+        if metrics is None or self.route is None:
+            return
+        if self.transfer:
+            direction, started = self.transfer
+            metrics.transfer_finished(direction, started,
+                                      self.bytes_sent if direction == "write" else self.bytes_received)
+        metrics.request_finished(self.route, self.response_code, time.perf_counter() - self.request_started,
+                                 self.bytes_sent, self.bytes_received, self.error_kind)
+
+    def arm_watchdog(self, kind):
+        watchdog = getattr(self.server, 'watchdog', None)
+        if watchdog:
+            watchdog.arm(self.connection, self.server.admission.header_timeout, kind)
+
+    def end_headers(self):
+        if self.requests_left <= 0 and not self.close_connection:
+            self.send_header("Connection", "close")
+        super().end_headers()
+
+    def has_unread_body(self):
+        """True if the request carried a body the handler hasn't read to the end"""
+        headers = getattr(self, 'headers', None)
+        if self.body_consumed or headers is None:
+            return False
+        return self.content_length > 0 or 'Transfer-Encoding' in headers
+
+    def send_error(self, code, message=None, explain=None):
+        """
+        Send and log an error reply. Unlike the base class this keeps a
+        persistent connection open, unless an unread request body would
+        otherwise be parsed as the next request.
+        """
+        try:
+            shortmsg, longmsg = self.responses[code]
+        except KeyError:
+            shortmsg, longmsg = '???', '???'
+        if message is None:
+            message = shortmsg
+        if explain is None:
+            explain = longmsg
+        self.log_error("code %d, message %s", code, message)
+        self.send_response(code, message)
+        if self.has_unread_body() or self.close_connection:
+            self.send_header('Connection', 'close')
+
+        body = None
+        if code >= 200 and code not in (204, 205, 304):
+            # HTML encode to prevent Cross Site Scripting attacks
+            content = (self.error_message_format % {
+                'code': code,
+                'message': escape(message, quote=False),
+                'explain': escape(explain, quote=False)
+            })
+            body = content.encode('UTF-8', 'replace')
+            self.send_header("Content-Type", self.error_content_type)
+        self.send_header('Content-Length', str(len(body) if body else 0))
+        self.end_headers()
+
+        if self.command != 'HEAD' and body:
+            self.wfile.write(body)
+            self.bytes_sent += len(body)
+
+    def start_streaming_body(self):
+        """
+        Finish the headers of a response whose length isn't known up front and
+        return a writer for its body: chunked on HTTP/1.1, close-delimited otherwise.
+        Call close() on the writer when done.
+        """
+        if self.request_version >= "HTTP/1.1" and self.protocol_version >= "HTTP/1.1":
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            return ChunkedWriter(self.wfile)
+        self.send_header("Connection", "close")
+        self.end_headers()
+        return ChunkedWriter(self.wfile, chunked=False)
 
     def translate_path(self, path):
-        original_path = super().translate_path(path)
-        relative_path = os.path.relpath(original_path, os.getcwd())
-        full_path = os.path.join(self.directory, relative_path)
-        
-        # Security: Prevent directory traversal
-        if not os.path.realpath(full_path).startswith(os.path.realpath(self.directory)):
-            raise PermissionError("Access denied")
-        return full_path
+        path_cache = getattr(self.server, 'path_cache', None)
+        if path_cache is not None:
+            return path_cache.translate(self.directory, path)
+        return translate_path(self.directory, path)
 
     def do_GET(self):
         """Handle GET requests with proper large file handling"""
-        if self.path == '/upload':
+        url = urlsplit(self.path)
+        if url.path == '/upload':
             self.handle_upload_get()
-        elif self.path == '/':
-            self.handle_root_get()
+        elif url.path == '/server-status' and hasattr(self.server, 'server_status'):
+            self.send_json_response(self.server.server_status())
+        elif url.path == '/metrics' and getattr(self.server, 'metrics', None):
+            self.send_body_response(self.server.metrics.render().encode('utf-8'), METRICS_CONTENT_TYPE)
+        elif url.path.startswith(SESSIONS_PREFIX):
+            self.handle_session_request()
+        elif url.path == SEARCH_PATH:
+            self.handle_search(url)
+        elif ASSETS.lookup(url.path):
+            self.send_static_asset(ASSETS.lookup(url.path))
         else:
             try:
-                self.handle_file_request()
+                path = self.translate_path(self.path)
+                try:
+                    st = os.stat(path)
+                except (FileNotFoundError, NotADirectoryError):
+                    st = None
+                if st is not None and stat.S_ISDIR(st.st_mode):
+                    self.handle_directory_get(path, url)
+                else:
+                    self.handle_file_request(path, st)
             except BrokenPipeError:
                 # Client disconnected prematurely, no need to log as error
                 logging.debug("Client disconnected during download")
+                self.error_kind = "aborted"
+            except TimeoutError:
+                self.body_timed_out()
+            except PermissionError:
+                self.send_error(403, "Access denied")
+            except FileNotFoundError:
+                self.send_error(404, "File not found")
             except Exception as e:
                 self.send_error(500, f"Server error: {str(e)}")
 
-    def handle_file_request(self):
-        """Serve files with chunked transfer and connection checking"""
-        path = self.translate_path(self.path)
-        if not os.path.isfile(path):
+    def handle_file_request(self, path=None, st=None):
+        """Serve files, or byte ranges of them, with sendfile() where available"""
+        if path is None:
+            path = self.translate_path(self.path)
+            st = os.stat(path) if os.path.exists(path) else None
+        if st is None or not stat.S_ISREG(st.st_mode):
             self.send_error(404, "File not found")
             return
 
-        file_size = os.path.getsize(path)
-        self.send_response(200)
-        self.send_header("Content-Type", self.guess_type(path))
-        self.send_header("Content-Length", str(file_size))
+        # Conditional requests are answered from the stat() alone
+        validators = self.server.validator_cache.get(path, st)
+        content_type = self.guess_type(path)
+        compressible = self.server.compressed_cache is not None and is_compressible(content_type, st.st_size)
+        encoding = choose_encoding(self.headers) if compressible else None
+        etag = variant_etag(validators.etag, encoding)
+        if is_not_modified(self.headers, validators, etag):
+            self.send_response(304)
+            self.send_validator_headers(validators, etag, vary=compressible)
+            self.end_headers()
+            return
+
+        hot_cache = self.server.hot_cache
+        cached = None
+        if hot_cache is not None:
+            cached = hot_cache.lookup(path, st, encoding)
+            if cached is None and hot_cache.admit(path, st, encoding):
+                cached = hot_cache.load(path, st, encoding)
+        if cached is not None:
+            with self.open_flow("write") as flow:
+                if encoding:
+                    self.send_response(200)
+                    self.send_header("Content-Type", content_type)
+                    self.send_header("Content-Encoding", encoding)
+                    self.send_header("Content-Length", str(len(cached)))
+                    self.send_validator_headers(validators, etag, vary=True)
+                    self.end_headers()
+                    if self.command != 'HEAD':
+                        self.send_body(cached, flow=flow)
+                else:
+                    self.send_file_body(cached, len(cached), validators, content_type, compressible, flow)
+            return
+
+        with open(path, 'rb') as f, self.open_flow("write") as flow:
+            fst = os.fstat(f.fileno())
+            if stat_identity(fst) != validators.identity:
+                validators = self.server.validator_cache.get(path, fst)  # replaced since the stat()
+                etag = variant_etag(validators.etag, encoding)
+
+            if encoding:
+                self.send_compressed_file(path, f, validators, content_type, encoding, etag, flow)
+                return
+            self.send_file_body(f, fst.st_size, validators, content_type, compressible, flow)
+
+    def send_file_body(self, source, file_size, validators, content_type, compressible, flow=None):
+        """
+        Full or Range response for an open file, sent with sendfile() where
+        available, or for file content cached in memory ('source' is then a
+        memoryview)
+        """
+        ranges = None
+        range_header = self.headers.get("Range")
+        if range_header and if_range_matches(self.headers, validators):
+            try:
+                ranges = parse_range_header(range_header, file_size)
+            except RangeNotSatisfiable:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{file_size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+        if not ranges:
+            self.send_response(200)
+            self.send_file_headers(validators, content_type, file_size, compressible)
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            self.send_response(206)
+            self.send_file_headers(validators, content_type, end - start + 1, compressible)
+            self.send_header("Content-Range", content_range(start, end, file_size))
+        else:
+            body = MultipartByteranges(ranges, file_size, content_type)
+            self.send_response(206)
+            self.send_file_headers(validators, body.content_type, body.content_length, compressible)
         self.end_headers()
+        if self.command == 'HEAD':
+            return
 
-        with open(path, 'rb') as f:
-            while True:
+        if not ranges:
+            self.send_body(source, 0, file_size, flow)
+        elif len(ranges) == 1:
+            self.send_body(source, start, end - start + 1, flow)
+        else:
+            self.send_body(source, flow=flow, parts=body.parts, trailer=body.trailer)
+
+    def send_body(self, source, offset=0, count=None, flow=None, parts=None, trailer=b''):
+        """
+        Send 'count' bytes of 'source' (an open file or a memoryview) from
+        'offset', or each (head, offset, length) of multipart 'parts'
+        """
+        if isinstance(source, memoryview):
+            send, stats = send_buffer, TransferStats("memory")
+        else:
+            send = send_file
+            stats = TransferStats("sendfile" if can_sendfile(self.connection, source) else "buffered")
+        expected = count if parts is None else sum(length for _, _, length in parts)
+        try:
+            if parts is None:
+                send(self.connection, source, offset, count, stats, flow)
+            else:
+                for head, part_offset, length in parts:
+                    self.connection.sendall(head)
+                    send(self.connection, source, part_offset, length, stats, flow)
+                self.connection.sendall(trailer)
+        except (BrokenPipeError, ConnectionResetError):
+            # Client disconnected during transfer
+            logging.debug(f"Client aborted download: {self.path}")
+            self.error_kind = "aborted"
+            return
+        finally:
+            self.bytes_sent += stats.bytes
+        self.check_sent(stats.bytes, expected)
+        logging.info(f"Sent {self.path}: {stats}")
+
+    def check_sent(self, sent, expected):
+        """
+        Close the connection after a body cut short by a file that shrank
+        while it was sent: the client would read the next response as the
+        rest of this one
+        """
+        if sent < expected:
+            logging.warning(f"{self.path} shrank while it was sent ({sent} of {expected} bytes)")
+            self.error_kind = "truncated"
+            self.close_connection = True
+
+    def send_file_headers(self, validators, content_type, length, vary=False):
+        """Headers shared by full and partial file responses"""
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_validator_headers(validators, validators.etag, vary)
+
+    def send_validator_headers(self, validators, etag, vary=False):
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", validators.last_modified)
+        if validators.digest and etag == validators.etag:
+            self.send_header("Repr-Digest", digest_header(validators.digest))  # not for compressed variants
+        self.send_header("Cache-Control", self.server.cache_control)
+        if vary:
+            self.send_header("Vary", "Accept-Encoding")
+
+    def send_compressed_file(self, path, f, validators, content_type, encoding, etag, flow=None):
+        """
+        Serve a compressed variant: straight from the on-disk cache with
+        sendfile() on a hit, otherwise compressed while streaming and saved
+        to the cache for the next request. 'flow' paces the body.
+        """
+        cache = self.server.compressed_cache
+        key = cache.key(path, validators.identity, encoding)
+        cached = cache.lookup(key)
+
+        def send_headers():
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Encoding", encoding)
+            self.send_validator_headers(validators, etag, vary=True)
+
+        if cached is not None:
+            with cached as cf:
+                size = os.fstat(cf.fileno()).st_size
+                send_headers()
+                self.send_header("Content-Length", str(size))
+                self.end_headers()
+                if self.command == 'HEAD':
+                    return
+                stats = TransferStats("sendfile" if can_sendfile(self.connection, cf) else "buffered")
                 try:
-                    chunk = f.read(16 * 1024)  # 16KB chunks
-                    if not chunk:
-                        break
-                    self.wfile.write(chunk)
-                    self.wfile.flush()  # Ensure chunk is sent immediately
+                    send_file(self.connection, cf, 0, size, stats, flow)
                 except (BrokenPipeError, ConnectionResetError):
-                    # Client disconnected during transfer
                     logging.debug(f"Client aborted download: {self.path}")
+                    self.error_kind = "aborted"
+                    return
+                finally:
+                    self.bytes_sent += stats.bytes
+                self.check_sent(stats.bytes, size)
+            logging.info(f"Sent {self.path} ({encoding}, cached): {stats}")
+            return
+
+        send_headers()
+        writer = self.start_streaming_body()
+        if self.command == 'HEAD':
+            return  # the GET's headers; its body is only compressed while it is sent
+        out = cache.writer()
+        compressor = StreamCompressor(encoding)
+        stats = TransferStats(f"{encoding} stream")
+        try:
+            while True:
+                chunk = f.read(COMPRESS_READ_SIZE)
+                if not chunk:
                     break
+                data = compressor.compress(chunk)
+                if flow:
+                    flow.throttle(len(data))
+                writer.write(data)
+                out.write(data)
+                stats.bytes += len(data)
+            data = compressor.flush()
+            if flow:
+                flow.throttle(len(data))
+            writer.write(data)
+            out.write(data)
+            writer.close()
+            stats.bytes += len(data)
+            if stat_identity(os.fstat(f.fileno())) == validators.identity:
+                cache.commit(key, out)
+            else:
+                out.discard()  # file changed while we read it
+        except (BrokenPipeError, ConnectionResetError):
+            out.discard()
+            logging.debug(f"Client aborted download: {self.path}")
+            self.error_kind = "aborted"
+            return
+        except Exception:
+            out.discard()
+            raise
+        finally:
+            self.bytes_sent += stats.bytes
+        logging.info(f"Sent {self.path}: {stats.finish()}")
+
+    def handle_directory_get(self, path, url):
+        """Show a directory listing (HTML, or JSON with ?format=json), paginated and sorted"""
+        if not url.path.endswith('/'):
+            # Relative links in the listing need the trailing slash
+            self.send_response(301)
+            self.send_header("Location", url.path + '/' + (f"?{url.query}" if url.query else ''))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        query = parse_qs(url.query)
+        if 'archive' in query:
+            self.send_archive(path, url, query)
+            return
+        try:
+            page, per_page, sort, order = parse_listing_query(query)
+        except ValueError:
+            self.send_error(400, "Invalid page")
+            return
+
+        listing = self.server.listing_cache.get(path)
+        entries, pages = listing.page(page, per_page, sort, order == 'desc')
+        page = min(max(1, page), pages)
+
+        if query.get('format', [''])[0] == 'json':
+            self.send_json_response(listing_json(url.path, listing, entries, page, pages,
+                                                 per_page, sort, order))
+            return
+
+        self.send_html_response(listing_page(self.directory, url.path, entries, page, pages, per_page,
+                                             sort, order, search=self.server.search_index is not None))
+
+    def handle_search(self, url):
+        """
+        Find entries under ?path= (default: the whole share) by name (?q=,
+        see SearchIndex.search), size and date. Answers JSON, or a results
+        page with ?format=html as the listing's search box asks.
+        """
+        index = self.server.search_index
+        if index is None:
+            self.send_error(404, "Search is disabled")
+            return
+        query = parse_qs(url.query)
+        try:
+            options = parse_search_query(query)
+            started = time.monotonic()
+            results, truncated = index.search(**options)
+            took = time.monotonic() - started
+        except ValueError as e:
+            self.send_error(400, f"Bad request: {str(e)}")
+            return
+        if query.get('format', [''])[0] == 'html':
+            self.send_html_response(search_page(self.directory, options['path'], options['query'],
+                                                results, truncated))
+        else:
+            self.send_json_response(search_json(index, options, results, truncated, took))
 
-    def handle_root_get(self):
-        """Show directory listing with upload link"""
-        html = f"""
-        <!DOCTYPE html>
-        <html lang="en">
-        <head>
-            {self.common_styles()}
-            <title>File Server - {os.path.basename(self.directory)}</title>
-        </head>
-        <body>
-            <div class="container">
-                <h1 class="my-4">📁 {os.path.basename(self.directory)}</h1>
-                <a href="/upload" class="btn btn-primary mb-4">
-                    <i class="bi bi-upload"></i> Upload Files
-                </a>
-                {self.generate_directory_listing()}
-            </div>
-        </body>
-        </html>
+    def send_archive(self, path, url, query):
+        """
+        Stream the folder, or the entries picked with ?files=, as a ZIP or TAR
+        (?archive=zip|tar) built while it is sent, with chunked transfer-coding
         """
-        self.send_html_response(html)
+        fmt = query['archive'][0]
+        if fmt not in ARCHIVE_FORMATS:
+            self.send_error(400, "Unsupported archive format")
+            return
+        try:
+            sources, name = archive_sources(self.directory, path, url.path, query.get('files', []))
+        except FileNotFoundError:
+            self.send_error(404, "File not found")
+            return
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", ARCHIVE_FORMATS[fmt])
+        self.send_header("Content-Disposition", content_disposition(f"{name}.{fmt}"))
+        self.send_header("Cache-Control", "no-store")
+        writer = self.start_streaming_body()
+        if self.command == 'HEAD':
+            return
+
+        chunks = stream_archive(fmt, walk_members(self.directory, sources, self.server.listing_cache.hidden))
+        stats = TransferStats(f"{fmt} stream")
+        try:
+            with self.open_flow("write") as flow:
+                for data in chunks:
+                    if flow:
+                        flow.throttle(len(data))
+                    writer.write(data)
+                    stats.bytes += len(data)
+            writer.close()
+        except (BrokenPipeError, ConnectionResetError):
+            logging.debug(f"Client aborted archive download: {self.path}")
+            self.error_kind = "aborted"
+            return
+        finally:
+            chunks.close()
+            self.bytes_sent += stats.bytes
+        logging.info(f"Sent {self.path}: {stats.finish()}")
+
+    def send_static_asset(self, asset):
+        """Bundled stylesheet or script, precompressed and cacheable for good under its fingerprinted URL"""
+        encoding = None
+        if self.server.compressed_cache is not None:
+            encoding = choose_encoding(self.headers)
+        etag = variant_etag(asset.etag, encoding)
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None and etag_matches(if_none_match, etag):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", STATIC_CACHE_CONTROL)
+            self.end_headers()
+            return
+
+        body = asset.variants[encoding]
+        self.send_response(200)
+        self.send_header("Content-Type", asset.content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Vary", "Accept-Encoding")
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", STATIC_CACHE_CONTROL)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+            self.bytes_sent += len(body)
 
     def handle_upload_get(self):
         """Show modern upload form with drag & drop"""
-        html = f"""
-        <!DOCTYPE html>
-        <html lang="en">
-        <head>
-            {self.common_styles()}
-            <title>Upload Files</title>
-            {self.uploader_scripts()}
-        </head>
-        <body>
-            <div class="container">
-                <h1 class="my-4"><i class="bi bi-cloud-upload"></i> Upload Files</h1>
-                <a href="/" class="btn btn-outline-secondary mb-4">
-                    <i class="bi bi-arrow-left"></i> Back to Files
-                </a>
-                
-                <div class="card">
-                    <div class="card-body">
-                        <div id="drop-zone" class="drop-zone">
-                            <input type="file" name="file" id="file-input" multiple 
-                                   class="d-none" onchange="handleFiles(this.files)">
-                            <label for="file-input" class="drop-zone-label">
-                                <i class="bi bi-file-earmark-arrow-up fs-1"></i>
-                                <div>Drag & drop files here or click to select</div>
-                                <div class="text-muted">(Maximum 4GB per file)</div>
-                            </label>
-                        </div>
-                        
-                        <div id="upload-list" class="mt-4"></div>
-                        
-                        <button class="btn btn-success mt-3 d-none" id="start-upload"
-                                onclick="startUpload()">
-                            <i class="bi bi-upload"></i> Start Upload
-                        </button>
-                    </div>
-                </div>
-            </div>
-        </body>
-        </html>
+        self.send_html_response(upload_page())
+
+    def do_HEAD(self):
+        """Same as GET without the body, so validators can be checked cheaply"""
+        self.do_GET()
+
+    def do_PUT(self):
+        """Receive one chunk of a resumable upload"""
+        self.handle_session_request()
+
+    def do_DELETE(self):
+        """Abort a resumable upload"""
+        self.handle_session_request()
+
+    def handle_session_request(self):
         """
-        self.send_html_response(html)
-
-    def common_styles(self):
-        return """
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1">
-        <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css" rel="stylesheet">
-        <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap-icons@1.7.2/font/bootstrap-icons.css">
-        <style>
-            .drop-zone {
-                border: 2px dashed #ccc;
-                border-radius: 8px;
-                padding: 3rem;
-                text-align: center;
-                transition: all 0.3s;
-            }
-            .drop-zone.dragover {
-                border-color: #0d6efd;
-                background-color: rgba(13, 110, 253, 0.05);
-            }
-            .drop-zone-label {
-                cursor: pointer;
-            }
-            .file-item {
-                padding: 1rem;
-                border-bottom: 1px solid #eee;
-            }
-            .progress {
-                height: 25px;
-                margin-top: 5px;
-            }
-            .table-hover tbody tr:hover {
-                background-color: rgba(13, 110, 253, 0.05);
-            }
-        </style>
+        Resumable upload API:
+          POST   /upload/sessions                     {"name", "size", "key"} -> session
+          GET    /upload/sessions/<id>                -> session with received ranges
+          PUT    /upload/sessions/<id>?offset=N       raw chunk body -> session
+          POST   /upload/sessions/<id>/complete       -> move the file into place
+          DELETE /upload/sessions/<id>                -> discard
         """
+        store = self.server.upload_sessions
+        url = urlsplit(self.path)
+        parts = url.path[len(SESSIONS_PREFIX):].strip('/').split('/')
+        session_id = parts[0]
+        action = parts[1] if len(parts) > 1 else None
+        try:
+            if self.command == 'POST' and not session_id:
+                body = self.read_json_body()
+                session = store.create(str(body['name']), int(body['size']), body.get('key'))
+                # Without a content index, hashing the file in the browser would be wasted
+                self.send_json_response(dict(session.to_dict(), hash_upload=self.server.content_index is not None),
+                                        201)
+            elif self.command == 'GET' and not action:
+                self.send_json_response(store.get(session_id).to_dict())
+            elif self.command == 'PUT' and not action:
+                session = store.get(session_id)
+                offset = int(parse_qs(url.query).get('offset', ['0'])[0])
+                length = self.headers.get('Content-Length')
+                if length is None:
+                    self.send_error(411, "Content-Length required")
+                    return
+                with self.open_flow("read") as flow:
+                    result = session.write_chunk(offset, self.rfile, int(length), flow=flow)
+                self.body_consumed = True
+                self.bytes_received += int(length)
+                self.send_json_response(result)
+            elif self.command == 'POST' and action == 'complete':
+                path = store.finalize(session_id)
+                self.folder_changed(self.directory)
+                self.content_changed([path])
+                logging.info(f"Upload complete: {path}")
+                self.send_json_response({"status": "success", "files": [os.path.basename(path)]})
+            elif self.command == 'DELETE' and not action:
+                store.abort(session_id)
+                self.send_json_response({"status": "aborted"})
+            else:
+                self.send_error(404, "Not found")
+        except SessionNotFound:
+            self.send_error(404, "Upload session not found")
+        except UploadIncomplete as e:
+            self.send_error(409, str(e))
+        except UploadTooLarge as e:
+            self.close_connection = True
+            self.send_error(413, f"Upload failed: {str(e)}")
+        except (KeyError, ValueError) as e:
+            self.close_connection = True
+            self.send_error(400, f"Bad request: {str(e)}")
+        except ConnectionError:
+            self.close_connection = True
+            self.error_kind = "aborted"
+            logging.debug(f"Client disconnected during chunk upload: {self.path}")
+        except TimeoutError:
+            self.body_timed_out()
+
+    def body_timed_out(self):
+        """A body read or write stalled past body_timeout; the connection is unusable"""
+        self.close_connection = True
+        self.error_kind = "timeout"
+        admission = getattr(self.server, 'admission', None)
+        if admission:
+            admission.timed_out("body")
+        logging.info(f"Timed out transferring {self.path} for {self.client_address[0]}")
 
-    def uploader_scripts(self):
-        return """
-        <script>
-            let filesToUpload = [];
-            
-            // Drag & drop handlers
-            const dropZone = document.getElementById('drop-zone');
-            
-            dropZone.addEventListener('dragover', (e) => {
-                e.preventDefault();
-                dropZone.classList.add('dragover');
-            });
-
-            dropZone.addEventListener('dragleave', () => {
-                dropZone.classList.remove('dragover');
-            });
-
-            dropZone.addEventListener('drop', (e) => {
-                e.preventDefault();
-                dropZone.classList.remove('dragover');
-                handleFiles(e.dataTransfer.files);
-            });
-
-            function handleFiles(files) {
-                for (let file of files) {
-                    addFileToList(file);
-                }
-                document.getElementById('start-upload').classList.remove('d-none');
-            }
-
-            function addFileToList(file) {
-                const fileItem = document.createElement('div');
-                fileItem.className = 'file-item';
-                fileItem.innerHTML = `
-                    <div class="d-flex justify-content-between align-items-center">
-                        <div>
-                            <i class="bi bi-file-earmark"></i> 
-                            ${file.name} (${formatSize(file.size)})
-                        </div>
-                        <div class="w-50 mx-3">
-                            <div class="progress">
-                                <div class="progress-bar" role="progressbar" 
-                                     style="width: 0%" aria-valuenow="0" 
-                                     aria-valuemin="0" aria-valuemax="100">
-                                </div>
-                            </div>
-                        </div>
-                    </div>
-                `;
-                document.getElementById('upload-list').appendChild(fileItem);
-                filesToUpload.push(file);
-            }
-
-            async function startUpload() {
-                const uploadBtn = document.getElementById('start-upload');
-                uploadBtn.disabled = true;
-                uploadBtn.innerHTML = `<i class="bi bi-upload"></i> Uploading...`;
-                let successCount = 0;
-
-                for (let i = 0; i < filesToUpload.length; i++) {
-                    const file = filesToUpload[i];
-                    const formData = new FormData();
-                    formData.append('file', file);
-                    
-                    const xhr = new XMLHttpRequest();
-                    const progressBar = document.querySelectorAll('.progress-bar')[i];
-                    
-                    xhr.upload.addEventListener('progress', (e) => {
-                        if (e.lengthComputable) {
-                            const percent = (e.loaded / e.total) * 100;
-                            progressBar.style.width = `${percent}%`;
-                            progressBar.textContent = `${Math.round(percent)}%`;
-                        }
-                    });
-
-                    xhr.open('POST', '/upload', true);
-                    
-                    xhr.onload = () => {
-                        if (xhr.status === 200) {
-                            progressBar.classList.add('bg-success');
-                            progressBar.textContent = 'Done!';
-                            successCount++;
-                            
-                            // Redirect when all files complete
-                            if(successCount === filesToUpload.length) {
-                                setTimeout(() => window.location.href = '/', 1000);
-                            }
-                        } else {
-                            progressBar.classList.add('bg-danger');
-                            progressBar.textContent = 'Error!';
-                        }
-                    };
-
-                    xhr.onerror = () => {
-                        progressBar.classList.add('bg-danger');
-                        progressBar.textContent = 'Error!';
-                    };
-
-                    xhr.send(formData);
-                }
-            }
-
-            function formatSize(bytes) {
-                const units = ['B', 'KB', 'MB', 'GB'];
-                let size = bytes;
-                for (const unit of units) {
-                    if (size < 1024) return `${size.toFixed(1)} ${unit}`;
-                    size /= 1024;
-                }
-                return `${size.toFixed(1)} TB`;
-            }
-        </script>
+    def open_flow(self, direction):
+        """
+        This client's bandwidth share for one upload ("read") or download
+        ("write"), also held to the minimum transfer rate
         """
+        flow = self.server.bandwidth.flow(direction, self.client_address[0])
+        metrics = getattr(self.server, 'metrics', None)
+        if metrics and self.transfer is None:
+            self.transfer = (direction, metrics.transfer_started(direction))
+        watchdog = getattr(self.server, 'watchdog', None)
+        if watchdog and self.server.admission.min_rate:
+            return GuardedFlow(flow, watchdog, self.connection)
+        return flow
 
+    def read_json_body(self, limit=64 * 1024):
+        length = self.content_length
+        if length > limit:
+            raise ValueError("Request body too large")
+        data = self.rfile.read(length)
+        self.body_consumed = True
+        self.bytes_received += len(data)
+        return json.loads(data or b'{}')
+
+    def send_json_response(self, obj, status=200):
+        """Helper method to send JSON responses"""
+        self.send_body_response(json.dumps(obj).encode('utf-8'), 'application/json', status)
 
     def do_POST(self):
-        """Handle file uploads with proper success response"""
+        """Handle file uploads, streaming each file straight to its destination"""
+        if self.path.startswith(SESSIONS_PREFIX):
+            self.handle_session_request()
+            return
+        if urlsplit(self.path).path == TAR_UPLOAD_PATH:
+            self.handle_tar_upload()
+            return
+        if urlsplit(self.path).path == HASH_UPLOAD_PATH:
+            self.handle_hash_upload()
+            return
+        if self.path != '/upload':
+            self.send_error(404, "Not found")
+            return
+
+        parser = None
         try:
-            if self.path != '/upload':
-                self.send_error(404, "Not found")
+            boundary = get_boundary(self.headers['Content-Type'])
+            length = self.headers.get('Content-Length')
+            if length is None:
+                self.send_error(411, "Content-Length required")
                 return
+            remaining = int(length)
+            unparsed = remaining
+
+            saved = []
+            def open_part(part):
+                if not part.filename:
+                    return None  # plain form field
+                path = safe_upload_path(self.directory, part.filename)
+                saved.append(os.path.basename(path))
+                # The rest of the body bounds the file's size; the excess is given back
+                return UploadFile(path, size_hint=unparsed, durability=self.server.durability)
 
-            content_type = self.headers['Content-Type']
-            if not content_type.startswith('multipart/form-data'):
-                raise ValueError("Invalid content type")
-
-            form = cgi.FieldStorage(
-                fp=self.rfile,
-                headers=self.headers,
-                environ={'REQUEST_METHOD': 'POST'},
-                keep_blank_values=True
-            )
-
-            # Process uploaded files
-            for field in form.list:
-                if field.filename:
-                    file_path = os.path.join(self.directory, field.filename)
-                    total_size = 0
-
-                    # Write file in chunks
-                    with open(file_path, 'wb') as f:
-                        while True:
-                            chunk = field.file.read(16 * 1024)
-                            if not chunk:
-                                break
-                            f.write(chunk)
-                            total_size += len(chunk)
-                            if total_size > 4 * 1024**3:
-                                os.remove(file_path)
-                                raise ValueError("File size exceeds 4GB limit")
+            parser = MultipartParser(boundary, open_part)
+            with self.open_flow("read") as flow:
+                while remaining > 0:
+                    n = min(UPLOAD_READ_SIZE, remaining)
+                    if flow:
+                        flow.throttle(n)
+                    chunk = self.rfile.read(n)
+                    if not chunk:
+                        raise MultipartError("Client closed connection mid-upload")
+                    unparsed = remaining
+                    remaining -= len(chunk)
+                    self.bytes_received += len(chunk)
+                    parser.feed(chunk)
+            self.body_consumed = True
+            parser.close()
+            self.folder_changed(self.directory)
+            self.content_changed([os.path.join(self.directory, name) for name in saved])
 
             # Send success response
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(b'{"status": "success"}')
+            self.send_json_response({"status": "success", "files": saved})
 
         except Exception as e:
-            self.send_error(500, f"Upload failed: {str(e)}")
-            if 'file_path' in locals() and os.path.exists(file_path):
-                os.remove(file_path)
-
-    def generate_directory_listing(self):
-        """Generate styled directory listing"""
-        rows = []
-        with os.scandir(self.directory) as entries:
-            for entry in entries:
-                stat = entry.stat()
-                mod_time = datetime.fromtimestamp(stat.st_mtime).strftime('%Y-%m-%d %H:%M:%S')
-                size = format_file_size(stat.st_size)
-                icon = 'bi-folder' if entry.is_dir() else 'bi-file-earmark'
-                rows.append(f"""
-                    <tr>
-                        <td>
-                            <i class="bi {icon} me-2"></i>
-                            <a href="/{entry.name}" class="text-decoration-none">
-                                {entry.name}
-                            </a>
-                        </td>
-                        <td>{size}</td>
-                        <td>{mod_time}</td>
-                    </tr>
-                """)
-        
-        return f"""
-        <table class="table table-hover">
-            <thead class="table-light">
-                <tr>
-                    <th>Name</th>
-                    <th>Size</th>
-                    <th>Modified</th>
-                </tr>
-            </thead>
-            <tbody>
-                {''.join(rows)}
-            </tbody>
-        </table>
+            if parser is not None:
+                parser.abort()
+            self.close_connection = True  # the rest of the body is unread
+            if isinstance(e, TimeoutError):
+                self.body_timed_out()
+            elif isinstance(e, UploadTooLarge):
+                self.send_error(413, f"Upload failed: {str(e)}")
+            elif isinstance(e, ValueError):
+                self.send_error(400, f"Upload failed: {str(e)}")
+            else:
+                self.send_error(500, f"Upload failed: {str(e)}")
+
+    def handle_tar_upload(self):
+        """
+        Bulk upload: a tar body, optionally gzip or zstd compressed, extracted
+        into the shared folder while it arrives. Answers with the files
+        written and the entries that were skipped.
         """
+        extractor = None
+        try:
+            length = self.headers.get('Content-Length')
+            if length is None:
+                self.send_error(411, "Content-Length required")
+                return
+            remaining = int(length)
+            encoding = body_encoding(self.headers.get('Content-Type'), self.headers.get('Content-Encoding'))
+            extractor = TarExtractor(self.directory, encoding,
+                                     durability=self.server.durability)
+            with self.open_flow("read") as flow:
+                while remaining > 0:
+                    n = min(UPLOAD_READ_SIZE, remaining)
+                    if flow:
+                        flow.throttle(n)
+                    chunk = self.rfile.read(n)
+                    if not chunk:
+                        raise TarUploadError("Client closed connection mid-upload")
+                    remaining -= len(chunk)
+                    self.bytes_received += len(chunk)
+                    extractor.feed(chunk)
+            self.body_consumed = True
+            extractor.close()
+            summary = extractor.summary()
+            self.content_changed([os.path.join(self.directory, name) for name in summary['files']])
+            logging.info(f"Extracted {len(summary['files'])} files from a tar upload "
+                         f"({len(summary['skipped'])} skipped)")
+            self.send_json_response(summary)
+
+        except Exception as e:
+            if extractor is not None:
+                extractor.abort()
+            self.close_connection = True  # the rest of the body is unread
+            if isinstance(e, TimeoutError):
+                self.body_timed_out()
+            elif isinstance(e, UnsupportedEncoding):
+                self.send_error(415, str(e))
+            elif isinstance(e, UploadTooLarge):
+                self.send_error(413, f"Upload failed: {str(e)}")
+            elif isinstance(e, ValueError):
+                self.send_error(400, f"Upload failed: {str(e)}")
+            else:
+                self.send_error(500, f"Upload failed: {str(e)}")
+        finally:
+            if extractor is not None:
+                for path in extractor.touched:
+                    self.folder_changed(path)
+
+    def handle_hash_upload(self):
+        """
+        Hash-first upload: the client sends {"name", "size", "sha256"} and,
+        when a file with that content is already shared, the server stores
+        'name' from it ("method" "copy", "reflink" or "hardlink") and the
+        file doesn't have to be sent. Answers 404 {"status": "missing"}
+        otherwise, so the client uploads it as usual.
+        """
+        try:
+            body = self.read_json_body()
+            path = safe_upload_path(self.directory, str(body['name']))
+            digest, size = check_digest(body['sha256']), int(body['size'])
+            index = self.server.content_index
+            method = None
+            if index is not None:
+                method = store_known_content(index, path, digest, size, body.get('method', 'copy'),
+                                             self.server.durability)
+            if method is None:
+                self.send_json_response({"status": "missing"}, 404)
+                return
+            self.folder_changed(self.directory)
+            logging.info(f"Stored {path} from existing content ({method})")
+            self.send_json_response({"status": "success", "files": [os.path.basename(path)], "method": method})
+        except (KeyError, ValueError) as e:
+            self.close_connection = True
+            self.send_error(400, f"Bad request: {str(e)}")
+        except OSError as e:
+            self.send_error(500, f"Upload failed: {str(e)}")
+
+    def folder_changed(self, path):
+        """Refresh the listing and search index of a folder the server wrote into"""
+        self.server.listing_cache.invalidate(path)
+        if self.server.search_index is not None:
+            self.server.search_index.invalidate(path)
+
+    def content_changed(self, paths):
+        """Have the content index hash files the server just stored"""
+        index = self.server.content_index
+        if index is not None:
+            for path in paths:
+                index.update(path)
 
     def send_html_response(self, html):
-        """Helper method to send HTML responses"""
-        self.send_response(200)
-        self.send_header("Content-type", "text/html")
+        """Helper method to send HTML responses, with an ETag so unchanged pages get a 304"""
+        body = html.encode('utf-8')
+        self.send_body_response(body, "text/html; charset=utf-8",
+                                etag=f'"{hashlib.md5(body).hexdigest()}"')
+
+    def send_body_response(self, body, content_type, status=200, etag=None):
+        """Send an in-memory body, compressed when the client accepts it"""
+        encoding = None
+        compressible = self.server.compressed_cache is not None and is_compressible(content_type, len(body))
+        if compressible:
+            encoding = choose_encoding(self.headers)
+        if etag:
+            etag = variant_etag(etag, encoding)
+            if_none_match = self.headers.get("If-None-Match")
+            if if_none_match is not None and etag_matches(if_none_match, etag):
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", "no-cache")
+                self.end_headers()
+                return
+        if encoding:
+            body = compress_bytes(body, encoding)
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        if compressible:
+            self.send_header("Vary", "Accept-Encoding")
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
         self.end_headers()
-        self.wfile.write(html.encode('utf-8'))
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+            self.bytes_sent += len(body)
 
-def start_http_server(directory, http_port):
+class PooledHTTPServer(HTTPServer):
     """
-    Create and return an HTTPServer instance serving from 'directory'.
-    Caller can run http_server.serve_forever() in a thread.
+    HTTPServer that hands accepted connections to a fixed pool of worker threads.
+    Connections wait in a bounded queue. When it is full, or 'admission'
+    caps the client's connections, the connection is answered with 503 and
+    Retry-After instead. A watchdog drops clients that stall or trickle.
     """
+
+    def __init__(self, server_address, handler_class, workers=DEFAULT_HTTP_WORKERS,
+                 queue_size=DEFAULT_HTTP_QUEUE_SIZE, drain_timeout=DEFAULT_DRAIN_TIMEOUT,
+                 bind_and_activate=True, admission=None):
+        self.workers = max(1, workers)
+        self.admission = admission or AdmissionControl()
+        self.watchdog = Watchdog(self.admission)
+        self.request_queue_size = max(5, queue_size)
+        self.drain_timeout = drain_timeout
+        self._pending = queue.Queue(maxsize=max(1, queue_size))
+        self._active = set()
+        self._active_lock = threading.Lock()
+        self._threads = []
+        # Optional components; create_http_server() sets the enabled ones
+        self.hot_cache = self.compressed_cache = None
+        self.content_index = self.search_index = None
+        self.owned_indexes = []  # the ones built for this server, closed with it
+        super().__init__(server_address, handler_class, bind_and_activate)
+
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"http-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def process_request(self, request, client_address):
+        """Queue the connection for a worker instead of serving it inline"""
+        ip = client_address[0]
+        reason = self.admission.admit(ip)
+        if reason is None:
+            try:
+                self._pending.put_nowait((request, client_address))
+                return
+            except queue.Full:
+                reason = "queue full"
+                self.admission.reject(ip, reason)
+        logging.warning(f"Rejected HTTP connection from {ip}: {reason} "
+                        f"({self.queue_depth()} queued, {len(self._active)} active)")
+        self.reject_request(request, reason)
+
+    def reject_request(self, request, reason):
+        """Answer 503 without tying up a worker; the accept loop must not block here"""
+        try:
+            request.setblocking(False)
+            request.send(busy_response(reason, self.admission.retry_after))
+            request.recv(65536)  # swallow the request so closing doesn't reset the reply
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], (ConnectionError, TimeoutError)):
+            logging.debug(f"Connection from {client_address[0]} dropped")
+            return
+        super().handle_error(request, client_address)
+
+    def _worker(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            request, client_address = item
+            with self._active_lock:
+                self._active.add(request)
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                with self._active_lock:
+                    self._active.discard(request)
+                self.watchdog.disarm(request)
+                self.shutdown_request(request)
+                self.admission.release(client_address[0])
+
+    def queue_depth(self):
+        """Number of accepted connections waiting for a free worker"""
+        return self._pending.qsize()
+
+    def server_status(self):
+        """Connection counts, queue depth, rejections and timeouts for /server-status"""
+        return self.admission.stats(engine="threads", workers=self.workers, active=len(self._active),
+                                    queued=self.queue_depth(), queue_size=self._pending.maxsize,
+                                    hot_cache=self.hot_cache.stats() if self.hot_cache else None,
+                                    content_index=self.content_index.stats() if self.content_index else None,
+                                    search_index=self.search_index.stats() if self.search_index else None)
+
+    def shutdown(self):
+        """
+        Stop accepting, let the workers finish queued and in-flight requests,
+        and cut off whatever is still running after drain_timeout seconds.
+        """
+        super().shutdown()
+        for _ in self._threads:
+            self._pending.put(None)
+
+        deadline = threading.TIMEOUT_MAX if self.drain_timeout is None else self.drain_timeout
+        for t in self._threads:
+            t.join(deadline)
+            if not t.is_alive():
+                continue
+            # Drain timed out: unblock workers stuck on slow clients
+            with self._active_lock:
+                for request in list(self._active):
+                    try:
+                        request.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+            t.join(1.0)
+        self._threads = []
+        self.watchdog.stop()
+
+    def server_close(self):
+        super().server_close()
+        for index in self.owned_indexes:
+            index.close()
+
+def create_http_server(directory, server_address, sock=None, workers=DEFAULT_HTTP_WORKERS,
+                       queue_size=DEFAULT_HTTP_QUEUE_SIZE, keep_alive=True,
+                       keepalive_timeout=DEFAULT_KEEPALIVE_TIMEOUT,
+                       max_keepalive_requests=DEFAULT_MAX_KEEPALIVE_REQUESTS,
+                       etag_mode="stat", cache_control="no-cache", compression=True,
+                       compression_cache_dir=None, compression_cache_size=DEFAULT_CACHE_SIZE,
+                       engine="threads", bandwidth=None, max_connections=DEFAULT_MAX_CONNECTIONS,
+                       max_connections_per_ip=DEFAULT_MAX_CONNECTIONS_PER_IP,
+                       header_timeout=DEFAULT_HEADER_TIMEOUT, body_timeout=DEFAULT_BODY_TIMEOUT,
+                       min_rate=DEFAULT_MIN_RATE, metrics=None, hot_cache_size=DEFAULT_HOT_CACHE_SIZE,
+                       hot_file_size=DEFAULT_HOT_FILE_SIZE, durability=DEFAULT_DURABILITY,
+                       hash_workers=0, search=True, search_index=None, content_index=None):
+    """
+    Build the server object for start_http_server(), binding 'server_address'
+    or serving from an already listening 'sock'. Worker processes call this
+    with their own socket, so it must stay a picklable module-level function.
+    They also pass proxies of their supervisor's 'search_index' and
+    'content_index', which are used instead of building new ones.
+    """
+    handler_class = lambda *args: CustomHandler(*args, directory=directory)
+    admission = AdmissionControl(max_connections, max_connections_per_ip,
+                                 header_timeout, body_timeout, min_rate)
+    if engine == "asyncio":
+        http_server = AsyncHTTPServer(server_address, directory, io_threads=workers or 1,
+                                      backlog=max(queue_size, 128), sock=sock, admission=admission)
+    elif workers:
+        http_server = PooledHTTPServer(server_address, handler_class, workers=workers,
+                                       queue_size=queue_size, bind_and_activate=sock is None,
+                                       admission=admission)
+    else:
+        http_server = HTTPServer(server_address, handler_class, bind_and_activate=sock is None)
+    if sock is not None and engine != "asyncio":
+        http_server.socket.close()
+        http_server.socket = sock
+        http_server.server_address = sock.getsockname()
+    http_server.keep_alive = keep_alive
+    http_server.keepalive_timeout = keepalive_timeout
+    http_server.max_keepalive_requests = max_keepalive_requests
+    http_server.durability = check_durability(durability)
+    http_server.upload_sessions = UploadSessionStore(directory, durability=durability)
+    http_server.listing_cache = ListingCache(hidden=(SESSION_DIR_NAME,))
+    owned_indexes = []
+    if content_index is None and hash_workers:
+        content_index = ContentIndex(directory, http_server.upload_sessions.session_dir, hash_workers,
+                                     hidden=(SESSION_DIR_NAME,))
+        owned_indexes.append(content_index)
+    if search_index is None and search:
+        search_index = SearchIndex(directory, hidden=(SESSION_DIR_NAME,))
+        owned_indexes.append(search_index)
+    http_server.content_index = content_index
+    http_server.search_index = search_index
+    http_server.owned_indexes = owned_indexes
+    http_server.validator_cache = ValidatorCache(etag_mode, index=content_index)
+    http_server.hot_cache = HotFileCache(hot_cache_size, hot_file_size) if hot_cache_size else None
+    http_server.path_cache = PathCache()
+    http_server.cache_control = cache_control
+    http_server.compressed_cache = (CompressedCache(compression_cache_dir, compression_cache_size)
+                                    if compression else None)
+    http_server.bandwidth = bandwidth or BandwidthLimiter()
+    http_server.metrics = metrics or Metrics()
+    if not hasattr(http_server, 'admission'):
+        http_server.admission = admission  # timeouts only; plain HTTPServer has no caps
+    return http_server
+
+def start_http_server(directory, http_port, workers=DEFAULT_HTTP_WORKERS,
+                      queue_size=DEFAULT_HTTP_QUEUE_SIZE, keep_alive=True,
+                      keepalive_timeout=DEFAULT_KEEPALIVE_TIMEOUT,
+                      max_keepalive_requests=DEFAULT_MAX_KEEPALIVE_REQUESTS,
+                      etag_mode="stat", cache_control="no-cache", compression=True,
+                      compression_cache_dir=None, compression_cache_size=DEFAULT_CACHE_SIZE,
+                      engine="threads", processes=1, bandwidth=None,
+                      max_connections=DEFAULT_MAX_CONNECTIONS,
+                      max_connections_per_ip=DEFAULT_MAX_CONNECTIONS_PER_IP,
+                      header_timeout=DEFAULT_HEADER_TIMEOUT, body_timeout=DEFAULT_BODY_TIMEOUT,
+                      min_rate=DEFAULT_MIN_RATE, metrics=None, hot_cache_size=DEFAULT_HOT_CACHE_SIZE,
+                      hot_file_size=DEFAULT_HOT_FILE_SIZE, durability=DEFAULT_DURABILITY,
+                      hash_workers=0, search=True, sock=None):
+    """
+    Create and return an HTTP server instance serving from 'directory' (the
+    options are described in the README). Caller can run
+    http_server.serve_forever() in a thread and stop it with shutdown().
+    """
+    if engine not in ("threads", "asyncio"):
+        raise ValueError(f"Unknown HTTP engine: {engine}")
+    check_durability(durability)
     if not os.path.exists(directory):
         raise FileNotFoundError("Selected directory doesn't exist or is inaccessible.")
 
-    if is_port_in_use(http_port):
+    if sock is None and is_port_in_use(http_port):
         raise OSError(f"HTTP port {http_port} is already in use.")
 
     # Verify write permissions
     if not os.access(directory, os.W_OK):
         raise PermissionError("No write permissions for the directory")
 
-    handler_class = lambda *args: CustomHandler(*args, directory=directory)
-    server_address = ("0.0.0.0", http_port)
-    http_server = HTTPServer(server_address, handler_class)
+    options = dict(workers=workers, queue_size=queue_size, keep_alive=keep_alive,
+                   keepalive_timeout=keepalive_timeout,
+                   max_keepalive_requests=max_keepalive_requests, etag_mode=etag_mode,
+                   cache_control=cache_control, compression=compression,
+                   compression_cache_dir=compression_cache_dir,
+                   compression_cache_size=compression_cache_size, engine=engine,
+                   max_connections=max_connections, max_connections_per_ip=max_connections_per_ip,
+                   header_timeout=header_timeout, body_timeout=body_timeout, min_rate=min_rate,
+                   hot_cache_size=hot_cache_size, hot_file_size=hot_file_size,
+                   durability=durability, hash_workers=hash_workers, search=search)
+    server_address = ("0.0.0.0", http_port) if sock is None else sock.getsockname()[:2]
+    processes = processes or os.cpu_count() or 1
+    if processes > 1:
+        if bandwidth is not None:
+            options["bandwidth"] = bandwidth.split(processes)
+        if compression:
+            # Resolved once, so every worker uses the same cache folder
+            options["compression_cache_dir"] = prepare_cache_dir(compression_cache_dir)
+        shared = None
+        if search or hash_workers:
+            shared = SharedObjects()
+            shared.start()
+        try:
+            if search:
+                options["search_index"] = shared.create("SearchIndex", directory, hidden=(SESSION_DIR_NAME,))
+            if hash_workers:
+                options["content_index"] = shared.create("ContentIndex", directory,
+                                                         os.path.join(directory, SESSION_DIR_NAME),
+                                                         hash_workers, hidden=(SESSION_DIR_NAME,))
+            http_server = HTTPWorkerProcesses(server_address, processes, create_http_server,
+                                              (directory, server_address), options,
+                                              backlog=max(queue_size, 128), sock=sock, shared=shared)
+        except BaseException:
+            if shared is not None:
+                shared.close()
+            raise
+        logging.info(f"Starting {processes} HTTP worker processes")
+    else:
+        http_server = create_http_server(directory, server_address, sock=sock, bandwidth=bandwidth,
+                                         metrics=metrics, **options)
 
     local_ip = get_local_ip()
-    logging.info(f"HTTP Server ready at http://{local_ip}:{http_port}")
+    logging.info(f"HTTP Server ready at http://{local_ip}:{server_address[1]}")
     logging.info(f"Serving directory: {directory}")
-    return http_server
\ No newline at end of file
+    return http_server
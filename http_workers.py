@@ -0,0 +1,195 @@
+# http_workers.py
+import os
+import sys
+import time
+import socket
+import logging
+import threading
+import multiprocessing
+from multiprocessing.connection import wait
+from multiprocessing.managers import BaseManager
+
+RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 30.0
+STOP_GRACE = 5.0  # extra time a worker gets after its drain timeout before it is killed
+# Linux balances connections across SO_REUSEPORT listeners; BSD/macOS hand
+# them all to one socket, so there the workers share a pre-bound socket instead
+REUSE_PORT = sys.platform.startswith("linux") and hasattr(socket, "SO_REUSEPORT")
+
+def listening_socket(server_address, backlog=128, reuse_port=False, listen=True):
+    """Bind a TCP socket; with reuse_port several processes can bind the same port"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        if os.name == 'posix':
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(server_address)
+        if listen:
+            sock.listen(backlog)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+class SharedObjects(BaseManager):
+    """
+    Process holding objects that every worker uses, such as the search and
+    content indexes, so there is one copy instead of one per worker.
+    Register the classes, start(), create() the objects and pass the
+    proxies to the workers in their options. close() closes the objects
+    and stops the process.
+    """
+
+    def __init__(self):
+        super().__init__(ctx=multiprocessing.get_context("spawn"))
+        self._objects = []
+
+    def create(self, typeid, *args, **kwargs):
+        proxy = getattr(self, typeid)(*args, **kwargs)
+        self._objects.append(proxy)
+        return proxy
+
+    def close(self):
+        for proxy in self._objects:
+            try:
+                proxy.close()
+            except Exception as e:
+                logging.debug(f"Could not close a shared object: {e}")
+        self._objects = []
+        self.shutdown()
+
+def _worker_main(index, factory, args, options, server_address, backlog, shared_sock, stop_conn):
+    """
+    Entry point of a worker process: serve until the supervisor closes its
+    end of 'stop_conn', which also happens when the supervisor dies.
+    """
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(processName)s - %(message)s")
+    sock = shared_sock or listening_socket(server_address, backlog, reuse_port=True)
+    server = factory(*args, sock=sock, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"HTTP worker {index} serving on port {server_address[1]} (pid {os.getpid()})")
+
+    try:
+        stop_conn.poll(None)
+    except KeyboardInterrupt:
+        pass
+    server.shutdown()
+    server.server_close()
+
+class HTTPWorkerProcesses:
+    """
+    Runs 'processes' copies of an HTTP server in separate processes so that
+    request handling is not limited to one core by the GIL. Each worker calls
+    factory(*args, sock=<listening socket>, **options) and serves from it.
+    On Linux every worker binds its own SO_REUSEPORT socket and the kernel
+    spreads connections between them; elsewhere they accept from one socket
+    bound here. serve_forever() supervises the workers and restarts crashed
+    ones with backoff; shutdown() stops them all. Workers use the "spawn"
+    start method so they don't inherit the GUI's threads and sockets.
+    An already listening 'sock' (e.g. from systemd) is shared the same way.
+    'shared' is a started SharedObjects whose proxies are in 'options'; it
+    is closed with server_close().
+    """
+
+    def __init__(self, server_address, processes, factory, args=(), options=None,
+                 backlog=128, drain_timeout=5.0, reuse_port=REUSE_PORT, sock=None, shared=None):
+        self.processes = max(1, processes)
+        self.shared = shared
+        self.factory = factory
+        self.args = args
+        self.options = options or {}
+        self.backlog = backlog
+        self.drain_timeout = drain_timeout
+        self.context = multiprocessing.get_context("spawn")
+
+        # With SO_REUSEPORT this socket only reserves the port (it never
+        # listens, so it gets no connections); otherwise workers accept on it
+        self.reuse_port = reuse_port and sock is None
+        self.socket = sock or listening_socket(server_address, backlog, reuse_port, listen=not reuse_port)
+        self.server_address = self.socket.getsockname()
+
+        self._stopping = threading.Event()
+        self._stopped = threading.Event()
+        self._serving = False
+        self._workers = [None] * self.processes
+        self._stop_conns = [None] * self.processes
+        self._started_at = [0.0] * self.processes
+        self._failures = [0] * self.processes
+        self._restart_at = [0.0] * self.processes
+
+    def _start(self, index):
+        shared = None if self.reuse_port else self.socket
+        stop_reader, stop_writer = self.context.Pipe(duplex=False)
+        process = self.context.Process(
+            target=_worker_main, name=f"http-worker-{index}", daemon=True,
+            args=(index, self.factory, self.args, self.options, self.server_address,
+                  self.backlog, shared, stop_reader))
+        process.start()
+        stop_reader.close()
+        self._workers[index] = process
+        self._stop_conns[index] = stop_writer
+        self._started_at[index] = time.monotonic()
+
+    def _reap(self, index):
+        """Schedule a restart for a worker that exited, backing off if it keeps crashing"""
+        process = self._workers[index]
+        process.join()
+        self._workers[index] = None
+        self._stop_conns[index].close()
+        now = time.monotonic()
+        if now - self._started_at[index] > MAX_RESTART_DELAY:
+            self._failures[index] = 0
+        self._failures[index] += 1
+        delay = min(RESTART_DELAY * 2 ** (self._failures[index] - 1), MAX_RESTART_DELAY)
+        self._restart_at[index] = now + delay
+        logging.warning(f"HTTP worker {index} (pid {process.pid}) exited with code "
+                        f"{process.exitcode}, restarting in {delay:.0f}s")
+
+    def serve_forever(self):
+        self._serving = True
+        try:
+            for i in range(self.processes):
+                self._start(i)
+            while not self._stopping.is_set():
+                sentinels = [p.sentinel for p in self._workers if p is not None]
+                wait(sentinels, timeout=0.5)
+                now = time.monotonic()
+                for i, process in enumerate(self._workers):
+                    if self._stopping.is_set():
+                        break
+                    if process is not None and not process.is_alive():
+                        self._reap(i)
+                    elif process is None and now >= self._restart_at[i]:
+                        self._start(i)
+        finally:
+            self._stop_workers()
+            self._stopped.set()
+
+    def _stop_workers(self):
+        for conn in self._stop_conns:
+            if conn is not None:
+                conn.close()
+        deadline = time.monotonic() + self.drain_timeout + STOP_GRACE
+        for process in self._workers:
+            if process is not None:
+                process.join(max(0, deadline - time.monotonic()))
+        for process in self._workers:
+            if process is not None and process.is_alive():
+                logging.warning(f"HTTP worker pid {process.pid} did not stop, terminating")
+                process.terminate()
+                process.join(1.0)
+        self._workers = [None] * self.processes
+        self._stop_conns = [None] * self.processes
+
+    def shutdown(self):
+        """Stop all workers, letting each drain its in-flight requests"""
+        self._stopping.set()
+        if self._serving:
+            self._stopped.wait()
+
+    def server_close(self):
+        self.socket.close()
+        if self.shared is not None:
+            self.shared.close()
+            self.shared = None
@@ -0,0 +1,139 @@
+# listing.py
+import os
+import time
+import threading
+from collections import OrderedDict, namedtuple
+from uploads import is_temp_upload
+
+Entry = namedtuple("Entry", "name is_dir size mtime")
+
+SORT_KEYS = {
+    "name": lambda e: e.name.lower(),
+    "size": lambda e: e.size,
+    "mtime": lambda e: e.mtime,
+}
+DEFAULT_PER_PAGE = 200
+MAX_PER_PAGE = 5000
+DEFAULT_CACHE_DIRS = 256
+DEFAULT_MAX_AGE = 30.0   # picks up size/mtime changes of files, which don't touch the directory
+RACY_WINDOW_NS = 2 * 10**9  # mtime granularity: don't trust a directory modified this close to the scan
+
+class DirectoryListing:
+    """Snapshot of one directory's entries with lazily built sort orders"""
+
+    def __init__(self, path, dir_mtime_ns, entries):
+        self.path = path
+        self.dir_mtime_ns = dir_mtime_ns
+        self.entries = entries
+        self.scanned_ns = time.time_ns()
+        self.scanned = time.monotonic()
+        self._orders = {}
+        self._lock = threading.Lock()
+
+    def sorted(self, sort="name", reverse=False):
+        """Entries ordered by 'sort', directories first; each order is built once"""
+        key = (sort, reverse)
+        order = self._orders.get(key)
+        if order is None:
+            with self._lock:
+                order = self._orders.get(key)
+                if order is None:
+                    keyfunc = SORT_KEYS.get(sort, SORT_KEYS["name"])
+                    files = sorted((e for e in self.entries if not e.is_dir), key=keyfunc, reverse=reverse)
+                    dirs = sorted((e for e in self.entries if e.is_dir), key=keyfunc, reverse=reverse)
+                    order = self._orders[key] = dirs + files
+        return order
+
+    def page(self, page=1, per_page=DEFAULT_PER_PAGE, sort="name", reverse=False):
+        """Return (entries on the page, number of pages)"""
+        per_page = max(1, min(per_page, MAX_PER_PAGE))
+        pages = max(1, -(-len(self.entries) // per_page))
+        page = max(1, min(page, pages))
+        start = (page - 1) * per_page
+        return self.sorted(sort, reverse)[start:start + per_page], pages
+
+def scan_directory(path, hidden=()):
+    """
+    Read a directory's entries with their sizes and modification times,
+    leaving out 'hidden' names and uploads that are still being written
+    """
+    entries = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.name in hidden or is_temp_upload(entry.name):
+                continue
+            try:
+                st = entry.stat()
+                is_dir = entry.is_dir()
+            except OSError:
+                continue  # vanished or unreadable since readdir
+            entries.append(Entry(entry.name, is_dir, 0 if is_dir else st.st_size, st.st_mtime))
+    return entries
+
+class ListingCache:
+    """
+    LRU cache of directory listings. A cached listing is reused while the
+    directory's mtime is unchanged, so repeat views cost one stat() instead
+    of a scandir() plus a stat() per entry. Listings are also refreshed after
+    'max_age' seconds, and can be dropped explicitly with invalidate().
+    """
+
+    def __init__(self, max_dirs=DEFAULT_CACHE_DIRS, max_age=DEFAULT_MAX_AGE, hidden=()):
+        self.max_dirs = max_dirs
+        self.max_age = max_age
+        self.hidden = frozenset(hidden)
+        self._listings = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        path = os.path.normpath(path)
+        st = os.stat(path)
+        with self._lock:
+            listing = self._listings.get(path)
+            if listing is not None and self._fresh(listing, st):
+                self._listings.move_to_end(path)
+                return listing
+
+        listing = DirectoryListing(path, st.st_mtime_ns, scan_directory(path, self.hidden))
+        with self._lock:
+            self._listings[path] = listing
+            self._listings.move_to_end(path)
+            while len(self._listings) > self.max_dirs:
+                self._listings.popitem(last=False)
+        return listing
+
+    def _fresh(self, listing, st):
+        if st.st_mtime_ns != listing.dir_mtime_ns:
+            return False
+        if listing.scanned_ns - listing.dir_mtime_ns < RACY_WINDOW_NS:
+            return False  # a change in the same mtime tick as the scan could be missed
+        return time.monotonic() - listing.scanned < self.max_age
+
+    def invalidate(self, path):
+        """Forget the listing of 'path', e.g. after a file was written into it"""
+        with self._lock:
+            self._listings.pop(os.path.normpath(path), None)
+
+def parse_listing_query(query):
+    """(page, per_page, sort, order) from parsed ?page=&per_page=&sort=&order= parameters"""
+    page = int(query.get('page', ['1'])[0])
+    per_page = int(query.get('per_page', [str(DEFAULT_PER_PAGE)])[0])
+    sort = query.get('sort', ['name'])[0]
+    if sort not in SORT_KEYS:
+        sort = 'name'
+    order = 'desc' if query.get('order', ['asc'])[0] == 'desc' else 'asc'
+    return page, per_page, sort, order
+
+def listing_json(url_path, listing, entries, page, pages, per_page, sort, order):
+    """JSON body for one page of a directory listing"""
+    return {
+        "path": url_path,
+        "total": len(listing.entries),
+        "page": page,
+        "pages": pages,
+        "per_page": per_page,
+        "sort": sort,
+        "order": order,
+        "entries": [{"name": e.name, "type": "dir" if e.is_dir else "file",
+                     "size": e.size, "mtime": e.mtime} for e in entries],
+    }
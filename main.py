@@ -1,7 +1,14 @@
 # main.py
-from gui import run_gui
+import sys
+import multiprocessing
 
 def main():
+    multiprocessing.freeze_support()  # HTTP worker processes in frozen builds
+    if len(sys.argv) > 1:
+        # Headless: command line and config file, without loading tkinter
+        from daemon import main as run_daemon
+        sys.exit(run_daemon(sys.argv[1:]))
+    from gui import run_gui
     run_gui()
 
 if __name__ == "__main__":
@@ -0,0 +1,233 @@
+# metrics.py
+import time
+import threading
+from bisect import bisect_left
+from upload_sessions import SESSIONS_PREFIX
+from tar_upload import TAR_UPLOAD_PATH
+from content_index import HASH_UPLOAD_PATH
+from search_index import SEARCH_PATH
+from assets import STATIC_PREFIX
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DURATION_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+THROUGHPUT_BUCKETS = tuple(64 * 1024 * 4 ** i for i in range(8))  # 64KB/s up to 1GB/s
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+MIN_THROUGHPUT_BYTES = 64 * 1024  # smaller transfers say more about latency than bandwidth
+
+def route_of(method, path):
+    """
+    Low-cardinality label for a request path; file and listing URLs are
+    all "files" so the label can't grow with the shared directory
+    """
+    if path.startswith(SESSIONS_PREFIX):
+        return "upload_session"
+    if path == TAR_UPLOAD_PATH:
+        return "upload_tar"
+    if path == HASH_UPLOAD_PATH:
+        return "upload_hash"
+    if path == '/upload':
+        return "upload" if method == 'POST' else "upload_page"
+    if path == SEARCH_PATH:
+        return "search"
+    if path == '/metrics':
+        return "metrics"
+    if path == '/server-status':
+        return "status"
+    if path.startswith(STATIC_PREFIX):
+        return "static"
+    return "files"
+
+class _Family:
+    """A named metric with fixed label names; values live in the registry's shards"""
+
+    kind = None
+
+    def __init__(self, registry, name, help, labels=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = labels
+        registry.families.append(self)
+
+class Counter(_Family):
+    kind = "counter"
+
+    def inc(self, labels=(), value=1):
+        shard = self.registry.shard()
+        key = (self.name, labels)
+        shard[key] = shard.get(key, 0) + value
+
+class Gauge(Counter):
+    """A counter that may go down; the total is the sum of every thread's changes"""
+
+    kind = "gauge"
+
+    def dec(self, labels=(), value=1):
+        self.inc(labels, -value)
+
+class Histogram(_Family):
+    kind = "histogram"
+
+    def __init__(self, registry, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value, labels=()):
+        shard = self.registry.shard()
+        key = (self.name, labels)
+        counts = shard.get(key)
+        if counts is None:
+            # One slot per bucket plus +Inf, then the sum of observed values
+            counts = shard[key] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+class Metrics:
+    """
+    Counters, gauges and histograms for both servers, rendered in the
+    Prometheus text format at /metrics. Each thread updates its own shard
+    without locking; render() adds the shards up, folding in those of
+    threads that have exited so per-session FTP threads don't pile up.
+    One registry is shared by the HTTP and FTP servers like the bandwidth
+    limiter; HTTP worker processes each get a fresh one and report only
+    their own requests.
+    """
+
+    def __init__(self):
+        self.families = []
+        self._local = threading.local()
+        self._shards = []  # (thread, shard)
+        self._retired = {}
+        self._lock = threading.Lock()
+
+        self.http_requests = Counter(self, "http_requests_total", "HTTP requests answered", ("route", "code"))
+        self.http_latency = Histogram(self, "http_request_duration_seconds",
+                                      "Time from parsed request head to the end of the response", ("route",))
+        self.http_sent = Counter(self, "http_sent_bytes_total", "HTTP response body bytes sent", ("route",))
+        self.http_received = Counter(self, "http_received_bytes_total", "HTTP request body bytes read", ("route",))
+        self.http_errors = Counter(self, "http_errors_total",
+                                   "HTTP requests that failed: client_error, server_error, aborted or timeout",
+                                   ("route", "kind"))
+        self.http_transfers = Gauge(self, "http_active_transfers",
+                                    "File uploads (read) and downloads (write) in progress", ("direction",))
+        self.http_throughput = Histogram(self, "http_transfer_throughput_bytes_per_second",
+                                         "Throughput of HTTP file transfers of at least 64KB",
+                                         ("direction",), THROUGHPUT_BUCKETS)
+        self.ftp_logins = Counter(self, "ftp_logins_total", "FTP login attempts", ("result",))
+        self.ftp_sessions = Gauge(self, "ftp_active_sessions", "Connected FTP control channels")
+        self.ftp_bytes = Counter(self, "ftp_transfer_bytes_total", "FTP data channel bytes", ("command",))
+        self.ftp_transfers = Counter(self, "ftp_transfers_total", "FTP file transfers", ("command", "result"))
+        self.ftp_duration = Histogram(self, "ftp_transfer_duration_seconds", "FTP file transfer durations",
+                                      ("command",), DURATION_BUCKETS)
+
+    def __reduce__(self):
+        # Worker processes start from zero
+        return (self.__class__, ())
+
+    def shard(self):
+        """This thread's counters"""
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    # ----- recording -----
+
+    def request_finished(self, route, code, seconds, sent=0, received=0, error=None):
+        """Record one HTTP request; 'error' is "aborted" or "timeout" when the response didn't complete"""
+        self.http_requests.inc((route, str(code or 0)))
+        self.http_latency.observe(seconds, (route,))
+        if sent:
+            self.http_sent.inc((route,), sent)
+        if received:
+            self.http_received.inc((route,), received)
+        if error is None and code:
+            if code >= 500:
+                error = "server_error"
+            elif code >= 400:
+                error = "client_error"
+        if error:
+            self.http_errors.inc((route, error))
+
+    def transfer_started(self, direction):
+        self.http_transfers.inc((direction,))
+        return time.perf_counter()
+
+    def transfer_finished(self, direction, started, nbytes):
+        self.http_transfers.dec((direction,))
+        seconds = time.perf_counter() - started
+        if nbytes >= MIN_THROUGHPUT_BYTES and seconds > 0:
+            self.http_throughput.observe(nbytes / seconds, (direction,))
+
+    def ftp_transfer(self, command, nbytes, seconds, completed):
+        self.ftp_bytes.inc((command,), nbytes)
+        self.ftp_transfers.inc((command, "completed" if completed else "incomplete"))
+        self.ftp_duration.observe(seconds, (command,))
+
+    # ----- exposition -----
+
+    def collect(self):
+        """Totals over all threads, keyed by (name, labels)"""
+        totals = {}
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    _merge(self._retired, shard)  # the thread is gone, so its shard is final
+            self._shards = live
+            _merge(totals, self._retired)
+            for _, shard in live:
+                _merge(totals, shard.copy())
+        return totals
+
+    def render(self):
+        totals = self.collect()
+        lines = []
+        for family in self.families:
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            samples = sorted((labels, value) for (name, labels), value in totals.items()
+                             if name == family.name)
+            if not samples and not family.labels:
+                samples = [((), [0] * (len(family.buckets) + 2) if family.kind == "histogram" else 0)]
+            for labels, value in samples:
+                pairs = [f'{n}="{_escape(v)}"' for n, v in zip(family.labels, labels)]
+                if family.kind != "histogram":
+                    lines.append(f"{family.name}{_labels(pairs)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(family.buckets + ("+Inf",), value):
+                    cumulative += count
+                    le = 'le="%s"' % (bound if bound == "+Inf" else _number(bound))
+                    lines.append(f"{family.name}_bucket{_labels(pairs + [le])} {cumulative}")
+                lines.append(f"{family.name}_sum{_labels(pairs)} {_number(value[-1])}")
+                lines.append(f"{family.name}_count{_labels(pairs)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+def _merge(into, shard):
+    for key, value in shard.items():
+        if isinstance(value, list):
+            value = list(value)  # a live thread may still be adding to it
+            current = into.get(key)
+            if current is None:
+                into[key] = value
+            else:
+                into[key] = [a + b for a, b in zip(current, value)]
+        else:
+            into[key] = into.get(key, 0) + value
+
+def _labels(pairs):
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
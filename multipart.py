@@ -0,0 +1,121 @@
+# multipart.py
+from email.parser import BytesHeaderParser
+from email.message import Message
+
+MAX_HEADER_SIZE = 16 * 1024
+
+class MultipartError(ValueError):
+    """Malformed multipart/form-data body"""
+
+def get_boundary(content_type):
+    """Extract the boundary parameter from a multipart/form-data Content-Type"""
+    msg = Message()
+    msg['Content-Type'] = content_type or ''
+    if msg.get_content_type() != 'multipart/form-data':
+        raise MultipartError("Invalid content type")
+    boundary = msg.get_param('boundary')
+    if not boundary or len(boundary) > 200:
+        raise MultipartError("Missing multipart boundary")
+    return boundary
+
+class Part:
+    """Headers of one multipart section"""
+
+    def __init__(self, raw_headers):
+        self.headers = BytesHeaderParser().parsebytes(raw_headers)
+        self.name = self.headers.get_param('name', header='content-disposition')
+        self.filename = self.headers.get_filename()
+
+class MultipartParser:
+    """
+    Incremental multipart/form-data parser. Feed it the request body in
+    chunks of any size; for each section it calls open_part(part), which
+    returns an object with write(data) and close() to receive the section's
+    body, or None to skip it. Memory use is bounded by the chunk size.
+    """
+
+    def __init__(self, boundary, open_part):
+        if isinstance(boundary, str):
+            boundary = boundary.encode('latin-1')
+        self.delimiter = b'\r\n--' + boundary
+        self.open_part = open_part
+        # Pretend a CRLF precedes the body so the first boundary matches the delimiter
+        self.buffer = bytearray(b'\r\n')
+        self.state = 'preamble'
+        self.sink = None
+
+    def feed(self, data):
+        self.buffer += data
+        while self.state != 'done':
+            if self.state == 'preamble':
+                if not self._skip_to_delimiter():
+                    return
+            elif self.state == 'after-delimiter':
+                if len(self.buffer) < 2:
+                    return
+                if self.buffer[:2] == b'--':
+                    self.state = 'done'
+                elif self.buffer[:2] == b'\r\n':
+                    self.state = 'headers'
+                else:
+                    raise MultipartError("Malformed boundary line")
+                del self.buffer[:2]
+            elif self.state == 'headers':
+                end = self.buffer.find(b'\r\n\r\n')
+                if end < 0:
+                    if len(self.buffer) > MAX_HEADER_SIZE:
+                        raise MultipartError("Part headers too large")
+                    return
+                part = Part(bytes(self.buffer[:end]))
+                del self.buffer[:end + 4]
+                self.sink = self.open_part(part)
+                self.state = 'body'
+            elif self.state == 'body':
+                if not self._emit_body():
+                    return
+
+    def _skip_to_delimiter(self):
+        index = self.buffer.find(self.delimiter)
+        if index < 0:
+            keep = len(self.delimiter) - 1
+            if len(self.buffer) > keep:
+                del self.buffer[:len(self.buffer) - keep]
+            return False
+        del self.buffer[:index + len(self.delimiter)]
+        self.state = 'after-delimiter'
+        return True
+
+    def _emit_body(self):
+        index = self.buffer.find(self.delimiter)
+        if index < 0:
+            # Hold back enough bytes to catch a delimiter split across chunks
+            safe = len(self.buffer) - (len(self.delimiter) - 1)
+            if safe > 0:
+                self._write(memoryview(self.buffer)[:safe])
+                del self.buffer[:safe]
+            return False
+        self._write(memoryview(self.buffer)[:index])
+        del self.buffer[:index + len(self.delimiter)]
+        if self.sink is not None:
+            sink, self.sink = self.sink, None
+            sink.close()
+        self.state = 'after-delimiter'
+        return True
+
+    def _write(self, data):
+        try:
+            if self.sink is not None and len(data):
+                self.sink.write(data)
+        finally:
+            data.release()
+
+    def abort(self):
+        """Drop the section being written, e.g. after an error"""
+        sink, self.sink = self.sink, None
+        if sink is not None and hasattr(sink, 'abort'):
+            sink.abort()
+
+    def close(self):
+        """Finish parsing; raises MultipartError if the body was truncated"""
+        if self.state != 'done':
+            raise MultipartError("Incomplete multipart body")
@@ -0,0 +1,265 @@
+# pages.py
+import os
+from html import escape
+from datetime import datetime
+from string import Template
+from urllib.parse import quote, unquote
+from utils import format_file_size
+from assets import ASSETS
+
+# Page shells are rendered once; per request only the listing parts are filled in
+HEAD = f"""
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+    <link rel="stylesheet" href="{ASSETS.url('app.css')}">
+"""
+
+UPLOAD_PAGE = f"""
+    <!DOCTYPE html>
+    <html lang="en">
+    <head>
+        {HEAD}
+        <title>Upload Files</title>
+        <script src="{ASSETS.url('uploader.js')}"></script>
+    </head>
+    <body>
+        <div class="container">
+            <h1 class="my-4"><i class="bi bi-cloud-upload"></i> Upload Files</h1>
+            <a href="/" class="btn btn-outline-secondary mb-4">
+                <i class="bi bi-arrow-left"></i> Back to Files
+            </a>
+
+            <div class="card">
+                <div class="card-body">
+                    <div id="drop-zone" class="drop-zone">
+                        <input type="file" name="file" id="file-input" multiple 
+                               class="d-none" onchange="handleFiles(this.files)">
+                        <label for="file-input" class="drop-zone-label">
+                            <i class="bi bi-file-earmark-arrow-up fs-1"></i>
+                            <div>Drag & drop files here or click to select</div>
+                            <div class="text-muted">(Maximum 4GB per file)</div>
+                        </label>
+                    </div>
+
+                    <div id="upload-list" class="mt-4"></div>
+
+                    <button class="btn btn-success mt-3 d-none" id="start-upload"
+                            onclick="startUpload()">
+                        <i class="bi bi-upload"></i> Start Upload
+                    </button>
+                </div>
+            </div>
+        </div>
+    </body>
+    </html>
+"""
+
+LISTING_TEMPLATE = Template(f"""
+    <!DOCTYPE html>
+    <html lang="en">
+    <head>
+        {HEAD}
+        <title>File Server - $title</title>
+    </head>
+    <body>
+        <div class="container">
+            <h1 class="my-4">📁 $breadcrumbs</h1>
+            $search
+            <form method="get">
+                <div class="d-flex flex-wrap gap-2 mb-4">
+                    <a href="/upload" class="btn btn-primary">
+                        <i class="bi bi-upload"></i> Upload Files
+                    </a>
+                    <button type="submit" name="archive" value="zip" class="btn btn-outline-secondary"
+                            title="Download the checked entries, or the whole folder if none are checked">
+                        <i class="bi bi-file-earmark-zip"></i> Download ZIP
+                    </button>
+                    <button type="submit" name="archive" value="tar" class="btn btn-outline-secondary"
+                            title="Download the checked entries, or the whole folder if none are checked">
+                        <i class="bi bi-archive"></i> Download TAR
+                    </button>
+                </div>
+                $table
+            </form>
+            $pagination
+        </div>
+    </body>
+    </html>
+""")
+
+SEARCH_TEMPLATE = Template(f"""
+    <!DOCTYPE html>
+    <html lang="en">
+    <head>
+        {HEAD}
+        <title>Search - $title</title>
+    </head>
+    <body>
+        <div class="container">
+            <h1 class="my-4"><i class="bi bi-search"></i> $breadcrumbs</h1>
+            $search
+            <p class="text-muted">$summary</p>
+            $table
+        </div>
+    </body>
+    </html>
+""")
+
+def upload_page():
+    """Modern upload form with drag & drop"""
+    return UPLOAD_PAGE
+
+def listing_page(directory, url_path, entries, page, pages, per_page, sort, order, search=False):
+    """Directory listing page for one page of entries, with a search box if 'search'"""
+    title = os.path.basename(directory) + unquote(url_path).rstrip('/')
+    return LISTING_TEMPLATE.substitute(
+        title=escape(title),
+        breadcrumbs=breadcrumbs(directory, url_path),
+        search=search_form(url_path) if search else '',
+        table=directory_table(entries, url_path, sort, order),
+        pagination=pagination(page, pages, per_page, sort, order),
+    )
+
+def search_page(directory, path, query, results, truncated):
+    """Search results for 'query' under the folder 'path' (relative to the share, unquoted)"""
+    path = path.strip('/')
+    url_path = quote(f'/{path}/') if path else '/'
+    title = os.path.basename(directory) + unquote(url_path).rstrip('/')
+    if not query:
+        summary = 'Type part of a name, or a pattern such as <code>*.iso</code>.'
+    elif not results:
+        summary = f'No names match <strong>{escape(query)}</strong>.'
+    else:
+        count = f'First {len(results)}' if truncated else str(len(results))
+        summary = f'{count} match{"es" if len(results) != 1 else ""} for <strong>{escape(query)}</strong>.'
+    return SEARCH_TEMPLATE.substitute(
+        title=escape(title),
+        breadcrumbs=breadcrumbs(directory, url_path),
+        search=search_form(url_path, query),
+        summary=summary,
+        table=search_table(results) if results else '',
+    )
+
+def search_form(url_path, query=''):
+    """Box that searches the folder 'url_path' and everything below it"""
+    return f"""
+            <form action="/search" method="get" class="d-flex gap-2 mb-4" role="search">
+                <input type="hidden" name="format" value="html">
+                <input type="hidden" name="path" value="{escape(unquote(url_path))}">
+                <input type="search" name="q" value="{escape(query)}" class="form-control flex-grow-1"
+                       placeholder="Search this folder and its subfolders, e.g. report or *.iso"
+                       aria-label="Search">
+                <button type="submit" class="btn btn-outline-secondary">
+                    <i class="bi bi-search"></i> Search
+                </button>
+            </form>
+    """
+
+def search_table(results):
+    rows = []
+    for entry in results:
+        mod_time = datetime.fromtimestamp(entry['mtime']).strftime('%Y-%m-%d %H:%M:%S')
+        size = '' if entry['is_dir'] else format_file_size(entry['size'])
+        icon = 'bi-folder' if entry['is_dir'] else 'bi-file-earmark'
+        href = quote(entry['path']) + ('/' if entry['is_dir'] else '')
+        folder = entry['path'][:-len(entry['name'])]
+        rows.append(f"""
+                <tr>
+                    <td>
+                        <i class="bi {icon} me-2"></i>
+                        <a href="{href}" class="text-decoration-none">{escape(entry['name'])}</a>
+                        <div>
+                            <a href="{quote(folder)}" class="text-decoration-none text-muted">{escape(folder)}</a>
+                        </div>
+                    </td>
+                    <td>{size}</td>
+                    <td>{mod_time}</td>
+                </tr>
+            """)
+    return f"""
+    <table class="table table-hover">
+        <thead class="table-light">
+            <tr><th>Name</th><th>Size</th><th>Modified</th></tr>
+        </thead>
+        <tbody>
+            {''.join(rows)}
+        </tbody>
+    </table>
+    """
+
+def breadcrumbs(directory, url_path):
+    """Clickable path from the share root down to the current folder"""
+    crumbs = [f'<a href="/" class="text-decoration-none">{escape(os.path.basename(directory))}</a>']
+    href = '/'
+    for part in [p for p in url_path.split('/') if p]:
+        href += part + '/'
+        crumbs.append(f'<a href="{href}" class="text-decoration-none">{escape(unquote(part))}</a>')
+    return ' / '.join(crumbs)
+
+def pagination(page, pages, per_page, sort, order):
+    if pages <= 1:
+        return ''
+    def link(n, label, disabled=False):
+        state = ' disabled' if disabled else (' active' if n == page and label == str(n) else '')
+        return (f'<li class="page-item{state}"><a class="page-link" '
+                f'href="?page={n}&per_page={per_page}&sort={sort}&order={order}">{label}</a></li>')
+    items = [link(page - 1, '&laquo;', page == 1)]
+    for n in sorted({1, page - 2, page - 1, page, page + 1, page + 2, pages}):
+        if 1 <= n <= pages:
+            items.append(link(n, str(n)))
+    items.append(link(page + 1, '&raquo;', page == pages))
+    return f'<nav><ul class="pagination">{"".join(items)}</ul></nav>'
+
+def directory_table(entries, url_path, sort='name', order='asc'):
+    """Generate styled directory listing for one page of entries"""
+    rows = []
+    if url_path != '/':
+        rows.append("""
+                <tr>
+                    <td colspan="3">
+                        <i class="bi bi-arrow-90deg-up me-2"></i>
+                        <a href="../" class="text-decoration-none">..</a>
+                    </td>
+                </tr>
+            """)
+    for entry in entries:
+        mod_time = datetime.fromtimestamp(entry.mtime).strftime('%Y-%m-%d %H:%M:%S')
+        size = '' if entry.is_dir else format_file_size(entry.size)
+        icon = 'bi-folder' if entry.is_dir else 'bi-file-earmark'
+        href = quote(entry.name) + ('/' if entry.is_dir else '')
+        rows.append(f"""
+                <tr>
+                    <td>
+                        <input type="checkbox" name="files" value="{escape(entry.name)}"
+                               class="form-check-input me-2" aria-label="Select {escape(entry.name)}">
+                        <i class="bi {icon} me-2"></i>
+                        <a href="{href}" class="text-decoration-none">
+                            {escape(entry.name)}
+                        </a>
+                    </td>
+                    <td>{size}</td>
+                    <td>{mod_time}</td>
+                </tr>
+            """)
+
+    def header(label, key):
+        next_order = 'desc' if sort == key and order == 'asc' else 'asc'
+        arrow = (' <i class="bi bi-caret-up-fill"></i>' if order == 'asc' else
+                 ' <i class="bi bi-caret-down-fill"></i>') if sort == key else ''
+        return (f'<a href="?sort={key}&order={next_order}" '
+                f'class="text-decoration-none text-reset">{label}{arrow}</a>')
+
+    return f"""
+    <table class="table table-hover">
+        <thead class="table-light">
+            <tr>
+                <th>{header('Name', 'name')}</th>
+                <th>{header('Size', 'size')}</th>
+                <th>{header('Modified', 'mtime')}</th>
+            </tr>
+        </thead>
+        <tbody>
+            {''.join(rows)}
+        </tbody>
+    </table>
+    """
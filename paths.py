@@ -0,0 +1,120 @@
+# paths.py
+import os
+import time
+import posixpath
+import mimetypes
+import threading
+from collections import OrderedDict
+from urllib.parse import unquote
+from http.server import SimpleHTTPRequestHandler
+from uploads import is_temp_upload
+from upload_sessions import SESSION_DIR_NAME
+
+# Text formats mimetypes doesn't know, so they aren't served (and skipped
+# by compression) as application/octet-stream
+EXTENSIONS_MAP = {
+    **SimpleHTTPRequestHandler.extensions_map,
+    '.log': 'text/plain',
+    '.yaml': 'text/yaml',
+    '.yml': 'text/yaml',
+    '.toml': 'text/plain',
+    '.ndjson': 'application/x-ndjson',
+}
+
+DEFAULT_PATH_CACHE_ENTRIES = 10000
+DEFAULT_PATH_CACHE_TTL = 5.0
+
+def is_private_name(name):
+    """
+    True for the names the servers keep to themselves: the upload session
+    folder (which also holds the content index) and uploads still being written
+    """
+    name = name.rstrip('. ').lower()  # as Windows and case-insensitive file systems match it
+    return name == SESSION_DIR_NAME or is_temp_upload(name)
+
+def is_private_path(root, path):
+    """True if 'path', under 'root', is or lies inside a private name"""
+    return any(is_private_name(part) for part in os.path.relpath(path, root).split(os.sep))
+
+def translate_path(directory, path):
+    """
+    Map a URL path onto a file system path under 'directory', the same way
+    SimpleHTTPRequestHandler does, and refuse anything that resolves
+    outside of it (e.g. through a symlink) with PermissionError, and private
+    names (see is_private_name()) with FileNotFoundError.
+    """
+    # abandon query parameters
+    path = path.split('?', 1)[0]
+    path = path.split('#', 1)[0]
+    trailing_slash = path.rstrip().endswith('/')
+    try:
+        path = unquote(path, errors='surrogatepass')
+    except UnicodeDecodeError:
+        path = unquote(path)
+    path = posixpath.normpath(path)
+    full_path = directory
+    for word in filter(None, path.split('/')):
+        if os.path.dirname(word) or word in (os.curdir, os.pardir):
+            # Ignore components that are not a simple file/directory name
+            continue
+        full_path = os.path.join(full_path, word)
+    if trailing_slash:
+        full_path += '/'
+
+    # Security: Prevent directory traversal
+    root = os.path.realpath(directory)
+    real_path = os.path.realpath(full_path)
+    if real_path != root and not real_path.startswith(root + os.sep):
+        raise PermissionError("Access denied")
+    if is_private_path(root, real_path) or is_private_path(directory, full_path):
+        raise FileNotFoundError("Not found")
+    return full_path
+
+class PathCache:
+    """
+    LRU cache of translate_path() results, so a URL that was checked
+    recently doesn't cost two realpath() walks again. Refusals are cached
+    too. Entries expire after 'ttl' seconds, which bounds how long a
+    symlink swapped on disk can go unnoticed.
+    """
+
+    def __init__(self, max_entries=DEFAULT_PATH_CACHE_ENTRIES, ttl=DEFAULT_PATH_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # (directory, path) -> (expires, full path or the refusal's exception class)
+        self._lock = threading.Lock()
+
+    def translate(self, directory, path):
+        """translate_path(directory, path), from the cache when possible"""
+        key = (directory, path.split('?', 1)[0].split('#', 1)[0])
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                if isinstance(entry[1], type):
+                    raise entry[1](key[1])
+                return entry[1]
+        try:
+            full_path = translate_path(directory, key[1])
+        except (PermissionError, FileNotFoundError) as e:
+            full_path = type(e)
+        with self._lock:
+            self._entries[key] = (now + self.ttl, full_path)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        if isinstance(full_path, type):
+            raise full_path(key[1])
+        return full_path
+
+def guess_type(path):
+    """Content type for a file name, as SimpleHTTPRequestHandler.guess_type with EXTENSIONS_MAP"""
+    base, ext = posixpath.splitext(path)
+    if ext in EXTENSIONS_MAP:
+        return EXTENSIONS_MAP[ext]
+    ext = ext.lower()
+    if ext in EXTENSIONS_MAP:
+        return EXTENSIONS_MAP[ext]
+    guess, _ = mimetypes.guess_type(path)
+    return guess or 'application/octet-stream'
@@ -0,0 +1,82 @@
+# ranges.py
+import uuid
+
+MAX_RANGES = 64  # more than this is treated as abuse and answered with the whole file
+
+class RangeNotSatisfiable(ValueError):
+    """None of the requested byte ranges overlap the file"""
+
+def parse_range_header(header, size):
+    """
+    Parse a 'Range: bytes=...' header against a file of 'size' bytes.
+    Returns a sorted list of inclusive (start, end) tuples with overlapping
+    ranges merged, or None if the header is malformed and should be ignored.
+    Raises RangeNotSatisfiable if no range overlaps the file.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+
+    ranges = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, dash, last = part.partition("-")
+        if not dash:
+            return None
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else max(start, size - 1)
+                if start < 0 or end < start:
+                    return None
+            else:
+                suffix = int(last)  # "bytes=-500" is the last 500 bytes
+                if suffix < 0:
+                    return None
+                if not suffix:
+                    continue
+                start = max(0, size - suffix)
+                end = size - 1
+        except ValueError:
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, min(end, size - 1)))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+    if not ranges:
+        raise RangeNotSatisfiable(header)
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def content_range(start, end, size):
+    return f"bytes {start}-{end}/{size}"
+
+class MultipartByteranges:
+    """Framing for a multipart/byteranges response body"""
+
+    def __init__(self, ranges, size, content_type):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/byteranges; boundary={self.boundary}"
+        self.parts = []
+        for start, end in ranges:
+            head = (f"\r\n--{self.boundary}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Range: {content_range(start, end, size)}\r\n\r\n")
+            self.parts.append((head.encode("latin-1"), start, end - start + 1))
+        self.trailer = f"\r\n--{self.boundary}--\r\n".encode("latin-1")
+
+    @property
+    def content_length(self):
+        return sum(len(head) + length for head, _, length in self.parts) + len(self.trailer)
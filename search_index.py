@@ -0,0 +1,529 @@
+# search_index.py
+import os
+import re
+import time
+import logging
+import threading
+from array import array
+from itertools import accumulate, count
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from uploads import is_temp_upload
+from utils import parse_size
+
+SEARCH_PATH = "/search"
+SEARCH_MODES = ("substring", "prefix", "glob")
+DEFAULT_SEARCH_LIMIT = 100
+MAX_SEARCH_LIMIT = 1000
+RESCAN_INTERVAL = 60.0         # stat() every folder; rescan the ones whose mtime changed
+FULL_RESCAN_INTERVAL = 600.0   # re-read every folder, for files changed in place
+CHANGE_DELAY = 1.0             # batch the folders invalidated by a burst of uploads
+FILTER_FIRST_MAX = 50000       # size/date matches few enough to check names one by one
+ENTRY_BITS = 32                # an entry id is (folder serial << ENTRY_BITS) | position in the folder
+_serials = count()
+
+class _Folder:
+    """
+    One folder's entries, packed: names joined by newlines, metadata in
+    arrays. Each read of a folder gets a new serial, which identifies its
+    entries in the sort orders of every snapshot that includes it.
+    """
+    __slots__ = ("rel", "serial", "mtime_ns", "text", "folded", "count", "offsets", "sizes", "mtimes",
+                 "kinds", "subdirs")
+
+    def __init__(self, rel, mtime_ns, entries):
+        self.rel = rel
+        self.serial = next(_serials)
+        self.mtime_ns = mtime_ns
+        names = [e[0] for e in entries]
+        self.text = "\n".join(names)
+        # Lowercased for case-insensitive matching; a name whose lowercase has
+        # another length keeps its case, so positions in both texts line up
+        folded = [name.lower() for name in names]
+        self.folded = "\n".join(f if len(f) == len(n) else n for f, n in zip(folded, names))
+        self.count = len(entries)
+        self.offsets = array('q', accumulate((len(name) + 1 for name in names[:-1]), initial=0)
+                             if names else ())  # of each name in the texts
+        self.sizes = array('q', (e[2] for e in entries))
+        self.mtimes = array('d', (e[3] for e in entries))
+        self.kinds = bytes(e[1] for e in entries)
+        self.subdirs = sorted(e[0] for e in entries if e[1] and not e[4])
+
+    def same(self, other):
+        """True if 'other' holds the same entries"""
+        return (self.text == other.text and self.kinds == other.kinds and self.sizes == other.sizes and
+                self.mtimes == other.mtimes and self.subdirs == other.subdirs)
+
+class SearchSnapshot:
+    """
+    Immutable view of the whole share for queries: every name in one pair
+    of strings (folders in depth-first order, so a subtree is one slice),
+    with sizes, mtimes and kinds in arrays at the same positions. Runs of
+    folders unchanged since the 'previous' snapshot are copied from it in
+    one piece. The sort orders for size and date filters hold entry ids,
+    so the previous snapshot's orders carry over with only the folders
+    read since merged in; entries of folders that are gone are skipped
+    until they make up most of an order, which is then sorted afresh.
+    Orders are built on first use, or ahead of queries by warm().
+    """
+
+    def __init__(self, folders, built, previous=None):
+        self.folders = folders
+        self.built = built
+        self.starts = array('q')     # index of each folder's first entry
+        self.positions = array('q')  # offset of each folder's first name in the texts
+        self.sizes = array('q')
+        self.mtimes = array('d')
+        kinds = []
+        texts, folded = ["\n"], ["\n"]  # "\nname\nname\n...\n"
+        reuse = previous.rel_index if previous is not None else {}
+        index = 0
+        position = 1
+        i = 0
+        while i < len(folders):
+            folder = folders[i]
+            j = reuse.get(folder.rel)
+            if j is None or previous.folders[j] is not folder:
+                self.starts.append(index)
+                self.positions.append(position)
+                if folder.count:
+                    texts += (folder.text, "\n")
+                    folded += (folder.folded, "\n")
+                    position += len(folder.text) + 1
+                index += folder.count
+                self.sizes += folder.sizes
+                self.mtimes += folder.mtimes
+                kinds.append(folder.kinds)
+                i += 1
+                continue
+            end, k = i + 1, j + 1
+            while end < len(folders) and k < len(previous.folders) and folders[end] is previous.folders[k]:
+                end += 1
+                k += 1
+            first_index, first_position = previous.bounds(j)
+            end_index, end_position = previous.bounds(k)
+            self.starts.extend(start - first_index + index for start in previous.starts[j:k])
+            self.positions.extend(start - first_position + position for start in previous.positions[j:k])
+            texts.append(previous.text[first_position:end_position])
+            folded.append(previous.folded[first_position:end_position])
+            self.sizes += previous.sizes[first_index:end_index]
+            self.mtimes += previous.mtimes[first_index:end_index]
+            kinds.append(previous.kinds[first_index:end_index])
+            index += end_index - first_index
+            position += end_position - first_position
+            i = end
+        self.text = "".join(texts)
+        self.folded = "".join(folded)
+        self.kinds = b"".join(kinds)
+        self.count = index
+        self.rel_index = {folder.rel: i for i, folder in enumerate(folders)}
+        self.serial_index = {folder.serial: i for i, folder in enumerate(folders)}
+        self._lazy = {}
+        self._stale = {}  # ids of entries no longer here, per order
+        self._lock = threading.Lock()
+        if previous is not None:
+            self._carry_orders(previous)
+
+    def bounds(self, i):
+        """(first entry, offset of the first name) of folder 'i', or the ends for len(folders)"""
+        if i < len(self.folders):
+            return self.starts[i], self.positions[i]
+        return self.count, len(self.text)
+
+    def _carry_orders(self, previous):
+        """Take over the sort orders 'previous' has built, merging in the folders read since"""
+        orders = {key: previous._lazy[key] for key in ("size", "mtime") if key in previous._lazy}
+        if not orders:
+            return
+        kept = sum(folder.count for folder in previous.folders if folder.serial in self.serial_index)
+        added = [folder for folder in self.folders if folder.serial not in previous.serial_index]
+        if sum(folder.count for folder in added) > self.count // 2:
+            return  # cheaper to sort afresh
+        for key, order in orders.items():
+            stale = previous._stale[key] + previous.count - kept
+            if stale <= self.count:
+                self._lazy[key] = _merge_order(order, added, key)
+                self._stale[key] = stale
+
+    def subtree(self, rel):
+        """(first folder, end folder) of the folder 'rel' and everything under it"""
+        first = self.rel_index.get(rel)
+        if first is None:
+            return None
+        end = first + 1
+        prefix = rel + "/" if rel else ""
+        while end < len(self.folders) and (not rel or self.folders[end].rel.startswith(prefix)):
+            end += 1
+        return first, end
+
+    def _cached(self, key, build):
+        value = self._lazy.get(key)
+        if value is None:
+            with self._lock:
+                value = self._lazy.get(key)
+                if value is None:
+                    value = self._lazy[key] = build()
+        return value
+
+    def order(self, key):
+        """
+        Entry ids sorted by "size" or "mtime", with the sorted values; see
+        locate() for the entry an id stands for
+        """
+        def build():
+            values = self.sizes if key == "size" else self.mtimes
+            ids = array('q', ((folder.serial << ENTRY_BITS) | i
+                              for folder in self.folders for i in range(folder.count)))
+            indexes = sorted(range(self.count), key=values.__getitem__)
+            self._stale[key] = 0
+            return (array('q', map(ids.__getitem__, indexes)),
+                    array(values.typecode, map(values.__getitem__, indexes)))
+        return self._cached(key, build)
+
+    def warm(self):
+        self.order("size")
+        self.order("mtime")
+
+    def locate(self, id):
+        """(index, offset of the name in the texts) of the entry 'id', or None if it is gone"""
+        folder = self.serial_index.get(id >> ENTRY_BITS)
+        if folder is None:
+            return None
+        i = id & ((1 << ENTRY_BITS) - 1)
+        return self.starts[folder] + i, self.positions[folder] + self.folders[folder].offsets[i]
+
+    def entry(self, index, line_start):
+        folder = self.folders[bisect_right(self.starts, index) - 1]
+        end = self.text.find("\n", line_start)
+        name = self.text[line_start:end]
+        path = f"{folder.rel}/{name}" if folder.rel else name
+        return {"path": "/" + path, "name": name, "is_dir": bool(self.kinds[index]),
+                "size": 0 if self.kinds[index] else self.sizes[index], "mtime": self.mtimes[index]}
+
+class SearchIndex:
+    """
+    In-memory index of every name in the shared 'directory', built by a
+    background thread and kept current by rescans: every RESCAN_INTERVAL
+    seconds each folder is stat()ed and the changed ones re-read, folders
+    passed to invalidate() are re-read within CHANGE_DELAY seconds, and
+    every FULL_RESCAN_INTERVAL seconds everything is re-read so files
+    changed in place show their new size and date. Queries run against
+    the latest SearchSnapshot without locking.
+    """
+
+    def __init__(self, directory, hidden=()):
+        self.directory = directory
+        self.hidden = frozenset(hidden)
+        self.snapshot = SearchSnapshot([], None)
+        self._folders = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="search-index", daemon=True)
+        self._thread.start()
+
+    def invalidate(self, path):
+        """Re-read the folder 'path' soon, e.g. after an upload into it"""
+        rel = os.path.relpath(path, self.directory)
+        if rel.startswith(os.pardir):
+            return
+        with self._lock:
+            self._dirty.add("" if rel == os.curdir else rel.replace(os.sep, "/"))
+        self._changed.set()
+
+    def close(self):
+        self._stop.set()
+        self._changed.set()
+
+    def stats(self):
+        snapshot = self.snapshot
+        return {"entries": snapshot.count, "folders": len(snapshot.folders), "ready": snapshot.built is not None}
+
+    # ----- queries -----
+
+    def search(self, query="", mode=None, path="", min_size=None, max_size=None, after=None, before=None,
+               kind=None, limit=DEFAULT_SEARCH_LIMIT):
+        """
+        Entries under the folder 'path' (relative, "" for the whole share)
+        whose name matches 'query', case-insensitively: as a "substring",
+        "prefix" or shell-style "glob" ('mode' defaults to glob when the
+        query has wildcards). Size (bytes) and date (epoch seconds) bounds
+        and 'kind' ("file" or "dir") narrow the results. Returns (entries,
+        truncated) with at most 'limit' entries.
+        """
+        snapshot = self.snapshot
+        limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+        query = query.strip().lower()
+        if "\n" in query:
+            raise ValueError("Invalid query")
+        if mode is None:
+            mode = "glob" if any(c in query for c in "*?[") else "substring"
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode}")
+        span = snapshot.subtree(path.strip("/"))
+        if span is None:
+            return [], False
+        start_index, start_pos = snapshot.bounds(span[0])
+        end_index, end_pos = snapshot.bounds(span[1])
+
+        def wanted(i):
+            if kind is not None and bool(snapshot.kinds[i]) != (kind == "dir"):
+                return False
+            if (min_size is not None or max_size is not None) and snapshot.kinds[i]:
+                return False  # folders have no size
+            size, mtime = snapshot.sizes[i], snapshot.mtimes[i]
+            return ((min_size is None or size >= min_size) and (max_size is None or size <= max_size) and
+                    (after is None or mtime >= after) and (before is None or mtime < before))
+
+        # A narrow size or date range is walked in sorted order, checking
+        # names; otherwise the names are searched and the filters checked
+        bounds = None
+        if min_size is not None or max_size is not None:
+            ids, values = snapshot.order("size")
+            bounds = (bisect_left(values, min_size) if min_size is not None else 0,
+                      bisect_right(values, max_size) if max_size is not None else len(values))
+        elif after is not None or before is not None or not query:
+            ids, values = snapshot.order("mtime")
+            bounds = (bisect_left(values, after) if after is not None else 0,
+                      bisect_left(values, before) if before is not None else len(values))
+
+        results = []
+        if bounds is not None and (not query or bounds[1] - bounds[0] <= FILTER_FIRST_MAX):
+            matches = _name_matcher(snapshot.folded, query, mode) if query else None
+            for k in range(*bounds):
+                found = snapshot.locate(ids[k])
+                if found is None:
+                    continue
+                i, offset = found
+                if start_index <= i < end_index and wanted(i) and (matches is None or matches(offset)):
+                    if len(results) == limit:
+                        return results, True
+                    results.append(snapshot.entry(i, offset))
+            return results, False
+
+        index, counted = start_index, start_pos
+        for line_start in self._matches(snapshot.folded, query, mode, start_pos, end_pos):
+            index += snapshot.folded.count("\n", counted, line_start)
+            counted = line_start
+            if wanted(index):
+                if len(results) == limit:
+                    return results, True
+                results.append(snapshot.entry(index, line_start))
+        return results, False
+
+    def _matches(self, folded, query, mode, start, end):
+        """Line starts of the names matching 'query' between offsets 'start' and 'end'"""
+        if mode == "glob":
+            regex, literal = _glob_regex(query)
+            if not literal:
+                # The lookahead skips the empty "line" after the last name
+                pattern = re.compile("^(?=[^\n])" + regex + "$", re.MULTILINE)
+                for match in pattern.finditer(folded, start, end):
+                    yield match.start()
+                return
+            # Find the pattern's longest literal part first, then check that name
+            pattern = re.compile(regex)
+            pos = start
+            while True:
+                pos = folded.find(literal, pos, end)
+                if pos < 0:
+                    return
+                line_start = folded.rfind("\n", 0, pos) + 1
+                pos = folded.find("\n", pos, end)
+                if pattern.fullmatch(folded, line_start, pos):
+                    yield line_start
+                if pos < 0:
+                    return
+        needle = "\n" + query if mode == "prefix" else query
+        pos = start - 1 if mode == "prefix" else start
+        while True:
+            pos = folded.find(needle, pos, end)
+            if pos < 0:
+                return
+            line_start = pos + 1 if mode == "prefix" else folded.rfind("\n", 0, pos) + 1
+            yield line_start
+            pos = folded.find("\n", pos + 1, end)  # next name
+            if pos < 0:
+                return
+
+    # ----- background scans -----
+
+    def _run(self):
+        next_check = next_full = 0
+        while not self._stop.is_set():
+            now = time.monotonic()
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+            try:
+                if now >= next_full:
+                    self._rescan(full=True)
+                    next_full = now + FULL_RESCAN_INTERVAL
+                    next_check = now + RESCAN_INTERVAL
+                elif now >= next_check:
+                    self._rescan(forced=dirty)
+                    next_check = now + RESCAN_INTERVAL
+                elif dirty:
+                    self._rescan(forced=dirty, check=False)
+            except Exception:
+                logging.exception("Search index scan failed")
+            self._changed.wait(max(0.0, min(next_check, next_full) - time.monotonic()))
+            if self._changed.is_set() and not self._stop.is_set():
+                self._changed.clear()
+                self._stop.wait(CHANGE_DELAY)
+
+    def _rescan(self, full=False, forced=(), check=True):
+        """
+        Walk the tree from the root, re-reading folders that are new, in
+        'forced', changed since the last scan (by mtime; only with 'check',
+        otherwise the rest are reused without a stat()), or all of them
+        when 'full'
+        """
+        started = time.monotonic()
+        old = self._folders
+        folders = {}
+        order = []
+        changed = False
+        stack = [""]
+        while stack:
+            rel = stack.pop()
+            folder = old.get(rel)
+            if check or full or folder is None or rel in forced:
+                try:
+                    mtime_ns = os.stat(os.path.join(self.directory, rel)).st_mtime_ns
+                except OSError:
+                    changed = True
+                    continue
+                if full or folder is None or folder.mtime_ns != mtime_ns or rel in forced:
+                    new = self._read(rel, mtime_ns)
+                    if new is None:
+                        changed = True
+                        continue
+                    if folder is not None and folder.same(new):
+                        folder.mtime_ns = mtime_ns  # keep the old one so its slices are copied
+                    else:
+                        folder = new
+                        changed = True
+            folders[rel] = folder
+            order.append(folder)
+            stack.extend(f"{rel}/{name}" if rel else name for name in reversed(folder.subdirs))
+        if changed or len(folders) != len(old):
+            self._folders = folders
+            self.snapshot = SearchSnapshot(order, time.time(), self.snapshot)
+            self.snapshot.warm()  # here rather than in the first filtered query
+            logging.debug(f"Search index: {self.snapshot.count} entries in {len(order)} folders, "
+                          f"scanned in {time.monotonic() - started:.2f}s")
+
+    def _read(self, rel, mtime_ns):
+        entries = []
+        try:
+            with os.scandir(os.path.join(self.directory, rel)) as it:
+                for entry in it:
+                    name = entry.name
+                    if name in self.hidden or is_temp_upload(name) or "\n" in name:
+                        continue  # a newline would split the name in the packed text
+                    try:
+                        st = entry.stat()
+                        is_dir = entry.is_dir()
+                        is_link = entry.is_symlink()  # linked folders are listed, not descended into
+                    except OSError:
+                        continue
+                    entries.append((name, is_dir, 0 if is_dir else st.st_size, st.st_mtime, is_link))
+        except OSError:
+            return None
+        entries.sort()
+        return _Folder(rel, mtime_ns, entries)
+
+def _merge_order(order, folders, key):
+    """Sort order 'order' with the entries of 'folders' merged in"""
+    ids, values = order
+    added = sorted((value, (folder.serial << ENTRY_BITS) | i) for folder in folders
+                   for i, value in enumerate(folder.sizes if key == "size" else folder.mtimes))
+    if not added:
+        return order
+    merged_ids, merged_values = array('q'), array(values.typecode)
+    at = 0
+    for value, id in added:
+        to = bisect_right(values, value, at)
+        merged_ids += ids[at:to]
+        merged_values += values[at:to]
+        merged_ids.append(id)
+        merged_values.append(value)
+        at = to
+    merged_ids += ids[at:]
+    merged_values += values[at:]
+    return merged_ids, merged_values
+
+def _name_matcher(folded, query, mode):
+    """Test for the name at an offset in 'folded', the one-name version of _matches()"""
+    if mode == "prefix":
+        return lambda offset: folded.startswith(query, offset)
+    if mode == "glob":
+        pattern = re.compile(_glob_regex(query)[0])
+        return lambda offset: pattern.fullmatch(folded, offset, folded.find("\n", offset)) is not None
+    return lambda offset: folded.find(query, offset, folded.find("\n", offset)) >= 0
+
+def _glob_regex(pattern):
+    """
+    (regex, literal) for a shell-style pattern: a regex that never matches
+    across names, and the longest run of plain characters it requires
+    """
+    parts = []
+    literal = longest = ""
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        i += 1
+        if c == "[":
+            j = pattern.find("]", i + 1 if pattern[i:i + 1] in ("!", "]") else i)
+            if j >= 0:
+                body = pattern[i:j]
+                i = j + 1
+                negate = body.startswith("!")
+                body = body[1:] if negate else body
+                body = body.replace("\\", "\\\\").replace("^", "\\^").replace("[", "\\[")
+                parts.append(f"[^{body}\n]" if negate else f"[{body}]")
+                literal = ""
+                continue
+        if c == "*":
+            parts.append("[^\n]*")
+            literal = ""
+        elif c == "?":
+            parts.append("[^\n]")
+            literal = ""
+        else:
+            parts.append(re.escape(c))
+            literal += c
+            longest = max(longest, literal, key=len)
+    return "".join(parts), longest
+
+def parse_date(value):
+    """Epoch seconds from an ISO date or date-time (local time), or a number"""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value.strip()).timestamp()
+    except ValueError:
+        raise ValueError(f"Invalid date: {value!r}")
+
+def parse_search_query(query):
+    """search() keyword arguments from parsed /search?q=&mode=&path=&type=&min_size=... parameters"""
+    def param(name):
+        return query.get(name, [''])[0]
+    options = {"query": param('q'), "mode": param('mode') or None, "path": param('path'),
+               "kind": param('type') or None}
+    if options["kind"] not in (None, "file", "dir"):
+        raise ValueError(f"Unknown type: {options['kind']}")
+    for name, parse in (("min_size", parse_size), ("max_size", parse_size),
+                        ("after", parse_date), ("before", parse_date)):
+        if param(name):
+            options[name] = parse(param(name))
+    if param('limit'):
+        options["limit"] = int(param('limit'))
+    return options
+
+def search_json(index, options, results, truncated, took):
+    return {"query": options["query"], "path": "/" + options["path"].strip("/"), "results": results,
+            "truncated": truncated, "took_ms": round(took * 1000, 3), **index.stats()}
@@ -0,0 +1,53 @@
+# socket_activation.py
+import os
+import socket
+import logging
+
+LISTEN_FDS_START = 3  # SD_LISTEN_FDS_START: passed sockets are fds 3, 4, ...
+
+def listen_sockets():
+    """
+    Listening sockets passed by systemd socket activation, as a list of
+    (name, socket); names come from FileDescriptorName= in the .socket
+    unit (systemd defaults to the unit's name). Empty when the process
+    wasn't socket activated. The variables are cleared afterwards so
+    child processes don't take the sockets for their own.
+    """
+    try:
+        if int(os.environ.get("LISTEN_PID", "0")) != os.getpid():
+            return []
+        count = int(os.environ.get("LISTEN_FDS", "0"))
+    except ValueError:
+        return []
+    names = os.environ.get("LISTEN_FDNAMES", "").split(":")
+    for variable in ("LISTEN_PID", "LISTEN_FDS", "LISTEN_FDNAMES"):
+        os.environ.pop(variable, None)
+
+    sockets = []
+    for i in range(count):
+        fd = LISTEN_FDS_START + i
+        try:
+            os.set_inheritable(fd, False)
+            sock = socket.socket(fileno=fd)
+        except OSError as e:
+            logging.warning(f"Ignoring passed file descriptor {fd}: {e}")
+            continue
+        sockets.append((names[i] if i < len(names) else "", sock))
+    return sockets
+
+def notify(state):
+    """
+    Tell systemd about the service state (e.g. "READY=1") when it runs the
+    service with Type=notify; does nothing otherwise
+    """
+    address = os.environ.get("NOTIFY_SOCKET")
+    if not address or not hasattr(socket, "AF_UNIX"):
+        return
+    if address.startswith("@"):
+        address = "\0" + address[1:]  # abstract namespace
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as s:
+            s.connect(address)
+            s.sendall(state.encode())
+    except OSError as e:
+        logging.debug(f"systemd notification failed: {e}")
@@ -0,0 +1,314 @@
+# tar_upload.py
+import os
+import zlib
+import logging
+import tarfile
+from uploads import UploadFile, MAX_UPLOAD_SIZE, DEFAULT_DURABILITY, safe_member_path
+from paths import is_private_path
+from utils import format_file_size
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+TAR_UPLOAD_PATH = "/upload/tar"
+DECODE_STEP = 256 * 1024      # most decompressed bytes produced per step
+MAX_META_SIZE = 1024 * 1024   # pax / GNU long name records
+_FILE_TYPES = (tarfile.REGTYPE, tarfile.AREGTYPE, tarfile.CONTTYPE)
+_DECODE_ERRORS = (zlib.error,) + ((zstandard.ZstdError,) if zstandard else ())
+_META_TYPES = (tarfile.XHDTYPE, tarfile.XGLTYPE, tarfile.SOLARIS_XHDTYPE,
+               tarfile.GNUTYPE_LONGNAME, tarfile.GNUTYPE_LONGLINK)
+
+class TarUploadError(ValueError):
+    """Malformed or truncated tar stream"""
+
+class UnsupportedEncoding(ValueError):
+    """Request body compressed with an encoding the server can't decode"""
+
+def body_encoding(content_type, content_encoding):
+    """
+    Compression of an uploaded tar: from Content-Encoding, or from a
+    Content-Type of application/gzip or application/zstd
+    """
+    encoding = (content_encoding or '').strip().lower()
+    if encoding in ('', 'identity'):
+        content_type = (content_type or '').split(';')[0].strip().lower()
+        encoding = {"application/gzip": "gzip", "application/x-gzip": "gzip",
+                    "application/x-compressed-tar": "gzip", "application/zstd": "zstd"}.get(content_type)
+    elif encoding == 'x-gzip':
+        encoding = 'gzip'
+    if encoding not in (None, 'gzip', 'zstd') or (encoding == 'zstd' and zstandard is None):
+        raise UnsupportedEncoding(f"Unsupported Content-Encoding: {encoding}")
+    return encoding
+
+class _Decoder:
+    """
+    Undo gzip or zstd in bounded steps, passing the output to 'sink'; a
+    small body that inflates enormously never sits in memory as a whole
+    """
+
+    def __init__(self, encoding, sink):
+        self.sink = sink
+        self.encoding = encoding
+        if encoding == 'gzip':
+            self._obj = zlib.decompressobj(31)
+        elif encoding == 'zstd':
+            self._obj = zstandard.ZstdDecompressor().stream_writer(self, write_size=DECODE_STEP, closefd=False)
+
+    def write(self, data):
+        # zstandard's stream_writer hands its output here
+        self.sink(data)
+        return len(data)
+
+    def feed(self, data):
+        try:
+            self._decode(data)
+        except _DECODE_ERRORS as e:
+            raise TarUploadError(f"Invalid {self.encoding} data: {e}")
+
+    def _decode(self, data):
+        if self.encoding is None:
+            self.sink(data)
+        elif self.encoding == 'zstd':
+            self._obj.write(data)
+        else:
+            while data:
+                if self._obj.eof:
+                    # Concatenated gzip members, e.g. from pigz or appended archives
+                    self._obj = zlib.decompressobj(31)
+                out = self._obj.decompress(data, DECODE_STEP)
+                self.sink(out)
+                # Input after the end of a member is the start of the next one
+                data = self._obj.unused_data if self._obj.eof else self._obj.unconsumed_tail
+                if not out and not data:
+                    break
+
+    def close(self):
+        if self.encoding == 'gzip':
+            while not self._obj.eof:
+                out = self._obj.decompress(self._obj.unconsumed_tail, DECODE_STEP)
+                if not out:
+                    raise TarUploadError("Truncated gzip stream")
+                self.sink(out)
+
+class TarExtractor:
+    """
+    Incremental tar extractor. Feed it the request body in chunks of any
+    size; regular files and folders are written under 'directory' as their
+    data arrives, so memory use is bounded by the chunk size. Each file is
+    preallocated from its header's size and moved into place once complete,
+    synced as 'durability' asks (see UploadFile). Unsafe paths, private
+    names (see paths.is_private_name()), links, devices and files over
+    'max_file_size' are skipped and listed in summary() instead of failing
+    the whole upload.
+    """
+
+    def __init__(self, directory, encoding=None, max_file_size=MAX_UPLOAD_SIZE,
+                 durability=DEFAULT_DURABILITY):
+        self.directory = directory
+        self.max_file_size = max_file_size
+        self.durability = durability
+        self.decoder = _Decoder(encoding, self._feed)
+        self.buffer = bytearray()
+        self.state = 'header'
+        self.need = tarfile.BLOCKSIZE  # bytes to collect in 'header' and 'meta'
+        self.remaining = 0             # bytes left in 'data' and 'pad'
+        self.meta_type = None
+        self.meta_size = 0
+        self.overrides = {}            # pax / GNU long name values for the next member
+        self.sink = None
+        self.member_size = 0
+        self.files = []
+        self.directories = 0
+        self.skipped = []
+        self.bytes = 0
+        self.touched = set()           # folders whose listing changed
+
+    def feed(self, data):
+        self.decoder.feed(data)
+
+    def _feed(self, data):
+        view = memoryview(data)
+        pos = 0
+        while pos < len(view) and self.state != 'end':
+            if self.state in ('data', 'pad'):
+                n = min(self.remaining, len(view) - pos)
+                if self.state == 'data' and self.sink is not None:
+                    self.sink.write(view[pos:pos + n])
+                pos += n
+                self.remaining -= n
+                if self.remaining:
+                    continue
+                if self.state == 'data':
+                    self._member_done()
+                else:
+                    self._expect_header()
+            else:
+                n = min(self.need - len(self.buffer), len(view) - pos)
+                self.buffer += view[pos:pos + n]
+                pos += n
+                if len(self.buffer) == self.need:
+                    block = bytes(self.buffer)
+                    self.buffer.clear()
+                    if self.state == 'header':
+                        self._header(block)
+                    else:
+                        self._meta(block)
+
+    def _expect_header(self):
+        self.state = 'header'
+        self.need = tarfile.BLOCKSIZE
+
+    def _skip(self, size):
+        """Discard 'size' bytes of member data plus the block padding"""
+        self.sink = None
+        self.remaining = size + (-size % tarfile.BLOCKSIZE)
+        self.state = 'pad'
+        if not self.remaining:
+            self._expect_header()
+
+    def _header(self, block):
+        if block == bytes(tarfile.BLOCKSIZE):
+            self.state = 'end'  # end-of-archive; trailing zero blocks are ignored
+            return
+        try:
+            info = tarfile.TarInfo.frombuf(block, "utf-8", "surrogateescape")
+        except tarfile.HeaderError as e:
+            raise TarUploadError(f"Invalid tar header: {e}")
+
+        if info.type in _META_TYPES:
+            if info.size > MAX_META_SIZE:
+                raise TarUploadError("Tar extended header too large")
+            self.meta_type = info.type
+            self.meta_size = info.size
+            self.state = 'meta'
+            self.need = info.size + (-info.size % tarfile.BLOCKSIZE)
+            if not self.need:
+                self._expect_header()
+            return
+
+        name = self.overrides.pop('path', info.name)
+        size = int(self.overrides.pop('size', info.size))
+        self.overrides.clear()
+
+        if info.type == tarfile.DIRTYPE:
+            self._make_directory(name)
+            self._skip(size)
+        elif info.type not in _FILE_TYPES:
+            self._skip_member(name, "not a regular file")
+            self._skip(size)
+        elif size > self.max_file_size:
+            self._skip_member(name, f"exceeds {format_file_size(self.max_file_size)} limit")
+            self._skip(size)
+        else:
+            self.sink = self._open_file(name, size)
+            self.member_size = self.remaining = size
+            self.state = 'data'
+            if not size:
+                self._member_done()
+
+    def _meta(self, block):
+        data = block[:self.meta_size]
+        if self.meta_type in (tarfile.GNUTYPE_LONGNAME, tarfile.GNUTYPE_LONGLINK):
+            if self.meta_type == tarfile.GNUTYPE_LONGNAME:
+                self.overrides['path'] = data.split(b'\0', 1)[0].decode("utf-8", "surrogateescape")
+        elif self.meta_type != tarfile.XGLTYPE:
+            self.overrides.update(_pax_records(data))
+        self._expect_header()
+
+    def _member_done(self):
+        sink, self.sink = self.sink, None
+        if sink is not None:
+            sink.close()
+            self.files.append(os.path.relpath(sink.path, self.directory).replace(os.sep, '/'))
+            self.bytes += sink.size
+        self.remaining = -self.member_size % tarfile.BLOCKSIZE
+        self.state = 'pad'
+        if not self.remaining:
+            self._expect_header()
+
+    def _skip_member(self, name, reason):
+        logging.debug(f"Skipping {name!r} in tar upload: {reason}")
+        self.skipped.append({"name": name, "reason": reason})
+
+    def _safe_path(self, name):
+        try:
+            path = safe_member_path(self.directory, name)
+        except ValueError as e:
+            self._skip_member(name, str(e))
+            return None
+        if is_private_path(self.directory, path):
+            self._skip_member(name, "reserved name")
+            return None
+        return path
+
+    def _make_directory(self, name):
+        path = self._safe_path(name)
+        if path is None:
+            return
+        try:
+            os.makedirs(path, exist_ok=True)
+        except OSError as e:
+            self._skip_member(name, e.strerror or str(e))
+            return
+        self.directories += 1
+        self.touched.add(os.path.dirname(os.path.normpath(path)))
+
+    def _open_file(self, name, size):
+        """UploadFile for a member, or None (skip its data) if it can't be written"""
+        path = self._safe_path(name)
+        if path is None:
+            return None
+        try:
+            parent = os.path.dirname(path)
+            os.makedirs(parent, exist_ok=True)
+            sink = UploadFile(path, limit=self.max_file_size, size_hint=size,
+                              durability=self.durability)
+        except OSError as e:
+            self._skip_member(name, e.strerror or str(e))
+            return None
+        self.touched.add(parent)
+        return sink
+
+    def abort(self):
+        """Remove the file being written, e.g. after an error"""
+        sink, self.sink = self.sink, None
+        if sink is not None:
+            sink.abort()
+
+    def close(self):
+        """Finish extracting; raises TarUploadError if the stream was truncated"""
+        self.decoder.close()
+        if self.state == 'end' or (self.state == 'header' and not self.buffer):
+            return
+        self.abort()
+        raise TarUploadError("Truncated tar stream")
+
+    def summary(self):
+        return {"status": "success", "files": self.files, "directories": self.directories,
+                "bytes": self.bytes, "skipped": self.skipped}
+
+def _pax_records(data):
+    """Decode 'length key=value\\n' pax records"""
+    records = {}
+    pos = 0
+    while pos < len(data):
+        space = data.find(b' ', pos)
+        if space < 0:
+            break
+        try:
+            length = int(data[pos:space])
+        except ValueError:
+            raise TarUploadError("Invalid pax header")
+        if length <= 0:
+            raise TarUploadError("Invalid pax header")
+        key, _, value = data[space + 1:pos + length - 1].partition(b'=')
+        records[key.decode("utf-8", "replace")] = value.decode("utf-8", "surrogateescape")
+        pos += length
+    if 'size' in records:
+        try:
+            int(records['size'])
+        except ValueError:
+            raise TarUploadError("Invalid pax size")
+    return records
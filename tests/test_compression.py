@@ -0,0 +1,43 @@
+# tests/test_compression.py
+import unittest
+from unittest import mock
+import compression
+from compression import negotiate
+
+ALL_ENCODINGS = ["zstd", "br", "gzip"]
+
+class NegotiateTest(unittest.TestCase):
+
+    def test_negotiate(self):
+        cases = [
+            # available, Accept-Encoding, expected
+            (ALL_ENCODINGS, None, None),
+            (ALL_ENCODINGS, "", None),
+            (ALL_ENCODINGS, "identity", None),
+            (ALL_ENCODINGS, "gzip", "gzip"),
+            (ALL_ENCODINGS, "GZIP , deflate", "gzip"),
+            (ALL_ENCODINGS, "gzip, br, zstd", "zstd"),
+            (ALL_ENCODINGS, "gzip;q=1.0, br;q=0.5", "gzip"),
+            (["gzip"], "zstd, br", None),
+            (["gzip"], "zstd, gzip;q=0.1", "gzip"),
+            # q=0 refuses an encoding
+            (ALL_ENCODINGS, "gzip;q=0", None),
+            (ALL_ENCODINGS, "gzip;q=0.000, br", "br"),
+            (ALL_ENCODINGS, "zstd;q=0, br;q=0, gzip;q=0.2", "gzip"),
+            (ALL_ENCODINGS, "gzip;q=abc", None),
+            # wildcard covers encodings not listed
+            (ALL_ENCODINGS, "*", "zstd"),
+            (["gzip"], "*", "gzip"),
+            (ALL_ENCODINGS, "*;q=0.5, br", "br"),
+            (ALL_ENCODINGS, "zstd;q=0, *", "br"),
+            (ALL_ENCODINGS, "zstd;q=0, br;q=0, *;q=0.1", "gzip"),
+            (ALL_ENCODINGS, "*;q=0", None),
+            (ALL_ENCODINGS, "gzip, *;q=0", "gzip"),
+        ]
+        for available, header, expected in cases:
+            with self.subTest(available=available, header=header):
+                with mock.patch.object(compression, "PREFERENCE", available):
+                    self.assertEqual(negotiate(header), expected)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+# tests/test_multipart.py
+import os
+import unittest
+from multipart import MultipartParser, MultipartError, get_boundary, MAX_HEADER_SIZE
+
+BOUNDARY = "----formboundary7MA4YWxk"
+
+def make_body(parts, boundary=BOUNDARY, preamble=b"", epilogue=b""):
+    """multipart/form-data body from (name, filename, data) triples"""
+    body = bytearray(preamble)
+    for name, filename, data in parts:
+        body += b"--" + boundary.encode() + b"\r\n"
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            disposition += f'; filename="{filename}"'
+        body += f"Content-Disposition: {disposition}\r\n\r\n".encode()
+        body += data + b"\r\n"
+    body += b"--" + boundary.encode() + b"--\r\n" + epilogue
+    return bytes(body)
+
+class Sink:
+    def __init__(self, part, received):
+        self.part = part
+        self.data = bytearray()
+        self.closed = False
+        self.aborted = False
+        received.append(self)
+
+    def write(self, data):
+        self.data += data
+
+    def close(self):
+        self.closed = True
+
+    def abort(self):
+        self.aborted = True
+
+class MultipartParserTest(unittest.TestCase):
+
+    def parse(self, body, chunk_size, boundary=BOUNDARY, skip=()):
+        received = []
+
+        def open_part(part):
+            if part.name in skip:
+                return None
+            return Sink(part, received)
+
+        parser = MultipartParser(boundary, open_part)
+        for pos in range(0, len(body), chunk_size):
+            parser.feed(body[pos:pos + chunk_size])
+        parser.close()
+        return received
+
+    def test_boundary_split_at_every_offset(self):
+        # Data that almost matches the delimiter must not be cut short
+        tricky = b"a\r\n--" + BOUNDARY[:-1].encode() + b"\r\n-" + b"\r"
+        parts = [("file", "a.bin", os.urandom(300) + tricky), ("note", None, b"hi"),
+                 ("file", "empty.txt", b"")]
+        body = make_body(parts, preamble=b"ignored preamble\r\n", epilogue=b"ignored epilogue")
+        for size in range(1, 80):
+            with self.subTest(chunk_size=size):
+                received = self.parse(body, size)
+                self.assertEqual([(s.part.name, s.part.filename, bytes(s.data)) for s in received],
+                                 parts)
+                self.assertTrue(all(s.closed for s in received))
+
+    def test_delimiter_split_between_chunks(self):
+        data = os.urandom(1000)
+        body = make_body([("file", "x", data)])
+        delimiter = body.index(b"\r\n--" + BOUNDARY.encode(), 10)
+        # Cut inside the CRLF, the dashes and the boundary itself
+        for cut in range(delimiter - 1, delimiter + len(BOUNDARY) + 5):
+            with self.subTest(cut=cut):
+                received = []
+                parser = MultipartParser(BOUNDARY, lambda part: Sink(part, received))
+                parser.feed(body[:cut])
+                parser.feed(body[cut:])
+                parser.close()
+                self.assertEqual(bytes(received[0].data), data)
+
+    def test_skipped_part(self):
+        body = make_body([("skip", "a", b"aaa"), ("keep", "b", b"bbb")])
+        received = self.parse(body, 3, skip=("skip",))
+        self.assertEqual([(s.part.name, bytes(s.data)) for s in received], [("keep", b"bbb")])
+
+    def test_truncated_body(self):
+        body = make_body([("file", "a", b"data" * 100)])
+        for cut in (0, 10, 60, len(body) - 10, len(body) - 5):
+            with self.subTest(cut=cut):
+                received = []
+                parser = MultipartParser(BOUNDARY, lambda part: Sink(part, received))
+                parser.feed(body[:cut])
+                with self.assertRaises(MultipartError):
+                    parser.close()
+                parser.abort()
+                self.assertFalse(any(s.closed for s in received))
+                self.assertTrue(all(s.aborted for s in received))
+
+    def test_malformed_boundary_line(self):
+        body = b"--" + BOUNDARY.encode() + b"XX\r\n"
+        parser = MultipartParser(BOUNDARY, lambda part: None)
+        with self.assertRaises(MultipartError):
+            parser.feed(body)
+
+    def test_headers_too_large(self):
+        body = b"--" + BOUNDARY.encode() + b"\r\nX-Padding: " + b"a" * (MAX_HEADER_SIZE + 1)
+        parser = MultipartParser(BOUNDARY, lambda part: None)
+        with self.assertRaises(MultipartError):
+            for pos in range(0, len(body), 1024):
+                parser.feed(body[pos:pos + 1024])
+
+    def test_get_boundary(self):
+        self.assertEqual(get_boundary(f'multipart/form-data; boundary="{BOUNDARY}"'), BOUNDARY)
+        for content_type in (None, "text/plain", "multipart/form-data",
+                             "multipart/form-data; boundary=" + "a" * 201):
+            with self.subTest(content_type=content_type):
+                with self.assertRaises(MultipartError):
+                    get_boundary(content_type)
+
+if __name__ == '__main__':
+    unittest.main()
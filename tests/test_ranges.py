@@ -0,0 +1,81 @@
+# tests/test_ranges.py
+import unittest
+from ranges import parse_range_header, MultipartByteranges, RangeNotSatisfiable, MAX_RANGES
+
+class ParseRangeHeaderTest(unittest.TestCase):
+
+    def test_ranges(self):
+        cases = [
+            # header, size, expected
+            ("bytes=0-99", 1000, [(0, 99)]),
+            ("bytes=900-", 1000, [(900, 999)]),
+            ("bytes=500-5000", 1000, [(500, 999)]),
+            ("BYTES = 0-0", 1000, [(0, 0)]),
+            # suffix ranges
+            ("bytes=-100", 1000, [(900, 999)]),
+            ("bytes=-5000", 1000, [(0, 999)]),
+            ("bytes=-0, 0-9", 1000, [(0, 9)]),
+            # overlapping and adjacent ranges are merged and sorted
+            ("bytes=50-99,0-49", 1000, [(0, 99)]),
+            ("bytes=0-10,5-20,100-110", 1000, [(0, 20), (100, 110)]),
+            ("bytes=-100,800-949", 1000, [(800, 999)]),
+            ("bytes=0-9, ,20-29,", 1000, [(0, 9), (20, 29)]),
+            # ranges past the end are dropped when others are satisfiable
+            ("bytes=0-9,2000-3000", 1000, [(0, 9)]),
+            # malformed headers are ignored
+            ("items=0-9", 1000, None),
+            ("bytes=", 1000, None),
+            ("bytes=10", 1000, None),
+            ("bytes=9-0", 1000, None),
+            ("bytes=a-9", 1000, None),
+            ("bytes=--5", 1000, None),
+            ("bytes=-", 1000, None),
+        ]
+        for header, size, expected in cases:
+            with self.subTest(header=header, size=size):
+                self.assertEqual(parse_range_header(header, size), expected)
+
+    def test_unsatisfiable(self):
+        for header, size in [("bytes=1000-", 1000), ("bytes=1000-2000,5000-", 1000),
+                             ("bytes=-0", 1000), ("bytes=0-", 0), ("bytes=-10", 0)]:
+            with self.subTest(header=header, size=size):
+                with self.assertRaises(RangeNotSatisfiable):
+                    parse_range_header(header, size)
+
+    def test_too_many_ranges(self):
+        cases = [
+            (MAX_RANGES, [(i * 10, i * 10) for i in range(MAX_RANGES)]),
+            (MAX_RANGES + 1, None),
+        ]
+        for count, expected in cases:
+            header = "bytes=" + ",".join(f"{i * 10}-{i * 10}" for i in range(count))
+            with self.subTest(count=count):
+                self.assertEqual(parse_range_header(header, 10000), expected)
+
+class MultipartByterangesTest(unittest.TestCase):
+
+    def test_framing(self):
+        data = bytes(range(256)) * 4
+        ranges = parse_range_header("bytes=-24,0-9,5-19", len(data))
+        body = MultipartByteranges(ranges, len(data), "application/octet-stream")
+        self.assertEqual(body.content_type, f"multipart/byteranges; boundary={body.boundary}")
+
+        out = bytearray()
+        for head, start, length in body.parts:
+            out += head + data[start:start + length]
+        out += body.trailer
+        self.assertEqual(len(out), body.content_length)
+
+        parts = bytes(out).split(f"--{body.boundary}".encode())
+        self.assertEqual(parts[0], b"\r\n")
+        self.assertEqual(parts[-1], b"--\r\n")
+        expected = [(b"bytes 0-19/1024", data[0:20]), (b"bytes 1000-1023/1024", data[1000:1024])]
+        for part, (content_range, payload) in zip(parts[1:-1], expected):
+            head, _, payload_crlf = part.partition(b"\r\n\r\n")
+            self.assertIn(b"Content-Range: " + content_range, head)
+            self.assertIn(b"Content-Type: application/octet-stream", head)
+            self.assertEqual(payload_crlf, payload + b"\r\n")
+        self.assertEqual(len(parts), len(expected) + 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# tests/test_search_index.py
+import os
+import re
+import time
+import random
+import shutil
+import tempfile
+import unittest
+from search_index import SearchIndex, SearchSnapshot, _Folder
+
+def make_folder(rel, names, rng):
+    entries = sorted((name, 0, rng.randrange(1000), float(rng.randrange(1000)), False) for name in names)
+    return _Folder(rel, 0, entries)
+
+class SearchSnapshotTest(unittest.TestCase):
+    """Snapshots built from a previous one must equal a snapshot built from scratch"""
+
+    def assertSameSnapshot(self, snapshot, folders):
+        fresh = SearchSnapshot(folders, 0)
+        for attr in ("text", "folded", "kinds", "sizes", "mtimes", "starts", "positions", "count"):
+            self.assertEqual(getattr(snapshot, attr), getattr(fresh, attr), attr)
+        line_starts = [match.end() for match in re.finditer("\n", fresh.text)][:-1]
+        for key in ("size", "mtime"):
+            ids, values = snapshot.order(key)
+            found = [(snapshot.locate(id), value) for id, value in zip(ids, values)]
+            found = [(located, value) for located, value in found if located is not None]
+            values_by_index = fresh.sizes if key == "size" else fresh.mtimes
+            self.assertEqual(sorted(located[0] for located, _ in found), list(range(fresh.count)))
+            self.assertEqual([value for _, value in found], sorted(values_by_index))
+            for (i, offset), value in found:
+                self.assertEqual(value, values_by_index[i])
+                self.assertEqual(offset, line_starts[i])
+                self.assertEqual(snapshot.entry(i, offset), fresh.entry(i, offset))
+
+    def test_changes_are_merged(self):
+        rng = random.Random(7)
+        folders = [make_folder(f"d{i:03}", [f"f{i}-{j}" for j in range(rng.randrange(0, 6))], rng)
+                   for i in range(60)]
+        snapshot = SearchSnapshot(folders, 0)
+        snapshot.warm()
+        for step in range(40):
+            folders = list(folders)
+            for _ in range(rng.randrange(1, 4)):
+                action = rng.randrange(3)
+                i = rng.randrange(len(folders))
+                if action == 0:
+                    rel = folders[i].rel
+                    folders[i] = make_folder(rel, [f"n{step}-{j}" for j in range(rng.randrange(0, 6))], rng)
+                elif action == 1 and len(folders) > 1:
+                    del folders[i]
+                else:
+                    folders.insert(i, make_folder(f"new{step}-{i}", ["x", "Y"], rng))
+            snapshot = SearchSnapshot(folders, 0, snapshot)
+            with self.subTest(step=step):
+                self.assertSameSnapshot(snapshot, folders)
+
+class SearchIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.share = tempfile.mkdtemp()
+        for folder in ("docs", "docs/old", "media"):
+            os.makedirs(os.path.join(self.share, folder))
+        for name, size in (("docs/Report.txt", 10), ("docs/old/report-2020.txt", 2000),
+                           ("media/clip.mp4", 5000), ("readme.md", 1)):
+            with open(os.path.join(self.share, name), "wb") as f:
+                f.write(b"x" * size)
+        self.index = SearchIndex(self.share, hidden=(".partial-uploads",))
+        self.wait_for(lambda: self.index.stats()["ready"])
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.share)
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 10
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.05)
+
+    def paths(self, **options):
+        return sorted(entry["path"] for entry in self.index.search(**options)[0])
+
+    def test_queries(self):
+        self.assertEqual(self.paths(query="report"), ["/docs/Report.txt", "/docs/old/report-2020.txt"])
+        self.assertEqual(self.paths(query="report-", mode="prefix"), ["/docs/old/report-2020.txt"])
+        self.assertEqual(self.paths(query="*.txt", path="docs/old"), ["/docs/old/report-2020.txt"])
+        self.assertEqual(self.paths(min_size=1000), ["/docs/old/report-2020.txt", "/media/clip.mp4"])
+        self.assertEqual(self.paths(query="o", kind="dir"), ["/docs", "/docs/old"])
+
+    def test_invalidate_picks_up_uploads(self):
+        self.paths(min_size=0)  # build the size order before the change
+        with open(os.path.join(self.share, "media", "new-report.bin"), "wb") as f:
+            f.write(b"x" * 3000)
+        self.index.invalidate(os.path.join(self.share, "media"))
+        self.wait_for(lambda: self.paths(query="new-report"))
+        self.assertEqual(self.paths(min_size=1000), ["/docs/old/report-2020.txt", "/media/clip.mp4",
+                                                     "/media/new-report.bin"])
+
+if __name__ == '__main__':
+    unittest.main()
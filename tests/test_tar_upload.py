@@ -0,0 +1,194 @@
+# tests/test_tar_upload.py
+import io
+import os
+import gzip
+import shutil
+import tarfile
+import tempfile
+import unittest
+from tar_upload import TarExtractor, TarUploadError, zstandard
+
+CHUNK_SIZES = (1, 7, 511, 512, 513, 4096, 1 << 20)
+
+def make_tar(members, format=tarfile.GNU_FORMAT):
+    """Tar archive bytes from (TarInfo, data) pairs; data may be None"""
+    out = io.BytesIO()
+    with tarfile.open(fileobj=out, mode='w', format=format) as tar:
+        for info, data in members:
+            if data is not None:
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+            else:
+                tar.addfile(info)
+    return out.getvalue()
+
+def file_member(name, data):
+    return tarfile.TarInfo(name), data
+
+def dir_member(name):
+    info = tarfile.TarInfo(name)
+    info.type = tarfile.DIRTYPE
+    return info, None
+
+def link_member(name, target, type=tarfile.SYMTYPE):
+    info = tarfile.TarInfo(name)
+    info.type = type
+    info.linkname = target
+    return info, None
+
+def chunks(data, size):
+    for pos in range(0, len(data), size):
+        yield data[pos:pos + size]
+
+class TarExtractorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.share = os.path.join(self.tmp, "share")
+        os.mkdir(self.share)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def extract(self, body, encoding=None, chunk_size=1 << 20, **options):
+        extractor = TarExtractor(self.share, encoding, **options)
+        for chunk in chunks(body, chunk_size):
+            extractor.feed(chunk)
+        extractor.close()
+        return extractor.summary()
+
+    def listing(self):
+        """Every path under the whole temporary folder, relative to it"""
+        found = []
+        for root, dirs, files in os.walk(self.tmp):
+            for name in dirs + files:
+                found.append(os.path.relpath(os.path.join(root, name), self.tmp).replace(os.sep, '/'))
+        return sorted(found)
+
+    def read(self, name):
+        with open(os.path.join(self.share, name), 'rb') as f:
+            return f.read()
+
+    def test_extracts_files_and_folders_in_any_chunk_size(self):
+        big = os.urandom(3000)
+        body = make_tar([dir_member("docs"), file_member("docs/a.txt", b"hello"),
+                         file_member("empty", b""), file_member("docs/sub/big.bin", big)])
+        for size in CHUNK_SIZES:
+            with self.subTest(chunk_size=size):
+                summary = self.extract(body, chunk_size=size)
+                self.assertEqual(summary["files"], ["docs/a.txt", "empty", "docs/sub/big.bin"])
+                self.assertEqual(summary["directories"], 1)
+                self.assertEqual(summary["bytes"], 5 + len(big))
+                self.assertEqual(summary["skipped"], [])
+                self.assertEqual(self.read("docs/a.txt"), b"hello")
+                self.assertEqual(self.read("empty"), b"")
+                self.assertEqual(self.read("docs/sub/big.bin"), big)
+                shutil.rmtree(self.share)
+                os.mkdir(self.share)
+
+    def test_long_names(self):
+        name = "/".join(["d" * 60] * 3) + "/file.txt"
+        for format in (tarfile.GNU_FORMAT, tarfile.PAX_FORMAT):
+            with self.subTest(format=format):
+                summary = self.extract(make_tar([file_member(name, b"x")], format), chunk_size=100)
+                self.assertEqual(summary["files"], [name])
+                self.assertEqual(self.read(name), b"x")
+
+    def test_truncated_stream(self):
+        body = make_tar([file_member("a.txt", b"a" * 2000), file_member("b.txt", b"b" * 2000)])
+        # Cut inside a header, inside file data, inside padding and right before the end blocks
+        for cut in (100, 512 + 1000, 512 + 2040, 512 + 2048 + 512 + 100, 512 + 2048 + 512 + 2048):
+            with self.subTest(cut=cut):
+                extractor = TarExtractor(self.share)
+                extractor.feed(body[:cut])
+                if cut == 512 + 2048 + 512 + 2048:
+                    # Ends on a member boundary: nothing is half written
+                    extractor.close()
+                else:
+                    with self.assertRaises(TarUploadError):
+                        extractor.close()
+                for name in os.listdir(self.share):
+                    self.assertFalse(name.startswith(".upload-"), name)
+                    self.assertEqual(self.read(name), name[0].encode() * 2000)
+
+    def test_truncated_gzip(self):
+        body = gzip.compress(make_tar([file_member("a.txt", os.urandom(5000))]))
+        extractor = TarExtractor(self.share, 'gzip')
+        extractor.feed(body[:len(body) // 2])
+        with self.assertRaises(TarUploadError):
+            extractor.close()
+        self.assertNotIn("a.txt", os.listdir(self.share))
+
+    def test_invalid_gzip(self):
+        extractor = TarExtractor(self.share, 'gzip')
+        with self.assertRaises(TarUploadError):
+            extractor.feed(b"not gzip data at all")
+
+    def test_concatenated_gzip_members(self):
+        data = os.urandom(4000)
+        body = make_tar([file_member("a.bin", data), file_member("b.txt", b"b")])
+        # Split mid-member, as pigz or an appended archive would
+        split = 700
+        compressed = gzip.compress(body[:split]) + gzip.compress(body[split:])
+        for size in (1, 100, 1 << 20):
+            with self.subTest(chunk_size=size):
+                summary = self.extract(compressed, 'gzip', chunk_size=size)
+                self.assertEqual(summary["files"], ["a.bin", "b.txt"])
+                self.assertEqual(self.read("a.bin"), data)
+
+    @unittest.skipUnless(zstandard, "zstandard is not installed")
+    def test_zstd(self):
+        body = zstandard.ZstdCompressor().compress(make_tar([file_member("a.txt", b"zstd")]))
+        summary = self.extract(body, 'zstd', chunk_size=5)
+        self.assertEqual(summary["files"], ["a.txt"])
+        self.assertEqual(self.read("a.txt"), b"zstd")
+
+    def test_traversal_is_skipped(self):
+        outside = os.path.join(self.tmp, "outside")
+        os.mkdir(outside)
+        os.symlink(outside, os.path.join(self.share, "escape"))
+        body = make_tar([
+            file_member("../evil.txt", b"x"),
+            file_member("docs/../../evil.txt", b"x"),
+            file_member("/evil.txt", b"x"),
+            file_member("\\evil.txt", b"x"),
+            file_member("C:evil.txt", b"x"),
+            file_member("escape/evil.txt", b"x"),
+            dir_member("../evil-dir"),
+            link_member("link", "/etc/passwd"),
+            link_member("hardlink", "../outside", tarfile.LNKTYPE),
+            file_member("ok.txt", b"ok"),
+        ])
+        summary = self.extract(body, chunk_size=300)
+        self.assertEqual(summary["files"], ["ok.txt"])
+        self.assertEqual(summary["directories"], 0)
+        self.assertEqual([skip["name"] for skip in summary["skipped"]],
+                         ["../evil.txt", "docs/../../evil.txt", "/evil.txt", "\\evil.txt",
+                          "C:evil.txt", "escape/evil.txt", "../evil-dir", "link", "hardlink"])
+        self.assertEqual(self.listing(), ["outside", "share", "share/escape", "share/ok.txt"])
+
+    def test_reserved_names_are_skipped(self):
+        reserved = [".partial-uploads/x.json", ".PARTIAL-UPLOADS/x.json", ".Partial-Uploads. /x",
+                    "docs/.partial-uploads/x", ".upload-1234", "docs/.UPLOAD-1234"]
+        body = make_tar([file_member(name, b"x") for name in reserved]
+                        + [dir_member(".Partial-Uploads"), file_member("ok", b"ok")])
+        summary = self.extract(body)
+        self.assertEqual(summary["files"], ["ok"])
+        self.assertEqual([skip["name"] for skip in summary["skipped"]], reserved + [".Partial-Uploads"])
+        self.assertTrue(all(skip["reason"] == "reserved name" for skip in summary["skipped"]))
+        self.assertEqual(self.listing(), ["share", "share/ok"])
+
+    def test_oversized_file_is_skipped(self):
+        body = make_tar([file_member("big", b"x" * 1000), file_member("small", b"y")])
+        summary = self.extract(body, chunk_size=64, max_file_size=100)
+        self.assertEqual(summary["files"], ["small"])
+        self.assertEqual(summary["skipped"][0]["name"], "big")
+        self.assertEqual(os.listdir(self.share), ["small"])
+
+    def test_invalid_header(self):
+        extractor = TarExtractor(self.share)
+        with self.assertRaises(TarUploadError):
+            extractor.feed(b"\x01" * 512)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+# tests/test_transfer.py
+import unittest
+from http.client import HTTPMessage
+from transfer import content_length
+
+def make_headers(*values):
+    headers = HTTPMessage()
+    for value in values:
+        headers['Content-Length'] = value
+    return headers
+
+class ContentLengthTest(unittest.TestCase):
+
+    def test_valid(self):
+        cases = [
+            ((), 0),
+            (("0",), 0),
+            (("1234",), 1234),
+            ((" 42 ",), 42),
+            (("007",), 7),
+            # repeated identical values are the same length
+            (("10", "10"), 10),
+            (("10", " 10"), 10),
+        ]
+        for values, expected in cases:
+            with self.subTest(values=values):
+                self.assertEqual(content_length(make_headers(*values)), expected)
+
+    def test_malformed(self):
+        cases = [
+            ("",), ("-1",), ("+5",), ("1_000",), ("1 000",), ("0x10",), ("1.5",),
+            ("abc",), ("١٢",),  # Arabic-Indic digits
+            ("10, 10",),
+            # conflicting duplicates
+            ("10", "11"), ("10", "abc"),
+        ]
+        for values in cases:
+            with self.subTest(values=values):
+                with self.assertRaises(ValueError):
+                    content_length(make_headers(*values))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+# tests/test_upload_sessions.py
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from uploads import DURABILITY_MODES
+from upload_sessions import (UploadSessionStore, SessionNotFound, UploadIncomplete,
+                             MAX_CHUNK_SIZE, SESSION_DIR_NAME)
+
+DATA = bytes(range(256)) * 40  # 10240 bytes
+
+class UploadSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.share = tempfile.mkdtemp()
+        self.store = UploadSessionStore(self.share, chunk_size=4096)
+
+    def tearDown(self):
+        shutil.rmtree(self.share)
+
+    def send(self, session, start, end, cut=None):
+        """PUT DATA[start:end]; 'cut' bytes arrive before the client goes away"""
+        body = DATA[start:end] if cut is None else DATA[start:start + cut]
+        return session.write_chunk(start, io.BytesIO(body), end - start, read_size=1000)
+
+    def test_received_ranges(self):
+        cases = [
+            # chunks as (start, end) or (start, end, bytes before the cut), received ranges
+            ([], []),
+            ([(0, 4096)], [[0, 4096]]),
+            ([(4096, 8192), (0, 4096)], [[0, 8192]]),
+            ([(0, 100), (200, 300)], [[0, 100], [200, 300]]),
+            ([(0, 100), (200, 300), (50, 250)], [[0, 300]]),
+            ([(0, 100), (0, 100)], [[0, 100]]),
+            ([(8192, 10240), (0, 4096, 1500)], [[0, 1500], [8192, 10240]]),
+            ([(0, 4096, 0)], []),
+            ([(0, 4096, 1000), (1000, 4096)], [[0, 4096]]),
+        ]
+        for chunks, expected in cases:
+            with self.subTest(chunks=chunks):
+                session = self.store.create("file.bin", len(DATA))
+                for chunk in chunks:
+                    if len(chunk) == 3:
+                        with self.assertRaises(ConnectionError):
+                            self.send(session, *chunk)
+                    else:
+                        self.send(session, *chunk)
+                self.assertEqual(session.received, expected)
+                self.assertEqual(session.received_bytes, sum(e - s for s, e in expected))
+                self.assertEqual(session.to_dict()["complete"], expected == [[0, len(DATA)]])
+                self.store.abort(session.id)
+
+    def test_invalid_chunks(self):
+        session = self.store.create("file.bin", len(DATA))
+        for offset, length in [(-1, 10), (len(DATA) - 10, 11), (len(DATA) + 1, 0),
+                               (0, MAX_CHUNK_SIZE + 1)]:
+            with self.subTest(offset=offset, length=length):
+                with self.assertRaises(ValueError):
+                    session.open_chunk(offset, length)
+        self.assertEqual(session.received, [])
+
+    def test_create(self):
+        first = self.store.create("file.bin", len(DATA), key="k1")
+        self.assertIs(self.store.create("file.bin", len(DATA), key="k1"), first)
+        self.assertIsNot(self.store.create("file.bin", len(DATA), key="k2"), first)
+        self.assertIsNot(self.store.create("other.bin", len(DATA), key="k1"), first)
+        self.assertIsNot(self.store.create("file.bin", len(DATA)), self.store.create("file.bin", len(DATA)))
+        # Sparse until chunks arrive
+        self.assertEqual(os.path.getsize(first.data_path), len(DATA))
+        for name, size in [("", 10), ("..", 10), ("file.bin", -1)]:
+            with self.subTest(name=name, size=size):
+                with self.assertRaises(ValueError):
+                    self.store.create(name, size)
+        with self.assertRaises(SessionNotFound):
+            self.store.get("not-a-session-id")
+        with self.assertRaises(SessionNotFound):
+            self.store.get("0" * 32)
+
+    def test_resume_after_restart(self):
+        for durability in DURABILITY_MODES:
+            with self.subTest(durability=durability):
+                store = UploadSessionStore(self.share, chunk_size=4096, durability=durability)
+                session = store.create("file.bin", len(DATA), key=durability)
+                self.send(session, 0, 4096)
+                with self.assertRaises(ConnectionError):
+                    self.send(session, 4096, 8192, cut=2000)
+
+                store = UploadSessionStore(self.share, chunk_size=4096, durability=durability)
+                resumed = store.create("file.bin", len(DATA), key=durability)
+                self.assertEqual(resumed.id, session.id)
+                self.assertEqual(resumed.received, [[0, 6096]])
+                self.send(resumed, 6096, len(DATA))
+                self.assertTrue(resumed.complete)
+                with open(store.finalize(resumed.id), "rb") as f:
+                    self.assertEqual(f.read(), DATA)
+
+    def test_resume_from_other_process(self):
+        session = self.store.create("file.bin", len(DATA))
+        other = UploadSessionStore(self.share, chunk_size=4096).get(session.id)
+        self.send(other, 4096, len(DATA))
+        self.send(session, 0, 1000)
+        # Each store only learns of the other's chunks from the shared log
+        self.assertEqual(self.store.get(session.id).received, [[0, 1000], [4096, len(DATA)]])
+        self.send(other, 1000, 4096)
+        self.assertTrue(self.store.get(session.id).complete)
+
+    def test_finalize(self):
+        session = self.store.create("C:\\Users\\me\\file.bin", len(DATA))
+        self.send(session, 0, 4096)
+        with self.assertRaises(UploadIncomplete):
+            self.store.finalize(session.id)
+        self.assertFalse(os.path.exists(os.path.join(self.share, "file.bin")))
+
+        self.send(session, 4096, len(DATA))
+        path = self.store.finalize(session.id)
+        self.assertEqual(path, os.path.join(self.share, "file.bin"))
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), DATA)
+        self.assertEqual(os.listdir(os.path.join(self.share, SESSION_DIR_NAME)), [])
+        with self.assertRaises(SessionNotFound):
+            self.store.finalize(session.id)
+
+    def test_finalize_empty_file(self):
+        session = self.store.create("empty.txt", 0)
+        self.assertTrue(session.complete)
+        with open(self.store.finalize(session.id), "rb") as f:
+            self.assertEqual(f.read(), b"")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+# transfer.py
+import os
+import time
+import socket
+import threading
+from utils import format_file_size
+from bandwidth import SHAPED_CHUNK_SIZE
+
+SENDFILE_CHUNK_SIZE = 8 * 1024 * 1024   # bytes handed to sendfile() per call
+COPY_BUFFER_SIZE = 1024 * 1024          # reused buffer for the read/send fallback
+
+_buffers = threading.local()
+
+class TransferStats:
+    """Byte count and timing for a single transfer"""
+
+    def __init__(self, method):
+        self.method = method
+        self.bytes = 0
+        self.started = time.monotonic()
+        self.finished = None
+
+    def finish(self):
+        self.finished = time.monotonic()
+        return self
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def rate(self):
+        """Average throughput in bytes per second"""
+        elapsed = self.elapsed
+        return self.bytes / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self):
+        return (f"{format_file_size(self.bytes)} in {self.elapsed:.2f}s "
+                f"({format_file_size(self.rate)}/s, {self.method})")
+
+def content_length(headers):
+    """Length of a request body from its Content-Length header, 0 without one; ValueError if malformed"""
+    values = {value.strip() for value in headers.get_all('Content-Length') or ()}
+    if not values:
+        return 0
+    if len(values) > 1:
+        raise ValueError("Conflicting Content-Length headers")
+    value = values.pop()
+    # int() would also take signs, spaces, underscores and non-ASCII digits
+    if not (value.isascii() and value.isdigit()):
+        raise ValueError(f"Invalid Content-Length: {value!r}")
+    return int(value)
+
+def _copy_buffer():
+    """Per-thread buffer reused across transfers to avoid allocating per chunk"""
+    buf = getattr(_buffers, "buf", None)
+    if buf is None:
+        buf = _buffers.buf = memoryview(bytearray(COPY_BUFFER_SIZE))
+    return buf
+
+def can_sendfile(sock, f):
+    """True if the kernel can copy straight from 'f' into 'sock'"""
+    if not hasattr(os, "sendfile") or not isinstance(sock, socket.socket):
+        return False
+    # TLS sockets have to encrypt in userspace
+    if sock.__class__.__name__ == "SSLSocket":
+        return False
+    try:
+        f.fileno()
+    except (AttributeError, OSError):
+        return False
+    return True
+
+def send_file(sock, f, offset=0, count=None, stats=None, flow=None):
+    """
+    Send 'count' bytes of the open binary file 'f' starting at 'offset' to
+    the connected socket 'sock', using sendfile() when possible and a reused
+    readinto() buffer otherwise. Returns a TransferStats for the transfer;
+    pass 'stats' to accumulate several calls into one. A bandwidth 'flow'
+    paces the transfer in SHAPED_CHUNK_SIZE pieces. If the file shrinks
+    meanwhile, fewer bytes are sent; the caller has to close the connection.
+    """
+    if count is None:
+        count = os.fstat(f.fileno()).st_size - offset
+    if can_sendfile(sock, f):
+        return _send_with_sendfile(sock, f, offset, count, stats or TransferStats("sendfile"), flow)
+    return _send_with_buffer(sock, f, offset, count, stats or TransferStats("buffered"), flow)
+
+def send_buffer(sock, data, offset=0, count=None, stats=None, flow=None):
+    """
+    send_file() for content already in memory, e.g. a memoryview from
+    HotFileCache: sendall() straight from the buffer, no copies
+    """
+    if count is None:
+        count = len(data) - offset
+    stats = stats or TransferStats("memory")
+    step = SHAPED_CHUNK_SIZE if flow else count
+    end = offset + count
+    while offset < end:
+        n = min(step, end - offset)
+        if flow:
+            flow.throttle(n)
+        sock.sendall(data[offset:offset + n])
+        offset += n
+        stats.bytes += n
+    return stats.finish()
+
+def _send_with_sendfile(sock, f, offset, count, stats, flow=None):
+    remaining = count
+    while remaining > 0:
+        n = min(SENDFILE_CHUNK_SIZE, remaining)
+        if flow:
+            n = min(n, SHAPED_CHUNK_SIZE)
+            flow.throttle(n)
+        # socket.sendfile() copes with socket timeouts, unlike a bare os.sendfile()
+        sent = sock.sendfile(f, offset, n)
+        if not sent:
+            break  # file shrank underneath us
+        offset += sent
+        remaining -= sent
+        stats.bytes += sent
+    return stats.finish()
+
+def _send_with_buffer(sock, f, offset, count, stats, flow=None):
+    buf = _copy_buffer()
+    f.seek(offset)
+    remaining = count
+    while remaining > 0:
+        n = min(len(buf), remaining)
+        if flow:
+            n = min(n, SHAPED_CHUNK_SIZE)
+            flow.throttle(n)
+        n = f.readinto(buf[:n])
+        if not n:
+            break
+        sock.sendall(buf[:n])
+        remaining -= n
+        stats.bytes += n
+    return stats.finish()
+
+class ChunkedWriter:
+    """
+    Body writer for responses whose length isn't known up front. Frames
+    data with HTTP/1.1 chunked transfer-coding, or passes it through
+    unchanged when the connection will be closed to mark the end instead.
+    """
+
+    def __init__(self, wfile, chunked=True):
+        self.wfile = wfile
+        self.chunked = chunked
+        self.closed = False
+
+    def write(self, data):
+        if not data:
+            return
+        if not self.chunked:
+            self.wfile.write(data)
+        elif len(data) <= 64 * 1024:
+            self.wfile.write(b"%X\r\n" % len(data) + bytes(data) + b"\r\n")
+        else:
+            self.wfile.write(b"%X\r\n" % len(data))
+            self.wfile.write(data)
+            self.wfile.write(b"\r\n")
+
+    def close(self):
+        """Write the terminating zero-length chunk"""
+        if not self.closed and self.chunked:
+            self.wfile.write(b"0\r\n\r\n")
+        self.closed = True
@@ -0,0 +1,293 @@
+# upload_sessions.py
+import os
+import re
+import json
+import time
+import uuid
+import logging
+import threading
+from uploads import (MAX_UPLOAD_SIZE, UPLOAD_READ_SIZE, DEFAULT_DURABILITY, UploadTooLarge,
+                     safe_upload_path, preallocate, sync_file, sync_directory)
+from utils import format_file_size
+
+SESSIONS_PREFIX = "/upload/sessions"
+SESSION_DIR_NAME = ".partial-uploads"
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+SESSION_TTL = 7 * 24 * 3600  # abandoned sessions are removed after a week
+_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+class SessionNotFound(KeyError):
+    """No upload session with that id"""
+
+class UploadIncomplete(ValueError):
+    """Tried to finalize a session that is still missing byte ranges"""
+
+def _add_range(ranges, start, end):
+    """Insert [start, end) into a sorted list of disjoint ranges, merging neighbours"""
+    merged = []
+    for s, e in ranges:
+        if e < start or s > end:
+            merged.append([s, e])
+        else:
+            start, end = min(s, start), max(e, end)
+    merged.append([start, end])
+    merged.sort()
+    return merged
+
+class UploadSession:
+    """
+    One resumable upload: a sparse partial file that chunks are written into
+    at arbitrary offsets (each preallocated as it arrives), plus a record of
+    which byte ranges have arrived.
+    """
+
+    def __init__(self, store, id, name, size, key=None, received=None, created=None):
+        self.store = store
+        self.id = id
+        self.name = name
+        self.size = size
+        self.key = key
+        self.received = received or []
+        self.created = created or time.time()
+        self.updated = self.created
+        self.lock = threading.Lock()
+
+    @property
+    def data_path(self):
+        return os.path.join(self.store.session_dir, self.id + ".part")
+
+    @property
+    def meta_path(self):
+        return os.path.join(self.store.session_dir, self.id + ".json")
+
+    @property
+    def log_path(self):
+        return os.path.join(self.store.session_dir, self.id + ".ranges")
+
+    @property
+    def received_bytes(self):
+        return sum(e - s for s, e in self.received)
+
+    @property
+    def complete(self):
+        return self.received == [[0, self.size]] or self.size == 0
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "size": self.size,
+            "received": self.received,
+            "received_bytes": self.received_bytes,
+            "chunk_size": self.store.chunk_size,
+            "complete": self.complete,
+        }
+
+    def save(self):
+        tmp = self.meta_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"id": self.id, "name": self.name, "size": self.size, "key": self.key,
+                       "received": self.received, "created": self.created}, f)
+        os.replace(tmp, self.meta_path)
+
+    def refresh(self):
+        """
+        Merge ranges recorded by other server processes. Each chunk appends
+        one "start end" line to the session's .ranges log, so processes
+        sharing the folder never overwrite each other's progress.
+        """
+        try:
+            with open(self.log_path) as f:
+                lines = f.read().splitlines()
+                modified = os.fstat(f.fileno()).st_mtime
+        except FileNotFoundError:
+            return
+        with self.lock:
+            self.updated = max(self.updated, modified)
+            for line in lines:
+                try:
+                    start, end = map(int, line.split())
+                except ValueError:
+                    continue  # partially written line of a concurrent append
+                self.received = _add_range(self.received, start, end)
+
+    def open_chunk(self, offset, length):
+        """Validate a chunk and return the partial file positioned at 'offset'"""
+        if length > MAX_CHUNK_SIZE:
+            raise ValueError("Chunk too large")
+        if offset < 0 or offset + length > self.size:
+            raise ValueError("Chunk outside of file")
+        f = open(self.data_path, "r+b")
+        try:
+            preallocate(f.fileno(), length, offset)
+        except BaseException:
+            f.close()
+            raise
+        f.seek(offset)
+        return f
+
+    def record_chunk(self, offset, written):
+        """Mark bytes as received; only what actually landed counts, a cut-off chunk is simply resent"""
+        with self.lock:
+            if written:
+                self.received = _add_range(self.received, offset, offset + written)
+                with open(self.log_path, "a") as f:
+                    f.write(f"{offset} {offset + written}\n")
+            self.updated = time.time()
+
+    def finish_chunk(self, f, offset, written):
+        """
+        Close a partial file from open_chunk() and record the 'written' bytes
+        as received, synced first if the store's durability is "periodic"
+        """
+        try:
+            f.flush()
+            if self.store.durability == "periodic":
+                sync_file(f.fileno(), "periodic")  # before the range is recorded as received
+        finally:
+            f.close()
+        self.record_chunk(offset, written)
+
+    def write_chunk(self, offset, rfile, length, read_size=UPLOAD_READ_SIZE, flow=None):
+        """Copy 'length' bytes from 'rfile' into the partial file at 'offset', paced by 'flow'"""
+        written = 0
+        f = self.open_chunk(offset, length)
+        try:
+            while written < length:
+                n = min(read_size, length - written)
+                if flow:
+                    flow.throttle(n)
+                data = rfile.read(n)
+                if not data:
+                    break
+                f.write(data)
+                written += len(data)
+        finally:
+            self.finish_chunk(f, offset, written)
+        if written < length:
+            raise ConnectionError("Client closed connection mid-chunk")
+        return self.to_dict()
+
+class UploadSessionStore:
+    """
+    Resumable upload sessions kept in a hidden folder of the shared
+    directory. 'durability' is the UploadFile policy: "periodic" syncs
+    every chunk before recording it, "fsync" the whole file on completion.
+    """
+
+    def __init__(self, directory, chunk_size=DEFAULT_CHUNK_SIZE, durability=DEFAULT_DURABILITY):
+        self.directory = directory
+        self.session_dir = os.path.join(directory, SESSION_DIR_NAME)
+        self.chunk_size = chunk_size
+        self.durability = durability
+        self.sessions = {}
+        self.lock = threading.Lock()
+        os.makedirs(self.session_dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """Pick up sessions left by a previous run so uploads resume after a restart"""
+        now = time.time()
+        for entry in os.listdir(self.session_dir):
+            if not entry.endswith(".json") or entry[:-5] in self.sessions:
+                continue
+            session = self._read_session(os.path.join(self.session_dir, entry))
+            if session is None:
+                continue
+            if now - session.created > SESSION_TTL or not os.path.exists(session.data_path):
+                self._discard(session)
+            else:
+                self.sessions[session.id] = session
+
+    def _read_session(self, path):
+        try:
+            with open(path) as f:
+                meta = json.load(f)
+            session = UploadSession(self, meta["id"], meta["name"], meta["size"],
+                                    meta.get("key"), meta.get("received"), meta.get("created"))
+        except FileNotFoundError:
+            return None  # finalized or aborted meanwhile
+        except (OSError, ValueError, KeyError):
+            logging.warning(f"Ignoring unreadable upload session {path}")
+            return None
+        session.refresh()
+        return session
+
+    def create(self, name, size, key=None):
+        """Start a new session, or return the existing one for the same key"""
+        safe_upload_path(self.directory, name)  # validate early
+        if size < 0:
+            raise ValueError("Invalid size")
+        if size > MAX_UPLOAD_SIZE:
+            raise UploadTooLarge(f"File size exceeds {format_file_size(MAX_UPLOAD_SIZE)} limit")
+
+        with self.lock:
+            self._expire()
+            self._load()  # sessions started through another server process
+            if key:
+                for session in self.sessions.values():
+                    if session.key == key and session.name == name and session.size == size:
+                        return session
+            session = UploadSession(self, uuid.uuid4().hex, name, size, key)
+            with open(session.data_path, "wb") as f:
+                # Sparse: blocks are only reserved for chunks that are being sent,
+                # so sessions that never send data take no disk space
+                f.truncate(size)
+            session.save()
+            self.sessions[session.id] = session
+        return session
+
+    def get(self, session_id):
+        if not _ID_RE.match(session_id or ""):
+            raise SessionNotFound(session_id)
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                # May have been created by another server process sharing the folder
+                session = self._read_session(os.path.join(self.session_dir, session_id + ".json"))
+                if session is None:
+                    raise SessionNotFound(session_id)
+                self.sessions[session_id] = session
+        session.refresh()
+        return session
+
+    def finalize(self, session_id):
+        """Move a fully received upload into the shared directory"""
+        session = self.get(session_id)
+        with session.lock:
+            if not session.complete:
+                raise UploadIncomplete("Upload is missing data")
+            path = safe_upload_path(self.directory, session.name)
+            try:
+                if self.durability == "fsync":
+                    with open(session.data_path, "rb") as f:
+                        sync_file(f.fileno(), "fsync")
+                os.replace(session.data_path, path)
+            except FileNotFoundError:
+                raise SessionNotFound(session_id)  # finalized by another process
+            sync_directory(self.directory, self.durability)
+            self._discard(session)
+        with self.lock:
+            self.sessions.pop(session_id, None)
+        return path
+
+    def abort(self, session_id):
+        session = self.get(session_id)
+        with self.lock:
+            self.sessions.pop(session_id, None)
+        self._discard(session)
+
+    def _expire(self):
+        now = time.time()
+        for session in list(self.sessions.values()):
+            if now - session.updated > SESSION_TTL:
+                del self.sessions[session.id]
+                self._discard(session)
+
+    def _discard(self, session):
+        for path in (session.data_path, session.meta_path, session.log_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
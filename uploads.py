@@ -0,0 +1,179 @@
+# uploads.py
+import os
+import errno
+import logging
+import tempfile
+from utils import format_file_size
+
+MAX_UPLOAD_SIZE = 4 * 1024**3  # 4GB per file
+UPLOAD_READ_SIZE = 256 * 1024
+TEMP_PREFIX = ".upload-"  # files still being written; hidden from listings
+DURABILITY_MODES = ("none", "fsync", "periodic")
+DEFAULT_DURABILITY = "none"
+SYNC_INTERVAL = 16 * 1024**2  # "periodic": fdatasync() after this many bytes
+
+# mkstemp() creates files readable by their owner only; finished uploads get
+# the permissions open() would have given them. Read once: umask() can only
+# be queried by changing it, which isn't safe once threads are running.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+class UploadTooLarge(ValueError):
+    """An uploaded file went over MAX_UPLOAD_SIZE"""
+
+def safe_upload_path(directory, filename):
+    """Resolve an uploaded file name to a path directly inside 'directory'"""
+    # Browsers may send "C:\\dir\\name" or "dir/name"; keep only the last component
+    name = os.path.basename(filename.replace('\\', '/')).strip()
+    if name in ('', '.', '..'):
+        raise ValueError(f"Invalid file name: {filename!r}")
+    return os.path.join(directory, name)
+
+def safe_member_path(directory, name):
+    """
+    Resolve a relative path from an uploaded archive to a path under
+    'directory', refusing absolute paths, ".." and anything a symlink
+    in the shared folder would lead outside of it
+    """
+    if name.startswith(('/', '\\')) or (len(name) > 1 and name[1] == ':'):
+        raise ValueError("absolute path")
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if not parts:
+        raise ValueError("empty name")
+    if '..' in parts:
+        raise ValueError("path leads outside the folder")
+    path = os.path.join(directory, *parts)
+    root = os.path.realpath(directory)
+    real_path = os.path.realpath(path)
+    if real_path != root and not real_path.startswith(root + os.sep):
+        raise ValueError("path leads outside the folder")
+    return path
+
+def is_temp_upload(name):
+    return name.startswith(TEMP_PREFIX)
+
+def check_durability(durability):
+    if durability not in DURABILITY_MODES:
+        raise ValueError(f"Unknown durability mode: {durability}")
+    return durability
+
+def create_temp(path):
+    """
+    (fd, temp path) of a new hidden file next to 'path', with the
+    permissions a file created by open() would get
+    """
+    fd, temp_path = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=os.path.dirname(path) or '.')
+    try:
+        os.fchmod(fd, 0o666 & ~_UMASK)
+    except BaseException:
+        os.close(fd)
+        os.remove(temp_path)
+        raise
+    return fd, temp_path
+
+def preallocate(fd, size, offset=0):
+    """
+    Reserve 'size' bytes from 'offset' up front so the file system can lay
+    them out contiguously. Only a full disk is an error; file systems
+    without posix_fallocate() support just skip it.
+    """
+    if size <= 0 or not hasattr(os, 'posix_fallocate'):
+        return
+    try:
+        os.posix_fallocate(fd, offset, size)
+    except OSError as e:
+        if e.errno in (errno.ENOSPC, errno.EDQUOT):
+            raise
+        logging.debug(f"posix_fallocate not supported here: {e}")
+
+def sync_file(fd, durability):
+    """Flush a finished file to disk as 'durability' asks"""
+    if durability == "fsync":
+        os.fsync(fd)
+    elif durability == "periodic":
+        getattr(os, 'fdatasync', os.fsync)(fd)
+
+def sync_directory(path, durability):
+    """Make a rename in the folder 'path' durable (POSIX only)"""
+    if durability == "none" or not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class UploadFile:
+    """
+    Destination for one uploaded file. Data goes to a hidden temporary file
+    next to 'path', which close() renames over 'path' in one step, so
+    readers never see a half-written file and concurrent uploads of the same
+    name don't interleave: the last one to finish wins. Enforces the size
+    limit as data arrives and removes the temporary file if the upload is
+    aborted. 'size_hint' (e.g. from Content-Length) preallocates the file;
+    'durability' is "none", "fsync" (sync once finished) or "periodic"
+    (fdatasync every SYNC_INTERVAL bytes as well, so little dirty data
+    builds up for the final sync).
+    """
+
+    def __init__(self, path, limit=MAX_UPLOAD_SIZE, size_hint=None, durability=DEFAULT_DURABILITY):
+        self.path = path
+        self.limit = limit
+        self.durability = durability
+        self.size = 0
+        self.unsynced = 0
+        fd, self.temp_path = create_temp(path)
+        try:
+            if size_hint:
+                preallocate(fd, min(size_hint, limit) if limit is not None else size_hint)
+            self.file = os.fdopen(fd, 'wb')
+        except BaseException:
+            os.close(fd)
+            os.remove(self.temp_path)
+            raise
+        self.preallocated = size_hint is not None and size_hint > 0
+
+    @property
+    def name(self):
+        return self.path
+
+    @property
+    def closed(self):
+        return self.file.closed
+
+    def write(self, data):
+        self.size += len(data)
+        if self.limit is not None and self.size > self.limit:
+            self.abort()
+            raise UploadTooLarge(f"File size exceeds {format_file_size(self.limit)} limit")
+        self.file.write(data)
+        if self.durability == "periodic":
+            self.unsynced += len(data)
+            if self.unsynced >= SYNC_INTERVAL:
+                self.file.flush()
+                sync_file(self.file.fileno(), "periodic")
+                self.unsynced = 0
+
+    def close(self):
+        """Finish the file and move it into place"""
+        if self.file.closed:
+            return
+        try:
+            self.file.flush()
+            if self.preallocated:
+                self.file.truncate(self.size)  # give back what the hint over-reserved
+            sync_file(self.file.fileno(), self.durability)
+            self.file.close()
+            os.replace(self.temp_path, self.path)
+        except BaseException:
+            self.abort()
+            raise
+        sync_directory(os.path.dirname(self.path) or '.', self.durability)
+
+    def abort(self):
+        if not self.file.closed:
+            self.file.close()
+        try:
+            os.remove(self.temp_path)
+        except FileNotFoundError:
+            pass
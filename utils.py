@@ -1,24 +1,92 @@
 # utils.py
+import re
+import sys
 import socket
+import struct
 import logging
+import functools
+import ipaddress
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+SIOCGIFADDR = 0x8915  # Linux ioctl: an interface's IPv4 address
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+def format_file_size(size):
+    """Convert file size to human-readable format"""
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024.0:
+            return f"{size:.2f} {unit}"
+        size /= 1024.0
+    return f"{size:.2f} TB"
+
+def parse_size(value):
+    """Bytes from "1500", "10K", "2.5G", ..."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", str(value), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid size: {value!r}")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+@functools.lru_cache(maxsize=None)
 def get_local_ip():
-    """Retrieve the local IP address of the machine, even without internet."""
+    """
+    Retrieve the local IP address of the machine, even without internet.
+    Looked up once per process without sending anything: the address of
+    the interface with the default route, else the first private one.
+    """
+    addresses = interface_addresses()
+    preferred = addresses.get(_default_route_interface())
+    if preferred is None:
+        # connect() on a UDP socket only picks a route; no packet is sent
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                s.connect(("8.8.8.8", 80))
+                preferred = s.getsockname()[0]
+        except OSError:
+            pass
+    if preferred is not None and not ipaddress.ip_address(preferred).is_loopback:
+        return preferred
+    for ip in addresses.values():
+        if ipaddress.ip_address(ip).is_private and not ipaddress.ip_address(ip).is_loopback:
+            return ip
+    return "127.0.0.1"
+
+@functools.lru_cache(maxsize=None)
+def interface_addresses():
+    """{interface name: IPv4 address}, asked from the kernel (Linux) or the host name (Windows)"""
+    addresses = {}
+    if fcntl is not None and hasattr(socket, "if_nameindex") and sys.platform.startswith("linux"):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            for _, name in socket.if_nameindex():
+                try:
+                    request = struct.pack("256s", name.encode()[:15])
+                    addresses[name] = socket.inet_ntoa(fcntl.ioctl(s.fileno(), SIOCGIFADDR, request)[20:24])
+                except OSError:
+                    continue  # down, or no IPv4 address
+    elif sys.platform == "win32":
+        # Windows answers this from its own interfaces; elsewhere it may wait on DNS or mDNS
+        try:
+            for info in socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET):
+                addresses.setdefault(info[4][0], info[4][0])
+        except OSError:
+            pass
+    return addresses
+
+def _default_route_interface():
+    """Name of the interface with the IPv4 default route, from /proc/net/route (Linux)"""
     try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        local_ip = s.getsockname()[0]
-        s.close()
-    except Exception:
-        # Fallback: pick the first private IP found or default to 127.0.0.1
-        local_ip = "127.0.0.1"
-        interfaces = socket.getaddrinfo(socket.gethostname(), None)
-        for addr in interfaces:
-            ip = addr[4][0]
-            if ip.startswith(("192.", "10.", "172.")):
-                local_ip = ip
-                break
-    return local_ip
+        with open("/proc/net/route") as f:
+            next(f)  # header
+            for line in f:
+                fields = line.split()
+                if len(fields) > 3 and fields[1] == "00000000" and int(fields[3], 16) & 1:  # RTF_UP
+                    return fields[0]
+    except (OSError, StopIteration, ValueError):
+        pass
+    return None
 
 def test_local_ip(ip):
     """Test if the detected local IP address is reachable by binding a test socket."""